@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+import errno
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from indigo_pl import metrics
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tickets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    resource TEXT NOT NULL,
+    weight INTEGER NOT NULL,
+    pid INTEGER NOT NULL,
+    admitted INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tickets_resource ON tickets (resource, admitted, id);
+"""
+
+_controller = None
+
+
+class AdmissionError(Exception):
+    """ Raised when an import waits for too long to be admitted, e.g. when many editors import
+    huge codes at once. The message is shown to the editor.
+    """
+    pass
+
+
+class AdmissionController(object):
+    """ Host-wide weighted semaphores, capping how much of each resource (e.g. "extraction",
+    i.e. pdftohtml, and "reformat", i.e. ImporterPL.reformat_text()) all the processes of a host
+    use at once. The weight of an import is its page count, which is roughly what its memory
+    grows with.
+
+    Each use of a resource is a ticket in a SQLite file shared by the processes. Tickets are
+    admitted in the order they were queued, while the weights of the admitted ones fit in the
+    capacity of the resource. A ticket heavier than the whole capacity is admitted once nothing
+    else is running. Tickets of processes which are gone (e.g. killed by gunicorn for timing
+    out) are dropped, so the file must be local to the host.
+    """
+
+    POLL_INTERVAL = 0.25
+    """Seconds between checks of a queued ticket. Waiting sleeps, so under gevent other
+    requests of the worker are served in the meantime."""
+
+    MAX_WAIT = 300
+    """Seconds after which a queued ticket gives up, raising AdmissionError."""
+
+    def __init__(self, path, capacities):
+        """
+        Args:
+            path: Path to the SQLite file, created if it doesn't exist.
+            capacities: Map from resources to the total weight which may be admitted at once.
+        """
+        self.path = path
+        self.capacities = capacities
+        db = self.connect()
+        try:
+            db.executescript(SCHEMA)
+        finally:
+            db.close()
+
+    def connect(self):
+        # Transactions are started explicitly, see try_admit().
+        return sqlite3.connect(self.path, timeout=60, isolation_level=None)
+
+    @contextmanager
+    def admit(self, resource, weight):
+        """Waits until the resource can be used with the given weight, and holds it for the
+        duration of the block.
+
+        Args:
+            resource: Name of the resource, one of capacities.
+            weight: Weight of the use, e.g. a page count.
+
+        Yields:
+            float: Seconds spent waiting.
+
+        Raises:
+            AdmissionError: If the ticket wasn't admitted within MAX_WAIT seconds.
+        """
+        start = time.time()
+        ticket = self.enqueue(resource, weight)
+        try:
+            while not self.try_admit(ticket, resource, weight):
+                if time.time() - start > self.MAX_WAIT:
+                    raise AdmissionError(u"Too many documents are being imported right now, "
+                                         u"please try again in a few minutes.")
+                time.sleep(self.POLL_INTERVAL)
+            waited = time.time() - start
+            metrics.ADMISSION_WAIT.observe(waited, resource=resource)
+            yield waited
+        finally:
+            self.release(ticket)
+
+    def enqueue(self, resource, weight):
+        """Queues a ticket, returning its id."""
+        db = self.connect()
+        try:
+            return db.execute("INSERT INTO tickets (resource, weight, pid, created) "
+                              "VALUES (?, ?, ?, ?)",
+                              (resource, weight, os.getpid(), time.time())).lastrowid
+        finally:
+            db.close()
+
+    def try_admit(self, ticket, resource, weight):
+        """Admits the ticket if it's the first one queued for the resource, and its weight fits.
+
+        Returns:
+            bool: Whether the ticket is admitted.
+        """
+        db = self.connect()
+        try:
+            # Only one process at a time looks at the queue and admits a ticket.
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                self.drop_orphans(db)
+                first, = db.execute("SELECT MIN(id) FROM tickets WHERE resource = ? AND "
+                                    "admitted = 0", (resource,)).fetchone()
+                running, = db.execute("SELECT COALESCE(SUM(weight), 0) FROM tickets "
+                                      "WHERE resource = ? AND admitted = 1",
+                                      (resource,)).fetchone()
+                admitted = (first == ticket and (
+                    not running or running + weight <= self.capacities[resource]))
+                if admitted:
+                    db.execute("UPDATE tickets SET admitted = 1 WHERE id = ?", (ticket,))
+                db.execute("COMMIT")
+            except:
+                db.execute("ROLLBACK")
+                raise
+            return admitted
+        finally:
+            db.close()
+
+    def drop_orphans(self, db):
+        """Removes the tickets of processes which are gone."""
+        for pid, in db.execute("SELECT DISTINCT pid FROM tickets").fetchall():
+            if not pid_exists(pid):
+                db.execute("DELETE FROM tickets WHERE pid = ?", (pid,))
+
+    def release(self, ticket):
+        db = self.connect()
+        try:
+            db.execute("DELETE FROM tickets WHERE id = ?", (ticket,))
+        finally:
+            db.close()
+
+    def queue(self):
+        """Returns the state of the queues, as a map from resources to dicts with the number of
+        "waiting" and "running" tickets, and the "running_weight"."""
+        db = self.connect()
+        try:
+            state = dict((resource, {"waiting": 0, "running": 0, "running_weight": 0})
+                         for resource in self.capacities)
+            for resource, admitted, count, weight in db.execute(
+                    "SELECT resource, admitted, COUNT(*), SUM(weight) FROM tickets "
+                    "GROUP BY resource, admitted"):
+                counts = state.setdefault(resource, {"waiting": 0, "running": 0,
+                                                     "running_weight": 0})
+                if admitted:
+                    counts["running"] = count
+                    counts["running_weight"] = weight
+                else:
+                    counts["waiting"] = count
+            return state
+        finally:
+            db.close()
+
+
+def pid_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno != errno.ESRCH
+    return True
+
+
+def configure(path, capacities):
+    """Starts admitting the resources through the AdmissionController at the path, and exposes
+    its queues in metrics. Until this is called, everything is admitted straight away."""
+    global _controller
+    _controller = AdmissionController(path, capacities)
+    metrics.ADMISSION_QUEUE.set_function(queue_samples)
+
+
+@contextmanager
+def admit(resource, weight):
+    """AdmissionController.admit() of the configured controller, if any."""
+    if _controller is None:
+        yield 0
+        return
+    with _controller.admit(resource, weight) as waited:
+        yield waited
+
+
+def queue_samples():
+    samples = {}
+    for resource, counts in _controller.queue().iteritems():
+        for state, value in counts.iteritems():
+            samples[(("resource", resource), ("state", state))] = value
+    return samples
@@ -6,6 +6,27 @@ class IndigoPLAppConfig(AppConfig):
     verbose_name = 'Indigo Poland'
 
     def ready(self):
-        # ensure our plugins are pulled in
-        import indigo_pl.importer  # noqa
-        import indigo_pl.toc  # noqa
+        # ensure our plugins are registered; their modules are only imported on first use,
+        # unless they should be shared by preloaded workers
+        from django.conf import settings
+        from indigo_pl import admission, isolation, metrics, plugins
+
+        if settings.INDIGO_PL_PRELOAD_PLUGINS:
+            plugins.load_all()
+        # metrics are recorded by every process, into a directory they share
+        if settings.INDIGO_PL_METRICS_DIR:
+            metrics.configure(settings.INDIGO_PL_METRICS_DIR)
+        # PDF conversions and imports wait for their turn among the ones of the host
+        if settings.INDIGO_PL_ADMISSION_DB:
+            admission.configure(settings.INDIGO_PL_ADMISSION_DB, {
+                "extraction": settings.INDIGO_PL_MAX_EXTRACTION_PAGES,
+                "reformat": settings.INDIGO_PL_MAX_REFORMAT_PAGES,
+            })
+        # and run in worker processes which can't take the web workers down with them
+        if settings.INDIGO_PL_IMPORT_WORKERS:
+            isolation.configure(settings.INDIGO_PL_IMPORT_WORKER_MAX_MEMORY,
+                                settings.INDIGO_PL_IMPORT_WORKER_MAX_CPU,
+                                settings.INDIGO_PL_IMPORT_WORKER_MAX_IMPORTS,
+                                settings.INDIGO_PL_IMPORT_WORKER_TIMEOUT)
+        # and our signal handlers are connected
+        import indigo_pl.signals  # noqa
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import sqlite3
+import zlib
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    hash BLOB PRIMARY KEY,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS artifacts (
+    work TEXT NOT NULL,
+    version TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    chunks BLOB NOT NULL,
+    PRIMARY KEY (work, version, stage)
+);
+"""
+
+DIGEST_SIZE = 20
+"""Size of the SHA-1 digest identifying a chunk."""
+
+
+class ArtifactStore(object):
+    """ Local content-addressed store for the intermediates of imports, e.g. the raw pdftohtml
+    XML, the XML without outgoing and upcoming section markers and the reformatted text.
+
+    Artifacts are split into chunks on line boundaries chosen by the content (a line ends a
+    chunk if its checksum has the lowest CHUNK_MASK bits unset), so the same run of lines is
+    split in the same way wherever it is in a document. Consecutive versions of an act share
+    most of their pages, and thus most of their chunks, which are stored only once, compressed.
+
+    Everything is kept in a single SQLite file, indexed by (work, version, stage), so getting an
+    artifact is one lookup for its list of chunks and one lookup per chunk.
+    """
+
+    STAGES = ("raw", "stripped", "text", "akn")
+    """Names of the artifacts of an import, in the order they're produced."""
+
+    CHUNK_MIN_SIZE = 4 * 1024
+    """Chunks are never cut before they have this many bytes."""
+
+    CHUNK_MAX_SIZE = 256 * 1024
+    """Chunks are always cut once they have this many bytes, even in the middle of a line."""
+
+    CHUNK_MASK = 0x3f
+    """Mask of the line checksum bits which must be all unset for the line to end a chunk, so on
+    average every 64th line (past CHUNK_MIN_SIZE) ends one."""
+
+    COMPRESSION_LEVEL = 6
+    """zlib compression level of the chunks."""
+
+    def __init__(self, path):
+        """
+        Args:
+            path: Path to the SQLite file, created if it doesn't exist.
+        """
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.text_factory = str
+        self.db.executescript(SCHEMA)
+
+    def put(self, work, version, stage, data):
+        """Stores an artifact, replacing the one with the same key, if any.
+
+        Args:
+            work: Key of the work, e.g. "dzu-2016-1579".
+            version: Key of the version of the work, e.g. the fingerprint of the PDF.
+            stage: Name of the artifact, e.g. one of STAGES.
+            data: The content, as a string, or as an iterable of strings which is consumed
+                piece by piece. Unicode is stored as UTF-8.
+
+        Returns:
+            str: SHA-1 of the content, as hex.
+        """
+        if isinstance(data, basestring):
+            data = [data]
+        digest = hashlib.sha1()
+        size = 0
+        hashes = []
+        with self.db:
+            for chunk in self.iter_chunks(data):
+                digest.update(chunk)
+                size += len(chunk)
+                chunk_hash = hashlib.sha1(chunk).digest()
+                hashes.append(chunk_hash)
+                if self.db.execute("SELECT 1 FROM chunks WHERE hash = ?",
+                                   (buffer(chunk_hash),)).fetchone() is None:
+                    self.db.execute("INSERT INTO chunks (hash, data) VALUES (?, ?)",
+                                    (buffer(chunk_hash),
+                                     buffer(zlib.compress(chunk, self.COMPRESSION_LEVEL))))
+            self.db.execute("INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?, ?)",
+                            (work, version, stage, digest.hexdigest(), size,
+                             buffer(b"".join(hashes))))
+        return digest.hexdigest()
+
+    def iter_chunks(self, pieces):
+        """Splits the content given as an iterable of strings into chunks (see the class
+        docstring).
+
+        Yields:
+            str: Consecutive chunks.
+        """
+        chunk = []
+        chunk_size = 0
+        rest = b""
+        for piece in pieces:
+            if isinstance(piece, unicode):
+                piece = piece.encode('utf-8')
+            lines = (rest + piece).split(b"\n")
+            rest = lines.pop()
+            for line in lines:
+                chunk.append(line)
+                chunk.append(b"\n")
+                chunk_size += len(line) + 1
+                if chunk_size >= self.CHUNK_MAX_SIZE or (
+                        chunk_size >= self.CHUNK_MIN_SIZE
+                        and not (zlib.crc32(line) & self.CHUNK_MASK)):
+                    yield b"".join(chunk)
+                    chunk = []
+                    chunk_size = 0
+            while len(rest) >= self.CHUNK_MAX_SIZE:
+                yield b"".join(chunk) + rest[:self.CHUNK_MAX_SIZE - chunk_size]
+                rest = rest[self.CHUNK_MAX_SIZE - chunk_size:]
+                chunk = []
+                chunk_size = 0
+        if chunk or rest:
+            yield b"".join(chunk) + rest
+
+    def get(self, work, version, stage):
+        """Returns the artifact as a (byte) string, or None if there's no such artifact."""
+        if not self.exists(work, version, stage):
+            return None
+        return b"".join(self.iter_artifact(work, version, stage))
+
+    def iter_artifact(self, work, version, stage):
+        """Yields the chunks of the artifact, decompressed one at a time, so that even the
+        largest artifacts can be streamed.
+
+        Raises:
+            KeyError: If there's no such artifact.
+        """
+        row = self.db.execute("SELECT chunks FROM artifacts WHERE work = ? AND version = ? "
+                              "AND stage = ?", (work, version, stage)).fetchone()
+        if row is None:
+            raise KeyError((work, version, stage))
+        hashes = bytes(row[0])
+        for i in xrange(0, len(hashes), DIGEST_SIZE):
+            data = self.db.execute("SELECT data FROM chunks WHERE hash = ?",
+                                   (buffer(hashes[i:i + DIGEST_SIZE]),)).fetchone()[0]
+            yield zlib.decompress(bytes(data))
+
+    def exists(self, work, version, stage):
+        return self.db.execute("SELECT 1 FROM artifacts WHERE work = ? AND version = ? "
+                               "AND stage = ?", (work, version, stage)).fetchone() is not None
+
+    def versions(self, work):
+        """Returns the sorted list of versions of the work which have any artifacts."""
+        return [row[0] for row in self.db.execute(
+            "SELECT DISTINCT version FROM artifacts WHERE work = ? ORDER BY version", (work,))]
+
+    def stages(self, work, version):
+        """Returns the list of stages stored for the version of the work, in order of STAGES."""
+        stages = [row[0] for row in self.db.execute(
+            "SELECT stage FROM artifacts WHERE work = ? AND version = ?", (work, version))]
+        return sorted(stages, key=lambda s: (self.STAGES.index(s) if s in self.STAGES
+                                             else len(self.STAGES), s))
+
+    def delete(self, work, version=None):
+        """Deletes all the artifacts of the work, or of one of its versions, together with the
+        chunks no other artifact uses.
+        """
+        with self.db:
+            if version is None:
+                self.db.execute("DELETE FROM artifacts WHERE work = ?", (work,))
+            else:
+                self.db.execute("DELETE FROM artifacts WHERE work = ? AND version = ?",
+                                (work, version))
+            self.collect_garbage()
+
+    def collect_garbage(self):
+        used = set()
+        for row in self.db.execute("SELECT chunks FROM artifacts"):
+            hashes = bytes(row[0])
+            used.update(hashes[i:i + DIGEST_SIZE] for i in xrange(0, len(hashes), DIGEST_SIZE))
+        unused = [row[0] for row in self.db.execute("SELECT hash FROM chunks")
+                  if bytes(row[0]) not in used]
+        self.db.executemany("DELETE FROM chunks WHERE hash = ?", [(h,) for h in unused])
+
+    def stats(self):
+        """Returns a dict with "artifacts" (count), "size" (total size of the artifacts) and
+        "stored_size" (total size of the compressed chunks, i.e. what the store takes).
+        """
+        count, size = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) "
+                                      "FROM artifacts").fetchone()
+        stored_size = self.db.execute("SELECT COALESCE(SUM(LENGTH(data)), 0) "
+                                      "FROM chunks").fetchone()[0]
+        return {"artifacts": count, "size": size, "stored_size": stored_size}
+
+    def close(self):
+        self.db.close()
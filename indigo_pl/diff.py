@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+import re
+from collections import OrderedDict, namedtuple
+from difflib import SequenceMatcher
+
+from lxml import etree
+
+UNIT_ELEMENTS = {'part', 'book', 'title', 'division', 'chapter', 'subdivision', 'section',
+                 'article', 'paragraph', 'point', 'indent', 'subparagraph', 'alinea'}
+"""Akoma Ntoso elements which are units of the hierarchy of an act."""
+
+UNIT_PREFIXES = {
+    'article': 'art',
+    'chapter': 'rozdzial',
+    'division': 'dzial',
+    'indent': 'tir',
+    'paragraph': 'ust',
+    'point': 'pkt',
+    'section': 'par',
+    'subdivision': 'oddzial',
+}
+"""Path segment prefixes of units without an id, e.g. "art" in "art-5"."""
+
+IGNORED_ELEMENTS = {'meta', 'num'}
+"""Elements which don't count towards the content of a unit. The number is part of its path."""
+
+QUOTED_ELEMENTS = {'quotedStructure', 'embeddedStructure'}
+"""Elements whose units (e.g. articles quoted by an amending act) are part of the content of
+the unit they're in, rather than units of the act."""
+
+WHITESPACE_RE = re.compile(r"\s+", re.UNICODE)
+
+
+class Unit(namedtuple('Unit', 'path id type num hash text')):
+    """ A single unit of an act, with its AKN id (None if it doesn't have one) and the
+    fingerprint of its own content, i.e. without the content of the units inside it.
+    """
+    __slots__ = ()
+
+
+def local_name(elem):
+    return elem.tag.rpartition('}')[2]
+
+
+def unit_fingerprints(xml):
+    """Fingerprints all the units of an act, in a single walk over the parsed XML. The text of
+    each element goes to the innermost unit it's in.
+
+    Args:
+        xml: String with the Akoma Ntoso XML of the document.
+
+    Returns:
+        OrderedDict: Map from unit paths (e.g. "art-112aa/ust-1/pkt-2") to Unit tuples, in
+            document order.
+    """
+    if not isinstance(xml, bytes):
+        xml = xml.encode('utf-8')
+    root = etree.fromstring(xml, parser=etree.XMLParser(remove_comments=True))
+    units = OrderedDict()
+    names = {}
+    # Stack of [path, id, type, num, list of text pieces] of the open units, the first one
+    # standing for the text outside any unit.
+    stack = [['', None, None, None, []]]
+    # Depth in ignored elements, and in quoted ones, where units don't count as units.
+    ignored = 0
+    quoted = 0
+    for event, elem in etree.iterwalk(root, events=('start', 'end')):
+        tag = names.get(elem.tag)
+        if tag is None:
+            tag = names[elem.tag] = local_name(elem)
+        if event == 'start':
+            if ignored:
+                ignored += 1
+                continue
+            if tag in IGNORED_ELEMENTS:
+                ignored = 1
+                continue
+            if tag in QUOTED_ELEMENTS:
+                quoted += 1
+            elif tag in UNIT_ELEMENTS and not quoted:
+                num = unit_num(elem)
+                path = stack[-1][0]
+                path = unique_path(units, (path + '/' if path else '')
+                                   + path_segment(elem, tag, num))
+                # Reserve the place in document order.
+                units[path] = None
+                stack.append([path, elem.get('id'), tag, num, []])
+            if elem.text:
+                stack[-1][4].append(elem.text)
+            continue
+
+        if ignored:
+            ignored -= 1
+        elif tag in QUOTED_ELEMENTS:
+            quoted -= 1
+        elif tag in UNIT_ELEMENTS and not quoted:
+            path, id_, type_, num, pieces = stack.pop()
+            text = WHITESPACE_RE.sub(' ', ''.join(pieces)).strip()
+            units[path] = Unit(path, id_, type_, num,
+                               hashlib.sha1(text.encode('utf-8')).digest(), text)
+        if elem.tail and not ignored:
+            stack[-1][4].append(elem.tail)
+    return units
+
+
+def path_segment(elem, tag, num):
+    """Returns the path segment of a unit: the last part of its id (e.g. "pkt-2" for
+    "art-112aa.ust-1.pkt-2") or, if it doesn't have one, its type and number.
+    """
+    id_ = elem.get('id')
+    if id_:
+        return id_.rpartition('.')[2]
+    prefix = UNIT_PREFIXES.get(tag, tag)
+    return '%s-%s' % (prefix, num) if num else prefix
+
+
+def unit_num(elem):
+    """Returns the normalized number of a unit, e.g. "5a" for "5a.", or None."""
+    for child in elem.iterchildren('{*}num'):
+        num = ''.join(child.itertext())
+        return WHITESPACE_RE.sub('', num).rstrip('.)').lower() or None
+    return None
+
+
+def unique_path(units, path):
+    """Makes the path unique, as some acts have units with the same number (e.g. repealed
+    ones), by adding "#2", "#3" and so on to the next ones.
+    """
+    if path not in units:
+        return path
+    i = 2
+    while '%s#%d' % (path, i) in units:
+        i += 1
+    return '%s#%d' % (path, i)
+
+
+def diff_units(old, new):
+    """Compares the units of two versions of an act. Units are aligned by their paths and
+    then, for the ones left over, by their fingerprints, so a unit which only got renumbered is
+    reported as moved, not as removed and added.
+
+    Args:
+        old: Units of the older version, as returned by unit_fingerprints().
+        new: Units of the newer version, as returned by unit_fingerprints().
+
+    Returns:
+        dict: With "added", "removed", "changed" and "moved" lists, in document order, and
+            "unchanged" count.
+    """
+    # Units of the old version whose paths are gone, by fingerprint.
+    gone = OrderedDict()
+    for path, unit in old.iteritems():
+        if path not in new:
+            gone.setdefault(unit.hash, []).append(path)
+
+    result = {'added': [], 'removed': [], 'changed': [], 'moved': [], 'unchanged': 0}
+    for path, unit in new.iteritems():
+        old_unit = old.get(path)
+        if old_unit is not None:
+            if old_unit.hash == unit.hash:
+                result['unchanged'] += 1
+            else:
+                result['changed'].append({
+                    'path': path,
+                    'type': unit.type,
+                    'diff': word_diff(old_unit.text, unit.text),
+                })
+        elif gone.get(unit.hash) and unit.text:
+            result['moved'].append({'from': gone[unit.hash].pop(0), 'to': path})
+        else:
+            result['added'].append({'path': path, 'type': unit.type, 'text': unit.text})
+
+    moved = set(m['from'] for m in result['moved'])
+    result['removed'] = [{'path': path, 'type': unit.type, 'text': unit.text}
+                         for path, unit in old.iteritems()
+                         if path not in new and path not in moved]
+    return result
+
+
+def word_diff(old_text, new_text):
+    """Returns the word level diff of two texts, as a list of dicts with "op" ("equal",
+    "insert", "delete" or "replace"), "old" and "new" text.
+    """
+    old_words = old_text.split(' ')
+    new_words = new_text.split(' ')
+    matcher = SequenceMatcher(None, old_words, new_words, autojunk=False)
+    return [{
+        'op': op,
+        'old': ' '.join(old_words[i1:i2]),
+        'new': ' '.join(new_words[j1:j2]),
+    } for op, i1, i2, j1, j2 in matcher.get_opcodes()]
+
+
+def diff_documents(old_xml, new_xml):
+    """Compares two versions of an act, given as Akoma Ntoso XML. See diff_units()."""
+    return diff_units(unit_fingerprints(old_xml), unit_fingerprints(new_xml))
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+import re
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import date
+
+MONTHS = {u"stycznia": 1, u"lutego": 2, u"marca": 3, u"kwietnia": 4, u"maja": 5, u"czerwca": 6,
+          u"lipca": 7, u"sierpnia": 8, u"września": 9, u"października": 10, u"listopada": 11,
+          u"grudnia": 12}
+"""Polish month names, as in dates ("1 stycznia 2020 r."), mapped to their numbers."""
+
+EFFECTIVE_DATE_RE = re.compile(u"w(?:chodzi|ejdzie) w życie z dniem (\\d{1,2}) (\\w+) (\\d{4})",
+                               re.UNICODE)
+"""Regex catching the date on which an amending act comes into force, in a footnote of a unified
+text, e.g. "która wchodzi w życie z dniem 1 stycznia 2020 r."."""
+
+FOOTNOTE_RE = re.compile(r"^\s*(\d+)\)(.*)$", re.DOTALL)
+"""Regex catching a footnote marker, e.g. "12)", or the beginning of a footnote, with its number
+and the rest of the text."""
+
+
+class ExpressionMaterializer(object):
+    """ Produces the text of an act as in force at given dates, from a single conversion of its
+    unified text.
+
+    ISAP unified texts have both the outgoing and the upcoming versions of the parts of an act
+    which change on some future date (see ImporterPL.find_alternatives()). Given the dates on
+    which the upcoming versions come into force, each date has its own set of versions in force,
+    and the text for it is produced by running the raw XML through ImporterPL.reformat_text()
+    with only those versions left. Dates with the same set of versions in force share the text,
+    which is produced only once.
+
+    The dates are taken from the footnotes of the unified text (see find_effective_dates()),
+    unless they're given.
+    """
+
+    def __init__(self, importer, text, effective_dates=None):
+        """
+        Args:
+            importer: The ImporterPL to reformat the text with.
+            text: String containing XML produced by ImporterPL.pdf_to_text().
+            effective_dates: Map from indexes of the alternatives to the dates their upcoming
+                versions come into force, or None to find them in the text. Upcoming versions
+                without a date are never in force.
+        """
+        self.importer = importer
+        self.text = text
+        self.alternatives = importer.find_alternatives(text)
+        if effective_dates is None:
+            effective_dates = find_effective_dates(importer, text, self.alternatives)
+        self.effective_dates = dict(effective_dates)
+        self.cache = {}
+
+    def in_force(self, date):
+        """Returns the frozenset of indexes of the alternatives whose upcoming version is in
+        force on the date."""
+        return frozenset(i for i, effective_date in self.effective_dates.iteritems()
+                         if effective_date is not None and effective_date <= date)
+
+    def text_at(self, date):
+        """Returns the plain text of the act as in force on the date."""
+        key = self.in_force(date)
+        text = self.cache.get(key)
+        if text is None:
+            text = self.cache[key] = self.reformat(key)
+            self.importer.store_artifact("text@" + date.isoformat(), text)
+        return text
+
+    def reformat(self, upcoming_in_force):
+        importer = self.importer
+        # The "text" artifact is the one with both versions, so it's not overwritten.
+        artifact_store = importer.artifact_store
+        importer.upcoming_in_force = upcoming_in_force
+        importer.artifact_store = None
+        try:
+            return importer.reformat_text(self.text)
+        finally:
+            importer.upcoming_in_force = None
+            importer.artifact_store = artifact_store
+
+    def expressions(self, date):
+        """Returns the texts of the act from the date on: the one in force on the date, and one
+        for each later date on which some upcoming version comes into force.
+
+        Args:
+            date: The first date, e.g. today.
+
+        Returns:
+            OrderedDict: Map from dates to the texts in force from then on, in order.
+        """
+        dates = [date] + sorted(set(d for d in self.effective_dates.itervalues()
+                                    if d is not None and d > date))
+        return OrderedDict((d, self.text_at(d)) for d in dates)
+
+
+def find_effective_dates(importer, text, alternatives):
+    """Finds the dates on which the upcoming versions of the alternatives come into force in the
+    footnotes of the unified text. ISAP puts a footnote marker, e.g. "12)" in a smaller font,
+    right after each version, and the footnote says when the act which made the change comes
+    into force, e.g. "12) Dodany przez art. 1 pkt 2 ustawy z dnia 9 listopada 2018 r. (Dz. U.
+    poz. 2244), która wchodzi w życie z dniem 1 stycznia 2020 r.".
+
+    Args:
+        importer: The ImporterPL, whose regexes are used to read the raw XML.
+        text: String containing XML produced by ImporterPL.pdf_to_text().
+        alternatives: List of Alternatives found in the text.
+
+    Returns:
+        dict: Map from indexes of the alternatives to the dates, for the ones with a footnote
+            giving a date.
+    """
+    fontsizes = {}
+    for match in importer.FONTSPEC_RE.finditer(text):
+        attrs = dict(importer.ATTRIBUTE_RE.findall(match.group(1)))
+        fontsizes[attrs.get("id")] = int(attrs.get("size", 0))
+    # (start, fontsize, text) of the nodes with any text, in order.
+    nodes = []
+    counts = {}
+    for match in importer.TEXT_NODE_RE.finditer(text):
+        content = importer.TAG_RE.sub("", match.group(2))
+        if not isinstance(content, unicode):
+            # MappedText.
+            content = content.decode("utf-8")
+        if not content.strip():
+            continue
+        attrs = dict(importer.ATTRIBUTE_RE.findall(match.group(1)))
+        fontsize = fontsizes.get(attrs.get("font"))
+        counts[fontsize] = counts.get(fontsize, 0) + 1
+        nodes.append((match.start(), fontsize, content))
+    if not nodes:
+        return {}
+    law_fontsize = max(counts, key=counts.get)
+
+    # Footnotes are runs of nodes in a smaller font, starting with their number.
+    footnotes = {}
+    number = None
+    for _, fontsize, content in nodes:
+        match = FOOTNOTE_RE.match(content)
+        if fontsize >= law_fontsize:
+            number = None
+        elif match:
+            number = int(match.group(1))
+            footnotes[number] = match.group(2)
+        elif number is not None:
+            footnotes[number] += u" " + content
+    footnote_dates = {}
+    for number, content in footnotes.iteritems():
+        match = EFFECTIVE_DATE_RE.search(u" ".join(content.split()))
+        if match and match.group(2) in MONTHS:
+            footnote_dates[number] = date(int(match.group(3)), MONTHS[match.group(2)],
+                                          int(match.group(1)))
+
+    starts = [start for start, _, _ in nodes]
+
+    def marker_after(section):
+        # The first marker after the version, before the law text goes on, or else the last
+        # one inside it.
+        markers = []
+        for start, fontsize, content in nodes[bisect_left(starts, section.text_start):]:
+            if start >= section.end and fontsize >= law_fontsize:
+                break
+            match = FOOTNOTE_RE.match(content)
+            if fontsize < law_fontsize and match and not match.group(2).strip():
+                if start >= section.end:
+                    return int(match.group(1))
+                markers.append(int(match.group(1)))
+        return markers[-1] if markers else None
+
+    dates = {}
+    for i, alternative in enumerate(alternatives):
+        for section in filter(None, (alternative.upcoming, alternative.outgoing)):
+            effective_date = footnote_dates.get(marker_after(section))
+            if effective_date is not None:
+                dates[i] = effective_date
+                break
+    return dates
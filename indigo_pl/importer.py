@@ -1,13 +1,143 @@
 # -*- coding: utf-8 -*-
+import logging
+import os
 import re
+import shutil
+import tempfile
+import time
+from bisect import bisect_right
+from collections import namedtuple
+from contextlib import contextmanager
+from multiprocessing import Pool, current_process
 
 from bs4 import BeautifulSoup
 from indigo_api.importers.base import Importer
-from indigo.plugins import plugins
+from indigo_pl import admission, isolation, metrics
+from indigo_pl.pagebuffer import MappedText, PageBuffer
+from indigo_pl.preflight import PDFPreflight
 from platform import node
 
+log = logging.getLogger(__name__)
+
+
+class LayoutStats(object):
+    """ Document-wide statistics of the PDF layout, gathered by ImporterPL.compute_layout_stats()
+    in a cheap first pass over the raw XML, for import modes which never have the whole document
+    parsed in memory.
+    """
+
+    def __init__(self):
+        self.fontsizes = {}
+        """Map from font id to font size, taken from <fontspec> nodes."""
+
+        self.font_counts = {}
+        """Map from font id to the number of <text> nodes using it."""
+
+        self.height_counts = {}
+        """Map from "height" attribute to the number of <text> nodes having it."""
+
+        self.line_start_lefts = {}
+        """Map from font size to a map from "left" attribute of nodes starting a line to the
+        number of such nodes."""
+
+        self.page_count = 0
+        """Number of pages in the document."""
+
+        self.has_specific_phrases = False
+        """Whether the document may contain a phrase from ImporterPL.SPECIFIC_PHRASES_TO_REMOVE."""
+
+        self.indent_profile = None
+        """The IndentProfile of the document, cached once found by
+        ImporterPL.get_all_indent_levels()."""
+
+    @property
+    def most_common_fontsize(self):
+        fontsize_counts = {}
+        for font, count in self.font_counts.items():
+            fontsize = int(self.fontsizes.get(font, ImporterPL.NO_FONTSIZE))
+            fontsize_counts[fontsize] = fontsize_counts.get(fontsize, 0) + count
+        most_common_fontsize = max(fontsize_counts, key = fontsize_counts.get)
+        if (most_common_fontsize == ImporterPL.NO_FONTSIZE):
+            raise Exception("Most common fontsize in the PDF can't be the marker for no font size.")
+        return most_common_fontsize
+
+    @property
+    def most_common_height(self):
+        most_common_height = max(self.height_counts, key = self.height_counts.get)
+        if (most_common_height == ImporterPL.NO_HEIGHT):
+            raise Exception("Most common height in the PDF can't be the marker for no height.")
+        return most_common_height
+
+
+class IndentProfile(list):
+    """ Increasing list of the indent levels (values of the "left" attribute) of a document,
+    together with a lookup table for finding the indent level of any "left" value in
+    logarithmic time (see ImporterPL.get_indent_level()).
+    """
+
+    def __init__(self, levels, tolerance, source = None):
+        """
+        Args:
+            levels: Increasing list of indent levels.
+            tolerance: How far "left" may be from an indent level and still match it.
+            source: Where the levels come from, e.g. "INDENT_LEVELS1" or "inferred".
+        """
+        super(IndentProfile, self).__init__(levels)
+        self.source = source
+        # The ranges of "left" values matching each level, as two sorted lists. When ranges of
+        # neighboring levels overlap, the lower level wins.
+        self.starts = []
+        self.ends = []
+        for level in levels:
+            start = level - tolerance + 1
+            if self.ends and start <= self.ends[-1]:
+                start = self.ends[-1] + 1
+            self.starts.append(start)
+            self.ends.append(level + tolerance - 1)
+
+    def level_of(self, left):
+        """Returns the index of the indent level matching the given "left" value, or None."""
+        idx = bisect_right(self.starts, left) - 1
+        if idx >= 0 and left <= self.ends[idx]:
+            return idx
+        return None
+
+
+class Alternative(namedtuple('Alternative', 'outgoing upcoming')):
+    """ A place in a unified text where the text changes on some date: the outgoing version,
+    which is in force until then, and the upcoming one, which replaces it. Either may be None,
+    e.g. for an article which is only added. Each version is a Section.
+    """
+    __slots__ = ()
+
+
+class Section(namedtuple('Section', 'start end text_start text_end')):
+    """ Span of an outgoing or upcoming version in the raw XML: from the start of its opening
+    marker to the end of its closing one, and (text_start, text_end) between the markers.
+    """
+    __slots__ = ()
+
+
+class PageChunk(namedtuple('PageChunk', 'head joined_head rest first_node last_node '
+                                         'last_line_start ends_in_formula last_text '
+                                         'reordered_nodes')):
+    """ Text of one or more pages, as returned by ImporterPL.reformat_pages(): the text of the
+    first node (head) and of the other ones (rest), and the nodes at the edges, as strings.
+
+    If the first node starts with a dash, it may have to be joined to the previous page: it's
+    then first_node, and joined_head is its text without the dash. last_node and
+    last_line_start are as in the state of join_dash_lines(). Pages without text have head
+    None, and pages ending inside a formula have ends_in_formula set, and nothing else.
+    reordered_nodes is as in the diagnostics of sort_text_nodes_in_reading_order().
+    """
+    __slots__ = ()
+
+    def size(self):
+        """Returns the number of characters of the text and nodes, i.e. roughly what it takes
+        to send the chunk back from a worker process."""
+        return sum(len(field) for field in self if isinstance(field, basestring))
+
 
-@plugins.register('importer')
 class ImporterPL(Importer):
     """ Importer for the Polish tradition.
 
@@ -76,6 +206,37 @@ class ImporterPL(Importer):
        3. The text we want to insert instead of the phrase to delete.
     """
 
+    REGION_LINE_TOLERANCE = 3
+    """How much the "top" attribute of nodes may differ for them to still be considered to be on
+    the same line, when looking for tables and formulas."""
+
+    TABLE_COLUMN_GAP = 20
+    """Minimum horizontal gap between two nodes on the same line for them to be considered to be
+    in different table columns."""
+
+    TABLE_MIN_COLUMNS = 3
+    """Minimum number of columns in a line for it to be considered a table row."""
+
+    TABLE_MIN_ROWS = 3
+    """Minimum number of consecutive, aligned table rows for them to be considered a table."""
+
+    FORMULA_PITCH_TOLERANCE = 3
+    """How much the vertical distance between two lines may differ from the most common one for
+    it to still be considered normal spacing of the law text."""
+
+    FORMULA_SYMBOLS_RE = re.compile(u"[=×÷·∙∑Σ√∫≤≥]")
+    """Regex catching a mathematical symbol which law text doesn't use, but formulas do."""
+
+    FOOTNOTE_MARKER_RE = re.compile(r"^\s*\d+\)\s*$")
+    """Regex catching the text of a footnote marker, e.g. "1)", which is in a smaller font like
+    sub- and superscripts of formulas, but doesn't make a formula."""
+
+    TABLE_REPLACEMENT = u"(sprawdź tabelę w tekście oficjalnym)"
+    """The text we insert instead of a table we removed."""
+
+    FORMULA_REPLACEMENT = u"(sprawdź wzór w tekście oficjalnym)"
+    """The text we insert instead of a formula we removed."""
+
     SIGNATURE_REGEX = '^\s*(Dz\.U\.|M\.P\.)\s+\d{4}\s+(Nr\s+\d+\s+)?poz\.\s+\d+\s*$'
     """Regex catching line containing only the law signature, e.g. "Dz.U. 2018 poz. 1234"."""
 
@@ -143,63 +304,957 @@ class ImporterPL(Importer):
     http://isap.sejm.gov.pl/isap.nsf/download.xsp/WDU19890300163/U/D19890163Lj.pdf
     """
 
+    KNOWN_INDENT_PROFILES = ["INDENT_LEVELS1", "INDENT_LEVELS2", "INDENT_LEVELS3",
+                             "INDENT_LEVELS4"]
+    """Names of the indent level lists above. A document whose leftmost line starts at the first
+    level of one of them is assumed to use it."""
+
+    INDENT_TOLERANCE = 13
+    """How far (exclusive) "left" attribute may be from an indent level and still match it. See
+    get_indent_level()."""
+
+    INDENT_STEP = 32
+    """Typical distance between consecutive indent levels, used when inferring indent levels of
+    documents not matching any of the known ones."""
+
+    INDENT_MAX_LEVELS = 6
+    """Maximal number of indent levels inferred for a document."""
+
+    INDENT_CLUSTER_GAP = 6
+    """Maximal distance between "left" values of line starts clustered into the same peak of the
+    histogram, when inferring indent levels."""
+
+    INDENT_PEAK_MIN_SHARE = 0.01
+    """Minimal share of all line starts which a peak of the histogram must have to become an
+    inferred indent level. Smaller peaks are considered noise."""
+
+    IMPORT_MODE = "in-memory"
+    """How reformat_text() processes the document:
+    - "in-memory": each stage works on the whole document at once.
+    - "windowed": global statistics are gathered by a cheap first pass over the raw XML, and then
+      the pages are streamed through the stages with only a few adjacent pages in memory, so that
+      peak memory doesn't grow with the page count. See iter_reformatted_text_windowed().
+    - "parallel": as "windowed", but pages are turned into text in a pool of worker processes,
+      many at a time. See iter_reformatted_text_parallel().
+    """
+
+    PDF_OUTPUT = "stdout"
+    """How pdf_to_text() gets the XML from pdftohtml:
+    - "stdout": read from its standard output, and decoded into a unicode string.
+    - "mmap": written to a temporary file, which is mapped into memory as MappedText. The XML is
+      never decoded as a whole in the "windowed" and "parallel" import modes, which read it page
+      by page; the "in-memory" one decodes it anyway.
+    """
+
+    PDF_BYTES_PER_PAGE = 50 * 1024
+    """Rough size of a page of a PDF, to estimate the number of pages of a PDF to admit for
+    conversion when there's no preflight to count them (see pdf_to_text())."""
+
+    PARALLEL_WORKERS = None
+    """Number of worker processes in the "parallel" import mode, None for one per CPU."""
+
+    PARALLEL_CHUNK_SIZE = 4
+    """Number of consecutive pages sent to a worker at once in the "parallel" import mode."""
+
+    PARALLEL_MIN_PAGES = 16
+    """Documents with fewer pages are imported in the "windowed" mode even when in the "parallel"
+    one, as starting the workers would take longer than the import itself."""
+
+    FORMULA_LEAD_WORDS = (u"według", u"następującego", u"wyrażony")
+    """Words which, at the end of a page, may start a formula on the next one, together with its
+    first line (see remove_formulas())."""
+
+    PAGE_RE = re.compile(r"<page\b.*?</page>", re.DOTALL)
+    """Regex catching a whole page in the raw XML produced by pdf_to_text."""
+
+    TEXT_NODE_RE = re.compile(r"<text\b([^>]*)>(.*?)</text>", re.DOTALL)
+    """Regex catching a <text> node in the raw XML, with its attributes and its content."""
+
+    FONTSPEC_RE = re.compile(r"<fontspec\b([^>]*)>")
+    """Regex catching a <fontspec> node in the raw XML, with its attributes."""
+
+    ATTRIBUTE_RE = re.compile(r"""(\w+)=["']([^"']*)["']""")
+    """Regex catching a single attribute of a node in the raw XML."""
+
+    TAG_RE = re.compile(r"<[^>]*>")
+    """Regex catching any tag in the raw XML."""
+
+    SECTION_MARKER_RE = re.compile(r"(?P<outgoing_start><i>\s*\[)|(?P<outgoing_end>\]\s*</i>)"
+                                   r"|(?P<upcoming_start><b>\s*&lt;)"
+                                   r"|(?P<upcoming_end>&gt;(?:<b>)?\s*</b>)")
+    """Regex catching the markers around outgoing ("<i>[...]</i>") and upcoming
+    ("<b>&lt;...&gt;</b>") versions in the raw XML. Some upcoming versions end with
+    "&gt;<b> </b>", with the closing bracket left out of the bold text."""
+
+    MARKER_RE = re.compile(r"<i>(\s*)\[|\](\s*)</i>|<b>(\s*)&lt;|&gt;(\s*)</b>|</?[ib]>")
+    """Regex catching a marker of an outgoing or upcoming version, or an italics or bold tag,
+    which are all stripped from the raw XML. Markers with whitespace become a single space."""
+
+    TAG_OR_NEWLINE_RE = re.compile(r"<[^>]*>|\n")
+
+    WHITESPACE_RE = re.compile(r"\s", re.UNICODE)
+
+    SEPARATOR_RE = re.compile(r"(?:\s|<[^>]*>)*$")
+    """Regex catching raw XML without any text, i.e. only tags and whitespace."""
+
+    BASELINE_TOLERANCE = 1
+    """Nodes whose "top" is at most this much below the highest node of a line are on the same
+    baseline, both in sort_text_nodes_in_reading_order() and check_main_text_node_is_sorted()."""
+
+    VALIDATION_LEVEL = "strict"
+    """How reformat_text() checks the invariants its stages rely on:
+    - "strict": each invariant is checked by its own pass over the XML, before the stage which
+      relies on it.
+    - "fast": the invariants are checked on the fly by the stages which visit every node anyway,
+      saving four passes over the XML. Errors are the same as in "strict" mode, but they may
+      only be raised once some of the nodes have already been transformed.
+    """
+
+    PIPELINE = [
+        "assert_all_text_nodes_have_top_left_height_font_attrs",
+        "remove_empty_text_nodes",
+        "remove_header_and_footer",
+        "remove_right_margin",
+        "add_fontsize_to_all_text_nodes",
+        "remove_table_and_formula_regions",
+        "remove_formulas",
+        "remove_specific_unparsable_text_units",
+        "make_top_attribute_monotonically_increasing",
+        "sort_text_nodes_in_reading_order",
+        "add_line_nums_to_law_text",
+        # At this point, all <text> nodes with most common "fontsize" have "line" attribute.
+        "process_superscripts",
+        "remove_footnotes",
+        # Outgoing and upcoming sections are handled on the raw text, by
+        # remove_outgoing_and_upcoming_section_markers().
+        "assert_only_text_nodes_with_most_common_fontsize_left",
+        "join_text_nodes_on_same_lines",
+        "assert_each_text_node_has_increasing_line_attr",
+        "add_indent_info_for_dashed_lines",
+        "add_newline_if_level0_unit_starts_with_level1_unit",
+    ]
+    """The XML stages of reformat_text(), in order. Each one is the name of a method taking the
+    XML. Stages listed in NODE_STAGES are fused: consecutive ones run in a single traversal of the
+    <text> nodes. Every other stage is a barrier, which needs the whole XML at once.
+    """
+
+    PAGE_PIPELINE = [
+        "assert_all_text_nodes_have_top_left_height_font_attrs",
+        "remove_empty_text_nodes",
+        "remove_header_and_footer",
+        "remove_right_margin",
+        "add_fontsize_to_all_text_nodes",
+        "remove_table_and_formula_regions",
+        "remove_formulas",
+        "make_top_attribute_monotonically_increasing",
+        "sort_text_nodes_in_reading_order",
+        "add_line_nums_to_law_text",
+        "process_superscripts",
+        "remove_footnotes",
+        "assert_only_text_nodes_with_most_common_fontsize_left",
+        "join_text_nodes_on_same_lines",
+        "assert_each_text_node_has_increasing_line_attr",
+        "add_indent_levels",
+        "join_dash_lines",
+    ]
+    """The XML stages run on a single page in the "windowed" import mode, by reformat_page().
+    The rest of PIPELINE is run by page_to_text()."""
+
+    NODE_STAGES = {
+        "remove_empty_text_nodes": "empty_text_node_filter",
+        "remove_header_and_footer": "header_and_footer_filter",
+        "remove_right_margin": "right_margin_filter",
+        "add_fontsize_to_all_text_nodes": "fontsize_annotator",
+    }
+    """Map from the stages which look at each <text> node on its own, to the names of methods
+    taking the XML and returning a function which handles a single node. The function returns
+    True if the node should be removed."""
+
+    STATEFUL_STAGES = {
+        "remove_formulas": "formula",
+        "join_dash_lines": "dashes",
+    }
+    """Map from the stages which carry state between pages in the "windowed" import mode, to the
+    key of their state in the dict passed to run_pipeline()."""
+
+    VALIDATION_STAGES = frozenset([
+        "assert_all_text_nodes_have_top_left_height_font_attrs",
+        "assert_only_text_nodes_with_most_common_fontsize_left",
+        "assert_each_text_node_has_increasing_line_attr",
+    ])
+    """Stages which only check invariants, run in the "strict" validation level only."""
+
+    FEATURE_STAGES = {
+        "remove_outgoing_and_upcoming_section_markers": "markers",
+        "remove_formulas": "formulas",
+        "remove_specific_unparsable_text_units": "specific_phrases",
+        "process_superscripts": "superscripts",
+    }
+    """Map from the stages which only have work to do if the document has some feature, to the
+    name of that feature, as found by scan_features()."""
+
+    FORMULA_HINT = u"wzor"
+    """Substring of all the phrases which start a formula in remove_formulas(), i.e. "wzoru:"
+    and "wzorem:"."""
+
+    SUPERSCRIPT_HINT_RE = re.compile(r">(?:\s|</?[ib]>|\[|&lt;)*\. ", re.UNICODE)
+    """Regex catching the start of a <text> node which may follow a superscript, i.e. one
+    starting with ". " (see process_superscripts())."""
+
+    disabled_stages = frozenset()
+    """Names of the stages to skip, e.g. for document types which never have some content."""
+
+    features = None
+    """Dict with the features of the document being processed, as found by scan_features(). When
+    set, stages listed in FEATURE_STAGES are skipped for the features the document lacks."""
+
+    diagnostics = None
+    """Dict with information about the last import, e.g. which features the document has and
+    which stages were skipped and why."""
+
+    preflight_class = PDFPreflight
+    """Class checking an uploaded PDF before it's converted by pdf_to_text(), or None to skip the
+    checks."""
+
+    stage_seconds = None
+    """Dict with the time taken by each stage of the current import, or None outside of
+    reformat_text() (e.g. in the workers of the "parallel" import mode)."""
+
+    artifact_store = None
+    """ArtifactStore to keep the intermediates of imports in ("raw", "stripped" and "text"), or
+    None not to keep them."""
+
+    artifact_key = None
+    """Tuple (work, version) under which the intermediates of the current import are kept in
+    artifact_store."""
+
+    upcoming_in_force = None
+    """Which versions remove_outgoing_and_upcoming_section_markers() keeps: None to keep both
+    the outgoing and the upcoming ones, for the editors to choose, or a set of indexes of the
+    alternatives (see find_alternatives()) whose upcoming version is in force, all the other
+    ones keeping the outgoing version. See indigo_pl.expressions."""
+
+    alternatives = None
+    """List of the Alternatives found in the raw XML of the last import."""
+
+    layout_stats = None
+    """LayoutStats of the document being processed in the "windowed" import mode. When set,
+    stages use it instead of gathering the statistics from the XML they're given."""
+
+    pages_done = 0
+    """Number of pages of the document being processed in the "windowed" or "parallel" import
+    mode which went through the stages so far. The text of the last one or two of them may still
+    be held back, e.g. until a formula ends."""
+
     locale = ('pl', None, None)
 
     slaw_grammar = 'pl'
 
-    def pdf_to_text(self, f):
+    def pdf_to_text(self, f, pages = None):
         """Override of pdf_to_text from superclass, using "pdftohtml" instead of "pdftotext".
         We need the HTML (XML actually) with positional info to do some special preprocessing,
         such as recognizing superscripts or how much dashes are indented.
 
+        Before the conversion, the PDF goes through a cheap preflight (see preflight_class), so
+        that files we can't import (e.g. scans) are rejected straight away, with a clear reason.
+        The conversion itself waits for its turn among the ones of the host (see
+        indigo_pl.admission), weighted by the number of pages.
+
+        Args:
+            f: The input PDF file.
+            pages: Tuple (first, last) of the pages to convert, counting from 1, or None to
+                convert all of them.
+
+        Raises:
+            PreflightError: If the PDF is rejected by the preflight.
+            AdmissionError: If the conversion waited for too long.
+        """
+        info = None
+        if self.preflight_class is not None:
+            info = self.preflight_class(self.shell).check(f.name)
+        weight = self.count_pdf_pages(f, info)
+        if pages is not None:
+            weight = min(weight, pages[1] - pages[0] + 1)
+        with admission.admit("extraction", weight):
+            if self.PDF_OUTPUT == "mmap":
+                return self.pdf_to_mapped_text(f, pages)
+            cmd = (["pdftohtml", "-zoom", "1.35", "-xml", "-stdout"] + self.page_range_args(pages)
+                   + [f.name])
+            code, stdout, stderr = self.shell(cmd)
+            if code > 0:
+                metrics.PDFTOHTML_FAILURES.inc(code=code)
+                raise ValueError(stderr)
+            return stdout.decode('utf-8')
+
+    def count_pdf_pages(self, f, info):
+        """Returns the number of pages of the PDF, as given by the preflight, or estimated from
+        the size of the file if there was none.
+
         Args:
             f: The input PDF file.
+            info: The "pdfinfo" metadata returned by the preflight, or None.
         """
-        cmd = ["pdftohtml", "-zoom", "1.35", "-xml", "-stdout", f.name]
-        code, stdout, stderr = self.shell(cmd)
-        if code > 0:
-            raise ValueError(stderr)
-        return stdout.decode('utf-8')
+        if info and info.get("Pages", "").isdigit():
+            return int(info["Pages"])
+        if not os.path.exists(f.name):
+            return 1
+        return max(os.path.getsize(f.name) // self.PDF_BYTES_PER_PAGE, 1)
+
+    def page_range_args(self, pages):
+        """Returns the arguments of pdftohtml converting only the given pages, see
+        pdf_to_text()."""
+        if pages is None:
+            return []
+        return ["-f", str(pages[0]), "-l", str(pages[1])]
+
+    def pdf_to_mapped_text(self, f, pages = None):
+        """Does the conversion of pdf_to_text() in the "mmap" PDF_OUTPUT mode: pdftohtml writes
+        the XML to a temporary directory, which is removed as soon as the file is mapped.
+
+        Args:
+            f: The input PDF file.
+            pages: The pages to convert, see pdf_to_text().
+
+        Returns:
+            MappedText: The XML.
+        """
+        directory = tempfile.mkdtemp(prefix="indigo-pl-")
+        try:
+            output = os.path.join(directory, "document")
+            code, stdout, stderr = self.shell(
+                ["pdftohtml", "-zoom", "1.35", "-xml"] + self.page_range_args(pages)
+                + [f.name, output])
+            if code > 0:
+                metrics.PDFTOHTML_FAILURES.inc(code=code)
+                raise ValueError(stderr)
+            return MappedText.open(output + ".xml")
+        finally:
+            shutil.rmtree(directory)
 
     def reformat_text(self, text):
         """Override of reformat_text from superclass. Here we do our special preprocessing on
         XML, then strip XML tags, and return a plain text string which should finally be parsed
         into Akoma Ntoso.
 
+        How long the import and each of its stages take, and which stages fail, is recorded in
+        metrics, and the time taken by each stage in the "stage_seconds" diagnostics too.
+
+        The import waits for its turn among the ones of the host (see indigo_pl.admission),
+        weighted by the number of pages, and the time it waited is in the "admission_seconds"
+        diagnostics. It runs in a separate worker process, with limits on its memory and time,
+        if those are configured (see indigo_pl.isolation).
+
         Args:
             text: String containing XML produced by pdf_to_text.
 
         Returns:
             str: Plain text containing the law.
+
+        Raises:
+            AdmissionError: If the import waited for too long.
+            ImportWorkerError: If the import went over the limits of its worker process.
         """
-        text = self.remove_outgoing_and_upcoming_section_markers(text)
+        return u"".join(self.iter_reformatted_text(text))
+
+    def iter_reformatted_text(self, text, progress=False):
+        """Does the same as reformat_text(), yielding the plain text in chunks of whole lines as
+        soon as they're ready: a few pages at a time in the "windowed" and "parallel" import
+        modes, all of it at once in the "in-memory" one.
+
+        Args:
+            text: String containing XML produced by pdf_to_text.
+            progress: Whether to yield how far the import is along with the chunks.
+
+        Yields:
+            str: Consecutive chunks of plain text containing the law, or if progress is set,
+                tuples (pages done, total pages, chunk), see pages_done.
+        """
+        if isolation.enabled():
+            for chunk in isolation.iter_reformatted_text(self, text, progress):
+                yield chunk
+            return
+        pages = max(text.count("<page "), 1)
+        with admission.admit("reformat", pages) as waited:
+            start = time.time()
+            self.stage_seconds = {}
+            try:
+                if self.IMPORT_MODE in ("windowed", "parallel"):
+                    chunks = []
+                    for chunk in self.iter_reformatted_text_windowed(text):
+                        if self.artifact_store is not None:
+                            chunks.append(chunk)
+                        yield (self.pages_done, pages, chunk) if progress else chunk
+                    self.store_artifact("raw", text)
+                    self.store_artifact("text", u"".join(chunks))
+                else:
+                    chunk = self.reformat_text_in_memory(text)
+                    yield (pages, pages, chunk) if progress else chunk
+            finally:
+                metrics.IMPORT_DURATION.observe(time.time() - start, mode=self.IMPORT_MODE)
+                metrics.IMPORT_PAGES.observe(pages)
+                for stage, seconds in self.stage_seconds.iteritems():
+                    metrics.IMPORT_STAGE_DURATION.observe(seconds, stage=stage)
+                metrics.flush()
+                if self.diagnostics is not None:
+                    self.diagnostics["stage_seconds"] = self.stage_seconds
+                    self.diagnostics["admission_seconds"] = waited
+                self.stage_seconds = None
+
+    def reformat_text_in_memory(self, text):
+        """Does the work of reformat_text() in the "in-memory" import mode."""
+        if not isinstance(text, unicode):
+            # MappedText, or the bytes left of it by the marker stage.
+            text = text.decode("utf-8")
+        self.start_diagnostics(text)
+        self.store_artifact("raw", text)
+        if not self.should_skip_stage("remove_outgoing_and_upcoming_section_markers"):
+            with self.timing_stage("remove_outgoing_and_upcoming_section_markers"):
+                text = self.remove_outgoing_and_upcoming_section_markers(text)
+        self.store_artifact("stripped", text)
         xml = BeautifulSoup(text)
-        self.assert_all_text_nodes_have_top_left_height_font_attrs(xml)
-        self.remove_empty_text_nodes(xml)
-        self.remove_header_and_footer(xml)
-        self.remove_right_margin(xml)
-        self.add_fontsize_to_all_text_nodes(xml)
-        self.remove_formulas(xml)
-        self.remove_specific_unparsable_text_units(xml)
-        self.make_top_attribute_monotonically_increasing(xml)
-        self.add_line_nums_to_law_text(xml)
-        # At this point, all <text> nodes with most common "fontsize" have "line" attribute.
-        self.process_superscripts(xml)
-        self.remove_footnotes(xml)
-        # Commented out because it's too hard parse outgoing and upcoming sections for now.
-        # Instead of this, remove_outgoing_and_upcoming_section_markers() was added.
-        # self.undecorate_outgoing_and_upcoming_sections(xml)
-        self.assert_only_text_nodes_with_most_common_fontsize_left(xml)
-        self.join_text_nodes_on_same_lines(xml)
-        self.assert_each_text_node_has_increasing_line_attr(xml)
-        self.add_indent_info_for_dashed_lines(xml)
-        self.add_newline_if_level0_unit_starts_with_level1_unit(xml)
+        self.run_pipeline(xml, self.PIPELINE)
         text = self.xml_to_text(xml)
         text = self.join_hyphenated_words(text)
         text = self.remove_linebreaks(text)
         text = self.trim_lines(text)
+        self.store_artifact("text", text)
         return text
 
+    def iter_reformatted_text_windowed(self, text):
+        """Does the same as reformat_text(), but in the "windowed" import mode, yielding the
+        plain text as soon as it's ready, in chunks of whole lines.
+
+        First, compute_layout_stats() gathers the document-wide statistics in a cheap pass over
+        the raw XML. Then each page is parsed on its own and goes through the stages which only
+        need the page itself. Pages are held in memory only as long as a following page may still
+        change them: a line starting with a dash may be joined to the last line of the previous
+        page, and a formula may span pages. Hyphenated words and line breaks are joined across
+        pages on the plain text, carrying over the last, still open line.
+
+        Documents which may need SPECIFIC_PHRASES_TO_REMOVE are processed in memory, as the
+        phrases are matched using a moving window of nodes which may span any number of pages.
+
+        In the "parallel" import mode, pages are turned into text in worker processes instead,
+        see iter_reformatted_text_parallel().
+
+        Args:
+            text: String containing XML produced by pdf_to_text.
+
+        Yields:
+            str: Consecutive chunks of plain text containing the law.
+        """
+        self.pages_done = 0
+        with self.timing_stage("compute_layout_stats"):
+            stats = self.compute_layout_stats(text)
+        self.start_diagnostics(text)
+        if stats.has_specific_phrases:
+            mode = self.IMPORT_MODE
+            self.IMPORT_MODE = "in-memory"
+            try:
+                yield self.reformat_text_in_memory(text)
+            finally:
+                self.IMPORT_MODE = mode
+            return
+
+        # Outgoing and upcoming sections may span pages, so their markers are handled on the whole
+        # raw XML rather than page by page.
+        if not self.should_skip_stage("remove_outgoing_and_upcoming_section_markers"):
+            with self.timing_stage("remove_outgoing_and_upcoming_section_markers"):
+                text = self.remove_outgoing_and_upcoming_section_markers(text)
+        self.layout_stats = stats
+        try:
+            if self.IMPORT_MODE == "parallel" and self.can_run_parallel(text):
+                for chunk in self.iter_reformatted_text_parallel(text):
+                    yield chunk
+                return
+            state = {"formula": self.new_formula_state(), "dashes": {}}
+            held_pages = []
+            pending = u""
+            for page_text in self.iter_pages(text):
+                xml = self.reformat_page(page_text, state)
+                self.pages_done += 1
+                held_pages.append(xml)
+                if (xml.find("text") is None) or state["formula"]["is_in_formula"]:
+                    continue
+                # Nothing after this page can change the pages before it anymore.
+                for page in held_pages[:-1]:
+                    pending, lines = self.join_lines_across_pages(pending, self.page_to_text(page))
+                    yield lines
+                held_pages = held_pages[-1:]
+
+            if state["formula"]["is_in_formula"]:
+                raise Exception('After iterating through entire law text, parser is inside a formula.')
+            for page in held_pages:
+                pending, lines = self.join_lines_across_pages(pending, self.page_to_text(page))
+                yield lines
+            yield self.trim_lines(self.remove_linebreaks(self.join_hyphenated_words(pending)))
+        finally:
+            self.layout_stats = None
+
+    def compute_layout_stats(self, text):
+        """The cheap first pass of the "windowed" import mode: gathers the document-wide
+        statistics using regexes over the raw XML, without building any tree. Nodes which the
+        first stages of reformat_text() would remove (empty ones, header, footer and right
+        margin) are skipped.
+
+        Args:
+            text: String containing XML produced by pdf_to_text.
+
+        Returns:
+            LayoutStats: The statistics.
+        """
+        stats = LayoutStats()
+        divider = (self.PAGE_NUM_MULTIPLIER / 10)
+        phrase_hints = self.get_specific_phrase_hints()
+        for page_text in self.iter_pages(text):
+            stats.page_count += 1
+            last_seen_tops = {}
+            for match in self.FONTSPEC_RE.finditer(page_text):
+                attrs = dict(self.ATTRIBUTE_RE.findall(match.group(1)))
+                stats.fontsizes[attrs["id"]] = attrs["size"]
+            for match in self.TEXT_NODE_RE.finditer(page_text):
+                content = self.TAG_RE.sub("", match.group(2))
+                if not content.strip():
+                    continue
+                attrs = dict(self.ATTRIBUTE_RE.findall(match.group(1)))
+                if not all(attr in attrs for attr in ("top", "left", "height", "font")):
+                    # Let the usual check report the node and its page.
+                    self.assert_all_text_nodes_have_top_left_height_font_attrs(
+                        BeautifulSoup(page_text))
+                top = int(attrs["top"])
+                left = int(attrs["left"])
+                if ((top % divider) <= self.HEADER_END_OFFSET
+                        or (top % divider) > self.FOOTER_START_OFFSET
+                        or left > self.RIGHT_MARGIN_START_OFFSET):
+                    continue
+                font = attrs["font"]
+                height = int(attrs["height"])
+                stats.font_counts[font] = stats.font_counts.get(font, 0) + 1
+                stats.height_counts[height] = stats.height_counts.get(height, 0) + 1
+                if font in stats.fontsizes:
+                    fontsize = int(stats.fontsizes[font])
+                    if top > last_seen_tops.get(fontsize, 0):
+                        last_seen_tops[fontsize] = top
+                        lefts = stats.line_start_lefts.setdefault(fontsize, {})
+                        lefts[left] = lefts.get(left, 0) + 1
+                if (not stats.has_specific_phrases) and any(hint in content for hint in phrase_hints):
+                    stats.has_specific_phrases = True
+        return stats
+
+    def iter_pages(self, text):
+        """Yields the raw XML of consecutive pages. If there are no <page> nodes, the whole text
+        is a single page.
+
+        Args:
+            text: String containing XML produced by pdf_to_text.
+
+        Yields:
+            str: The raw XML of a page.
+        """
+        found = False
+        for match in self.PAGE_RE.finditer(text):
+            found = True
+            page = match.group()
+            # Pages of MappedText are bytes.
+            yield page if isinstance(page, unicode) else page.decode("utf-8")
+        if not found:
+            yield text if isinstance(text, unicode) else text.decode("utf-8")
+
+    def reformat_page(self, text, state):
+        """Runs a single page through the XML stages of reformat_text(), in the "windowed"
+        import mode.
+
+        Args:
+            text: String containing the raw XML of the page.
+            state: Dict with the state carried over from the previous pages.
+
+        Returns:
+            The XML of the page, ready to be turned into text by page_to_text().
+        """
+        xml = BeautifulSoup(text)
+        self.run_pipeline(xml, self.PAGE_PIPELINE, state)
+        return xml
+
+    def can_run_parallel(self, text):
+        """Checks if the "parallel" import mode is worth it for the document, i.e. if it has at
+        least PARALLEL_MIN_PAGES pages, and possible, i.e. if this isn't a daemonic process
+        (e.g. a worker of IngestDaemon), which can't start workers of its own."""
+        return (not current_process().daemon) and (
+            text.count("<page ") >= self.PARALLEL_MIN_PAGES)
+
+    def iter_reformatted_text_parallel(self, text):
+        """The rest of iter_reformatted_text_windowed() in the "parallel" import mode, once the
+        layout statistics are known: each page is turned into text by reformat_pages() in a pool
+        of worker processes (see PARALLEL_WORKERS), many pages at a time. Pages come back in
+        order, and all that's left to do here is what crosses pages: joining a line starting
+        with a dash to the last line of the previous page, and joining hyphenated words and line
+        breaks, as in the "windowed" mode.
+
+        The pages are handed to the workers in a PageBuffer, so only their indexes are pickled,
+        and the workers send back just the text. How much that takes is in the "transfer"
+        diagnostics.
+
+        Formulas may span pages too, so the workers guess that a page doesn't start inside a
+        formula, or right after the words starting one. The rare pages for which the guess is
+        wrong, and the pages ending inside a formula, are done over here, together with the
+        following pages, until the formula ends.
+
+        Args:
+            text: String containing XML produced by pdf_to_text, with layout_stats set.
+
+        Yields:
+            str: Consecutive chunks of plain text containing the law.
+        """
+        # Worker processes don't have diagnostics, so the skipped stages are recorded here.
+        for stage in self.PAGE_PIPELINE:
+            self.should_skip_stage(stage)
+        start = time.time()
+        pages = PageBuffer.create(self.iter_pages(text))
+        transfer = {
+            "pages": len(pages),
+            "buffer_bytes": pages.size,
+            "pack_seconds": time.time() - start,
+            "result_chars": 0,
+        }
+        pool = Pool(self.PARALLEL_WORKERS, initializer=init_page_worker,
+                    initargs=(self.__class__, self.get_page_worker_config(), pages.path))
+        try:
+            # The stages run in the workers, so they're timed here as a whole.
+            with self.timing_stage("parallel_pages"):
+                results = pool.imap(reformat_pages_in_worker, xrange(len(pages)),
+                                    self.PARALLEL_CHUNK_SIZE)
+                formula_pages = []
+                previous_text = u""
+                redone = 0
+                reordered_nodes = 0
+                held = None
+                pending = u""
+                for index, chunk in enumerate(results):
+                    self.pages_done = index + 1
+                    transfer["result_chars"] += chunk.size()
+                    if (formula_pages or chunk.ends_in_formula
+                            or previous_text.endswith(self.FORMULA_LEAD_WORDS)):
+                        formula_pages.append(pages[index])
+                        chunk = self.reformat_pages(u"".join(formula_pages), previous_text)
+                        redone += 1
+                        if chunk.ends_in_formula:
+                            continue
+                        formula_pages = []
+                    previous_text = chunk.last_text
+                    reordered_nodes += chunk.reordered_nodes
+                    if chunk.head is None:
+                        # No text on the page.
+                        continue
+                    if held is None:
+                        held = [chunk.head + chunk.rest, chunk.last_node, chunk.last_line_start]
+                        continue
+                    held, lines = self.join_page_chunks(held, chunk)
+                    pending, lines = self.join_lines_across_pages(pending, lines)
+                    yield lines
+
+                if formula_pages:
+                    raise Exception('After iterating through entire law text, parser is inside a formula.')
+                if held is not None:
+                    pending, lines = self.join_lines_across_pages(pending, held[0])
+                    yield lines
+                yield self.trim_lines(self.remove_linebreaks(self.join_hyphenated_words(pending)))
+        finally:
+            pool.terminate()
+            pages.close()
+        if self.diagnostics is not None:
+            self.diagnostics["pages_redone"] = redone
+            self.diagnostics["transfer"] = transfer
+            if reordered_nodes:
+                self.diagnostics["reordered_nodes"] = reordered_nodes
+
+    def join_page_chunks(self, held, chunk):
+        """Does what join_dash_lines() does across pages, for pages turned into text by
+        reformat_pages(): if the page starts with a line which should be joined to the last line
+        of the previous one, moves the dash to the end of the previous page.
+
+        Args:
+            held: List with the text of the previous page, and its last node and the node
+                starting its last line, as strings.
+            chunk: The PageChunk of the next page.
+
+        Returns:
+            tuple: The same kind of list for the next page, and the text of the previous page,
+                which can't change anymore.
+        """
+        text, last_node, last_line_start = held
+        head = chunk.head
+        next_last_node, next_last_line_start = chunk.last_node, chunk.last_line_start
+        if (chunk.first_node is not None) and (last_node is not None) and (
+                self.should_join_dash_line(self.parse_node(chunk.first_node),
+                                           self.parse_node(last_node),
+                                           self.parse_node(last_line_start))):
+            text = text[:-1] + u" –\n"
+            head = chunk.joined_head
+            if next_last_node == chunk.first_node:
+                # The page has just this one line, whose dash is gone now.
+                next_last_node = next_last_line_start = next_last_node.replace(u"@@– ", u"@@")
+        return [head + chunk.rest, next_last_node, next_last_line_start], text
+
+    def parse_node(self, node):
+        return BeautifulSoup(node).find("text")
+
+    def get_page_worker_config(self):
+        """Returns the attributes of this importer which the worker processes of the "parallel"
+        import mode need to process pages in the same way."""
+        return {
+            "VALIDATION_LEVEL": self.VALIDATION_LEVEL,
+            "disabled_stages": self.disabled_stages,
+            "features": self.features,
+            "layout_stats": self.layout_stats,
+        }
+
+    def get_import_worker_config(self):
+        """Returns the attributes of this importer which an ImportWorker needs to import a
+        document in the same way (see indigo_pl.isolation). The artifact store is opened again
+        by the worker, from its path."""
+        return {
+            "IMPORT_MODE": self.IMPORT_MODE,
+            "VALIDATION_LEVEL": self.VALIDATION_LEVEL,
+            "PARALLEL_WORKERS": self.PARALLEL_WORKERS,
+            "PARALLEL_CHUNK_SIZE": self.PARALLEL_CHUNK_SIZE,
+            "PARALLEL_MIN_PAGES": self.PARALLEL_MIN_PAGES,
+            "disabled_stages": self.disabled_stages,
+            "upcoming_in_force": self.upcoming_in_force,
+            "artifact_key": self.artifact_key,
+        }
+
+    def reformat_pages(self, text, previous_node_text = u""):
+        """Turns one or more consecutive pages into text in the "parallel" import mode, as if
+        they were the first pages of the document: runs them through reformat_page() and
+        page_to_text(), keeping what iter_reformatted_text_parallel() needs to join them to the
+        previous and next pages.
+
+        Args:
+            text: String containing the raw XML of the pages.
+            previous_node_text: Text of the node before the pages, as seen by remove_formulas().
+
+        Returns:
+            PageChunk: The text of the pages.
+        """
+        formula = dict(self.new_formula_state(), previous_node_text = previous_node_text)
+        state = {"formula": formula, "dashes": {}}
+        # Worker processes have no diagnostics, so the pages get their own, and the parent adds
+        # them up.
+        diagnostics, self.diagnostics = self.diagnostics, {"skipped_stages": {}}
+        try:
+            xml = self.reformat_page(text, state)
+        finally:
+            reordered_nodes = self.diagnostics.get("reordered_nodes", 0)
+            self.diagnostics = diagnostics
+        if formula["is_in_formula"]:
+            return PageChunk(None, None, u"", None, None, None, True, u"", 0)
+        nodes = xml.find_all("text")
+        if not nodes:
+            return PageChunk(None, None, u"", None, None, None, False,
+                             formula["previous_node_text"], reordered_nodes)
+
+        first_node = None
+        joined_head = None
+        if re.match(self.DASH_PREFIX_WITH_INDENT, nodes[0].get_text()):
+            # It may have to be joined to the previous page, see join_dash_lines().
+            first_node = unicode(nodes[0])
+            joined = BeautifulSoup(first_node)
+            node = joined.find("text")
+            node.string = node.get_text().strip().replace(u"@@– ", u"@@")
+            joined_head = self.page_to_text(joined)
+        dashes = state["dashes"]
+        last_node = unicode(dashes["last_node"]) if dashes.get("last_node") else None
+        last_line_start = (unicode(dashes["last_line_start"])
+                           if dashes.get("last_line_start") else None)
+
+        self.remove_indent_info_except_for_dashed_lines(xml)
+        self.add_newline_if_level0_unit_starts_with_level1_unit(xml)
+        lines = [node.get_text().strip() + u"\n" for node in nodes]
+        return PageChunk(lines[0], joined_head, u"".join(lines[1:]), first_node, last_node,
+                         last_line_start, False, formula["previous_node_text"], reordered_nodes)
+
+    def page_to_text(self, xml):
+        """Finishes the XML stages of reformat_text() for a page processed by reformat_page(),
+        once no following page can change it anymore, and returns its text.
+
+        Args:
+            xml: The XML of the page.
+
+        Returns:
+            str: The text of the page, one line per <text> node.
+        """
+        self.remove_indent_info_except_for_dashed_lines(xml)
+        self.add_newline_if_level0_unit_starts_with_level1_unit(xml)
+        return self.xml_to_text(xml)
+
+    def join_lines_across_pages(self, pending, text):
+        """Runs the text stages of reformat_text() on the text of another page.
+
+        These stages look at the end of a line and the start of the next one, so we keep the
+        last (still open) line and process it again together with the next page.
+
+        Args:
+            pending: The open line left over from the previous page.
+            text: The text of the page, as returned by page_to_text().
+
+        Returns:
+            tuple: The new open line, and the finished lines.
+        """
+        text = pending + text
+        # The trailing line break belongs to the next page.
+        text = self.remove_linebreaks(self.join_hyphenated_words(text[:-1])) + text[-1:]
+        last_line_start = text.rfind(u"\n", 0, len(text) - 1) + 1
+        finished = text[:last_line_start]
+        return text[last_line_start:], (self.trim_lines(finished) if finished else u"")
+
+    def run_pipeline(self, xml, pipeline, state = None):
+        """Runs the given XML stages, skipping the disabled ones. Consecutive node stages (see
+        NODE_STAGES) are fused into a single traversal of the <text> nodes.
+
+        Args:
+            xml: The XML to operate on, as a list of tags.
+            pipeline: List of stage names, e.g. PIPELINE.
+            state: Dict with the state carried over from the previous pages in the "windowed"
+                import mode, passed to STATEFUL_STAGES. None if the XML is the whole document.
+        """
+        node_stages = []
+        for stage in pipeline:
+            if self.should_skip_stage(stage):
+                continue
+            if stage in self.NODE_STAGES:
+                node_stages.append(stage)
+                continue
+            self.run_node_stages(xml, node_stages)
+            node_stages = []
+            with self.timing_stage(stage):
+                if (state is not None) and (stage in self.STATEFUL_STAGES):
+                    getattr(self, stage)(xml, state[self.STATEFUL_STAGES[stage]])
+                else:
+                    getattr(self, stage)(xml)
+        self.run_node_stages(xml, node_stages)
+
+    @contextmanager
+    def timing_stage(self, stage):
+        """Adds the time taken by the block to stage_seconds, and counts the exceptions it
+        raises in metrics, in reformat_text() only.
+
+        Args:
+            stage: Name of the stage, e.g. "join_dash_lines".
+        """
+        if self.stage_seconds is None:
+            yield
+            return
+        start = time.time()
+        try:
+            yield
+        except Exception as e:
+            # Only in the innermost stage, if stages are nested.
+            if not getattr(e, "stage", None):
+                e.stage = stage
+                try:
+                    metrics.IMPORT_ERRORS.inc(stage=stage, error=metrics.error_kind(e))
+                except Exception:
+                    # Whatever goes wrong with the metrics, the error of the import is raised.
+                    log.exception("Counting an error of stage %s failed", stage)
+            raise
+        finally:
+            self.stage_seconds[stage] = self.stage_seconds.get(stage, 0) + time.time() - start
+
+    def store_artifact(self, stage, data):
+        """Keeps an intermediate of the current import in artifact_store, if there is one.
+
+        Args:
+            stage: Name of the intermediate, e.g. "raw".
+            data: The intermediate, as a string.
+        """
+        if self.artifact_store is not None and self.artifact_key is not None:
+            work, version = self.artifact_key
+            self.artifact_store.put(work, version, stage, data)
+
+    def should_skip_stage(self, stage):
+        """Checks if the given stage should be skipped, and if so, records why in diagnostics.
+
+        Args:
+            stage: Name of the stage.
+
+        Returns:
+            bool: True if the stage should be skipped, False otherwise.
+        """
+        if stage in self.disabled_stages:
+            reason = "disabled"
+        elif (stage in self.VALIDATION_STAGES) and self.VALIDATION_LEVEL != "strict":
+            reason = "validation level " + self.VALIDATION_LEVEL
+        elif ((self.features is not None) and (stage in self.FEATURE_STAGES)
+              and not self.features[self.FEATURE_STAGES[stage]]):
+            reason = "no " + self.FEATURE_STAGES[stage]
+        else:
+            return False
+        if self.diagnostics is not None:
+            self.diagnostics["skipped_stages"][stage] = reason
+        return True
+
+    def start_diagnostics(self, text):
+        """Resets diagnostics for a new import, and pre-scans the document for its features.
+
+        Args:
+            text: String containing XML produced by pdf_to_text.
+        """
+        self.features = self.scan_features(text)
+        self.alternatives = []
+        self.diagnostics = {
+            "import_mode": self.IMPORT_MODE,
+            "validation_level": self.VALIDATION_LEVEL,
+            "features": self.features,
+            "skipped_stages": {},
+        }
+        log.debug("Document features: %s", self.features)
+
+    def scan_features(self, text):
+        """Finds which features that need their own stages the document has, using plain
+        substring searches over the raw XML. This is much cheaper than the stages themselves, as
+        no tree is built. The scan may find a feature which isn't there, but never misses one.
+
+        Args:
+            text: String containing XML produced by pdf_to_text.
+
+        Returns:
+            dict: Map from the feature names of FEATURE_STAGES to bools.
+        """
+        return {
+            "markers": (u"<i>" in text) or (u"<b>" in text),
+            "formulas": self.FORMULA_HINT in text,
+            "specific_phrases": any(hint in text for hint in self.get_specific_phrase_hints()),
+            "superscripts": ((u". " in text)
+                             and (self.SUPERSCRIPT_HINT_RE.search(text) is not None)),
+        }
+
+    def get_specific_phrase_hints(self):
+        """Returns the last word of the text preceding each of SPECIFIC_PHRASES_TO_REMOVE. Any
+        document containing such a phrase contains its hint as well.
+
+        Returns:
+            list: List of strings.
+        """
+        return [phrase[0].split()[-1] for phrase in self.SPECIFIC_PHRASES_TO_REMOVE]
+
+    def run_node_stages(self, xml, stages):
+        """Runs the given node stages in a single traversal of the <text> nodes. Each node goes
+        through the stages in order, until one of them removes it.
+
+        Args:
+            xml: The XML to operate on, as a list of tags.
+            stages: List of names of stages from NODE_STAGES.
+        """
+        if not stages:
+            return
+        with self.timing_stage("+".join(stages)):
+            handlers = [getattr(self, self.NODE_STAGES[stage])(xml) for stage in stages]
+            for node in xml.find_all("text"):
+                for handler in handlers:
+                    if handler(node):
+                        node.extract()
+                        break
+
     def remove_outgoing_and_upcoming_section_markers(self, text):
         """Outgoing sections are indicated like this:
         <i>[Art. 123 This is about to stop being in force.]</i>
@@ -207,14 +1262,14 @@ class ImporterPL(Importer):
         Upcoming sections are indicated like this:
         <b>&lt;Art. 123 This is about to start being in force.&gt;</b>
 
-        Ideally, we could parse them as such, match them to the marginal notes saying when
-        they go out / come in, and leave the correct ones.
-
-        For now, we just make the resulting text contain both and rely on manual law editors
-        to select the right version.
+        Both can span many lines and pages, or be a few words inside a sentence, and an outgoing
+        section is usually followed by the upcoming one replacing it. They're recorded in
+        "alternatives" (see find_alternatives()), and then, depending on upcoming_in_force,
+        either both versions are left in the text for the editors to choose, or only the one
+        in force is.
 
-        I previously tried to go in the direction of parsing them more, in the now commented-out
-        method undecorate_outgoing_and_upcoming_sections().
+        The text may be MappedText, as the regexes run on its bytes, and then bytes are
+        returned.
 
         Args:
             text (str): The law text.
@@ -222,22 +1277,91 @@ class ImporterPL(Importer):
         Returns:
             str: The law text after processing.
         """
+        self.alternatives = self.find_alternatives(text)
+        if self.diagnostics is not None:
+            self.diagnostics["alternatives"] = len(self.alternatives)
+        if self.upcoming_in_force is not None:
+            text = self.select_versions(text, self.alternatives, self.upcoming_in_force)
+        return self.MARKER_RE.sub(self.replace_marker, text)
+
+    def replace_marker(self, match):
+        # Not unicode, which would make re decode MappedText as ASCII.
+        return " " if any(match.groups()) else ""
+
+    def find_alternatives(self, text):
+        """Finds the outgoing and upcoming sections in a single pass over the raw XML, pairing
+        each outgoing section with the upcoming one right after it, if any. Markers which don't
+        open or close a section (e.g. a stray closing one) are left alone.
 
-        # Each block has version with whitespace & without.
-        text = re.sub(r"<i>\s+\[", " ", text)
-        text = re.sub(r"<i>\[", "", text)
+        Args:
+            text (str): The law text.
 
-        text = re.sub(r"\]\s+</i>", " ", text)
-        text = re.sub(r"\]</i>", "", text)
+        Returns:
+            list: Alternatives, in order.
+        """
+        alternatives = []
+        open_kind = None
+        open_match = None
+        for match in self.SECTION_MARKER_RE.finditer(text):
+            kind, _, edge = match.lastgroup.partition("_")
+            if edge == "start":
+                if open_kind is None:
+                    open_kind, open_match = kind, match
+                continue
+            if open_kind != kind:
+                continue
+            section = Section(open_match.start(), match.end(), open_match.end(), match.start())
+            open_kind = None
+            if kind == "outgoing":
+                alternatives.append(Alternative(section, None))
+            elif (alternatives and alternatives[-1].outgoing is not None
+                  and alternatives[-1].upcoming is None and self.SEPARATOR_RE.match(
+                      text, alternatives[-1].outgoing.end, section.start)):
+                alternatives[-1] = alternatives[-1]._replace(upcoming=section)
+            else:
+                alternatives.append(Alternative(None, section))
+        return alternatives
 
-        text = re.sub(r"<b>\s+&lt;", " ", text)
-        text = re.sub(r"<b>&lt;", "", text)
+    def select_versions(self, text, alternatives, upcoming_in_force):
+        """Leaves only the versions in force in the raw XML. The text of the other ones is
+        removed, but their tags are kept, so that nodes and pages stay the same.
 
-        text = re.sub(r"&gt;\s+</b>", " ", text)
-        text = re.sub(r"&gt;</b>", "", text)
+        Args:
+            text (str): The law text.
+            alternatives: List of Alternatives found in the text.
+            upcoming_in_force: Set of indexes of the alternatives whose upcoming version is in
+                force.
 
-        text = re.sub(r"<i>|</i>|<b>|</b>", "", text)
-        return text
+        Returns:
+            str: The law text after processing.
+        """
+        pieces = []
+        last_end = 0
+        for i, alternative in enumerate(alternatives):
+            removed = alternative.outgoing if i in upcoming_in_force else alternative.upcoming
+            kept = alternative.upcoming if i in upcoming_in_force else alternative.outgoing
+            for section in sorted(filter(None, (removed, kept))):
+                if section is removed:
+                    # The whitespace between an outgoing version and the upcoming one replacing
+                    # it goes too.
+                    start, end = section.start, section.end
+                    if kept is not None:
+                        start, end = min(start, kept.end), max(end, kept.start)
+                    pieces.append(text[last_end:start])
+                    pieces.extend(self.TAG_OR_NEWLINE_RE.findall(text, start, end))
+                else:
+                    pieces.append(text[last_end:section.start])
+                    end = section.end
+                    # Whitespace in the markers is kept as a single space, as in replace_marker().
+                    pieces.append(" " if self.WHITESPACE_RE.search(
+                        text, section.start, section.text_start) else "")
+                    pieces.append(text[section.text_start:section.text_end])
+                    pieces.append(" " if self.WHITESPACE_RE.search(
+                        text, section.text_end, section.end) else "")
+                last_end = end
+        pieces.append(text[last_end:])
+        # Bytes for MappedText.
+        return text[:0].join(pieces)
 
     def assert_all_text_nodes_have_top_left_height_font_attrs(self, xml):
         """Make sure all the text XML nodes have all the required attributes, so that we don't
@@ -248,20 +1372,40 @@ class ImporterPL(Importer):
         """
         for page in xml.find_all("page"):
             for node in page.find_all("text"):
-                if ((not node.has_attr("top")) or (not node.has_attr("height")) 
-                    or (not node.has_attr("font")) or (not node.has_attr("left"))):
-                    raise Exception("The following node on page [" + page["number"] 
-                                    + "] doesn't have all the expected attributes: \n" + str(node))
+                self.check_text_node_attrs(node, page)
+
+    def check_text_node_attrs(self, node, page):
+        """Raises if the given text node doesn't have all the required attributes (see
+        assert_all_text_nodes_have_top_left_height_font_attrs()).
+
+        Args:
+            node: The <text> node to check.
+            page: The <page> node containing it.
+        """
+        if ((not node.has_attr("top")) or (not node.has_attr("height")) 
+            or (not node.has_attr("font")) or (not node.has_attr("left"))):
+            raise Exception("The following node on page [" + page["number"] 
+                            + "] doesn't have all the expected attributes: \n" + str(node))
 
     def remove_empty_text_nodes(self, xml):
-        """Remove the XML nodes containing nothing or whitespace.
+        """Remove the XML nodes containing nothing or whitespace. In the "fast" validation level,
+        also checks that each node has the required attributes.
         
         Args:
             xml: The XML to operate on, as a list of tags.
         """
-        for node in xml.find_all("text"):
-            if re.match("^\s*$", node.get_text()):
-                node.extract()
+        self.run_node_stages(xml, ["remove_empty_text_nodes"])
+
+    def empty_text_node_filter(self, xml):
+        """Returns the node handler of remove_empty_text_nodes() (see NODE_STAGES)."""
+        fast = (self.VALIDATION_LEVEL == "fast")
+        def is_empty(node):
+            if fast:
+                page = node.find_parent("page")
+                if page is not None:
+                    self.check_text_node_attrs(node, page)
+            return bool(re.match("^\s*$", node.get_text()))
+        return is_empty
 
     def remove_header_and_footer(self, xml):
         """Modify the passed in XML by removing tags laying outside the area we know to be
@@ -271,8 +1415,11 @@ class ImporterPL(Importer):
         Args:
             xml: The XML to operate on, as a list of tags.
         """
-        for tag in xml.find_all(self.is_header_or_footer):
-            tag.extract()
+        self.run_node_stages(xml, ["remove_header_and_footer"])
+
+    def header_and_footer_filter(self, xml):
+        """Returns the node handler of remove_header_and_footer() (see NODE_STAGES)."""
+        return self.is_header_or_footer
 
     def is_header_or_footer(self, tag):
         """Check if the given tag lies on the page at a position known to be in header or footer.
@@ -296,8 +1443,11 @@ class ImporterPL(Importer):
         Args:
             xml: The XML to operate on, as a list of tags.
         """
-        for tag in xml.find_all(self.is_right_margin):
-            tag.extract()
+        self.run_node_stages(xml, ["remove_right_margin"])
+
+    def right_margin_filter(self, xml):
+        """Returns the node handler of remove_right_margin() (see NODE_STAGES)."""
+        return self.is_right_margin
 
     def is_right_margin(self, tag):
         """Check if the given tag lies on the page at a position known to be in the right margin.
@@ -319,24 +1469,252 @@ class ImporterPL(Importer):
         Args:
             xml: The XML to operate on, as a list of tags.
         """
-        fonts_to_fontsizes = {}
-        for node in xml.find_all("fontspec"):
-            fonts_to_fontsizes[node["id"]] = node["size"]
-        for node in xml.find_all("text"):
+        self.run_node_stages(xml, ["add_fontsize_to_all_text_nodes"])
+
+    def fontsize_annotator(self, xml):
+        """Returns the node handler of add_fontsize_to_all_text_nodes() (see NODE_STAGES)."""
+        if self.layout_stats is not None:
+            fonts_to_fontsizes = self.layout_stats.fontsizes
+        else:
+            fonts_to_fontsizes = {}
+            for node in xml.find_all("fontspec"):
+                fonts_to_fontsizes[node["id"]] = node["size"]
+        def annotate(node):
             node["fontsize"] = fonts_to_fontsizes.get(node["font"], self.NO_FONTSIZE)
+        return annotate
+
+    def remove_table_and_formula_regions(self, xml):
+        """Remove <text> nodes which draw tables or mathematical formulas, recognizing them by
+        their geometry only, and put an explanatory text in their place.
+
+        For each page we sweep once through its nodes sorted by "top", grouping them into lines.
+        Then:
+        - A table is a run of at least TABLE_MIN_ROWS lines, each made of at least
+          TABLE_MIN_COLUMNS columns (nodes separated by more than TABLE_COLUMN_GAP), with the
+          columns of consecutive lines starting at the same "left" offsets.
+        - A formula is a run of lines following a line ending with a colon, where the vertical
+          spacing between lines differs from the most common one in the document, and some line
+          has a mathematical symbol (see FORMULA_SYMBOLS_RE) or a node in a smaller font than
+          law text (sub- and superscripts, fractions) which isn't a footnote marker (see
+          FOOTNOTE_MARKER_RE). The run ends where normally spaced law
+          text resumes, which must happen on the same page (otherwise it's rather footnotes,
+          which are handled elsewhere). Lists of points after a colon, however spaced and
+          indented, are law text.
+
+        This catches most tables and formulas without the need to add phrases to
+        SPECIFIC_PHRASES_TO_REMOVE or to remove_formulas().
+
+        Args:
+            xml: The XML to operate on, as a list of tags.
+        """
+        most_common_fontsize = self.find_most_common_fontsize(xml)
+        pages_lines = [self.get_region_lines(page) for page in (xml.find_all("page") or [xml])]
+        pitch = self.find_most_common_line_pitch(pages_lines, most_common_fontsize)
+        for lines in pages_lines:
+            tables = self.find_table_regions(lines)
+            in_table = set(i for start, end in tables for i in xrange(start, end))
+            formulas = [region for region in self.find_formula_regions(lines, pitch,
+                                                                        most_common_fontsize)
+                        if not in_table.intersection(xrange(*region))]
+            for start, end in tables:
+                self.replace_region(lines, start, end, self.TABLE_REPLACEMENT, "table",
+                                    most_common_fontsize)
+            for start, end in formulas:
+                self.replace_region(lines, start, end, self.FORMULA_REPLACEMENT, "formula",
+                                    most_common_fontsize)
+
+    def get_region_lines(self, page):
+        """Group the <text> nodes of a page into lines, for remove_table_and_formula_regions().
+
+        Args:
+            page: The XML of a single page.
+
+        Returns:
+            list: List of lines sorted by "top". Each line is a tuple (top, nodes), where nodes is
+                a list of tuples (left, width, fontsize, node) sorted by "left".
+        """
+        nodes = sorted(((int(node["top"]), int(node["left"]), int(node["width"]),
+                         int(node["fontsize"]), node) for node in page.find_all("text")),
+                       key=lambda item: item[0])
+        lines = []
+        for top, left, width, fontsize, node in nodes:
+            if (not lines) or (top - lines[-1][0] > self.REGION_LINE_TOLERANCE):
+                lines.append((top, []))
+            lines[-1][1].append((left, width, fontsize, node))
+        for _, line_nodes in lines:
+            line_nodes.sort(key=lambda item: item[0])
+        return lines
+
+    def find_most_common_line_pitch(self, pages_lines, most_common_fontsize):
+        """Returns the most common vertical distance between consecutive lines of law text.
 
-    def remove_formulas(self, xml):
+        Args:
+            pages_lines: For each page, list of lines as returned by get_region_lines().
+            most_common_fontsize: The fontsize of law text.
+
+        Returns:
+            int|None: The most common distance, or None if there are no two such lines.
+        """
+        pitches = {}
+        for lines in pages_lines:
+            last_top = None
+            for top, line_nodes in lines:
+                if not any(item[2] == most_common_fontsize for item in line_nodes):
+                    continue
+                if last_top is not None:
+                    pitches[top - last_top] = pitches.get(top - last_top, 0) + 1
+                last_top = top
+        if not pitches:
+            return None
+        return max(pitches, key = pitches.get)
+
+    def get_column_lefts(self, line_nodes):
+        """Returns the "left" offsets of the columns in a line (see TABLE_COLUMN_GAP)."""
+        lefts = []
+        last_right = None
+        for left, width, _, _ in line_nodes:
+            if (last_right is None) or (left - last_right > self.TABLE_COLUMN_GAP):
+                lefts.append(left)
+            last_right = left + width if last_right is None else max(left + width, last_right)
+        return lefts
+
+    def find_table_regions(self, lines):
+        """Returns (start, end) ranges of line indices which form tables.
+
+        Args:
+            lines: List of lines of a page, as returned by get_region_lines().
+
+        Returns:
+            list: List of (start, end) tuples, end exclusive.
+        """
+        regions = []
+        start = None
+        last_lefts = None
+        for i, (_, line_nodes) in enumerate(lines + [(None, [])]):
+            lefts = self.get_column_lefts(line_nodes)
+            is_row = len(lefts) >= self.TABLE_MIN_COLUMNS
+            if is_row and (start is not None) and self.are_columns_aligned(lefts, last_lefts):
+                last_lefts = lefts
+                continue
+            if (start is not None) and (i - start >= self.TABLE_MIN_ROWS):
+                regions.append((start, i))
+            start = i if is_row else None
+            last_lefts = lefts
+        return regions
+
+    def are_columns_aligned(self, lefts, other_lefts):
+        """Checks whether two table rows share at least TABLE_MIN_COLUMNS - 1 column offsets."""
+        shared = 0
+        for left in lefts:
+            if any(abs(left - other) <= self.REGION_LINE_TOLERANCE for other in other_lefts):
+                shared = shared + 1
+        return shared >= self.TABLE_MIN_COLUMNS - 1
+
+    def find_formula_regions(self, lines, pitch, most_common_fontsize):
+        """Returns (start, end) ranges of line indices which form formulas.
+
+        Args:
+            lines: List of lines of a page, as returned by get_region_lines().
+            pitch: The most common vertical distance between lines of law text.
+            most_common_fontsize: The fontsize of law text.
+
+        Returns:
+            list: List of (start, end) tuples, end exclusive.
+        """
+        if pitch is None:
+            return []
+
+        def is_normal_spacing(i):
+            return abs(lines[i][0] - lines[i - 1][0] - pitch) <= self.FORMULA_PITCH_TOLERANCE
+
+        def is_plain_text(i):
+            line_nodes = lines[i][1]
+            return (all(item[2] == most_common_fontsize for item in line_nodes)
+                    and len(self.get_column_lefts(line_nodes)) == 1)
+
+        def has_formula_parts(i):
+            for _, _, fontsize, node in lines[i][1]:
+                text = node.get_text()
+                if self.FORMULA_SYMBOLS_RE.search(text):
+                    return True
+                if fontsize < most_common_fontsize and not self.FOOTNOTE_MARKER_RE.match(text):
+                    return True
+            return False
+
+        regions = []
+        i = 1
+        while i < len(lines):
+            previous_text = u" ".join(item[3].get_text() for item in lines[i - 1][1]).strip()
+            if not (previous_text.endswith(u":") and not is_normal_spacing(i)):
+                i = i + 1
+                continue
+            # Look for the line where plain, normally spaced law text resumes.
+            end = None
+            for j in xrange(i + 1, len(lines) - 1):
+                if is_plain_text(j) and is_plain_text(j + 1) and is_normal_spacing(j + 1):
+                    end = j
+                    break
+            if end is None:
+                break
+            # Formulas have sub- and superscripts, fractions, symbols etc. Otherwise, it's just
+            # unusually spaced or indented law text, e.g. a list of points.
+            if any(has_formula_parts(k) for k in xrange(i, end)):
+                regions.append((i, end))
+            i = end + 1
+        return regions
+
+    def replace_region(self, lines, start, end, replacement, kind, most_common_fontsize):
+        """Remove the <text> nodes of the given lines, except for the first one, which gets
+        the replacement text and is marked with a "region" attribute.
+
+        Args:
+            lines: List of lines of a page, as returned by get_region_lines().
+            start: Index of the first line of the region.
+            end: Index of the line following the region.
+            replacement: The text to put instead of the region.
+            kind: Kind of the region, "table" or "formula".
+            most_common_fontsize: The fontsize of law text.
+        """
+        first_node = lines[start][1][0][3]
+        for _, line_nodes in lines[start:end]:
+            for _, _, _, node in line_nodes:
+                if node is not first_node:
+                    node.extract()
+        first_node.string = replacement
+        first_node["fontsize"] = most_common_fontsize
+        first_node["region"] = kind
+        if start > 0:
+            previous_node = lines[start - 1][1][0][3]
+            first_node["left"] = previous_node["left"]
+            first_node["height"] = previous_node["height"]
+
+    def new_formula_state(self):
+        """Returns the initial state of remove_formulas(), for carrying it over between pages."""
+        return {"is_in_formula": False, "formula_nodes": [], "previous_node_text": u""}
+
+    def remove_formulas(self, xml, state = None):
         """Remove <text> nodes which draw a mathematical formula. We can't parse them at the
         moment. :(
 
         Args:
             xml: The XML to operate on, as a list of tags.
+            state: The state carried over from the previous pages, as returned by
+                new_formula_state(), when the XML holds just a single page. The caller then
+                has to check that the last page doesn't end inside a formula.
         """
-        formula_nodes = []
-        is_in_formula = False
-        previous_node_text = u""
+        last_page = state is None
+        state = self.new_formula_state() if last_page else state
+        formula_nodes = state["formula_nodes"]
+        is_in_formula = state["is_in_formula"]
+        previous_node_text = state["previous_node_text"]
         for node in xml.find_all(name = "text",
                                  attrs = {"fontsize": self.find_most_common_fontsize(xml)}):            
+            if node.has_attr("region"):
+                # Already replaced by remove_table_and_formula_regions().
+                is_in_formula = False
+                formula_nodes = []
+                previous_node_text = u""
+                continue
             node_text = node.get_text().strip().replace("  ", " ")
             # Here is how we catch beginning of formula. Add other phrases if needed.
             # We unfortunately may need to look at previous line, hence the nested ifs...
@@ -372,10 +1750,13 @@ class ImporterPL(Importer):
                     # Remove formula nodes.
                     for formula_node in formula_nodes:
                         formula_node.extract()
+                    formula_nodes = []
                 else:
                     formula_nodes.append(node)
             previous_node_text = node_text
-        if (is_in_formula):
+        state.update(formula_nodes = formula_nodes, is_in_formula = is_in_formula,
+                     previous_node_text = previous_node_text)
+        if (last_page and is_in_formula):
             raise Exception('After iterating through entire law text, parser is inside a formula.')
 
     def remove_specific_unparsable_text_units(self, xml):
@@ -505,6 +1886,55 @@ class ImporterPL(Importer):
                 node["height"] = most_common_height
                 node["top"] = int(node["top"]) - 6
 
+    def sort_text_nodes_in_reading_order(self, xml):
+        """pdftohtml sometimes emits nodes of the main text out of order, e.g. the end of a line
+        before its beginning, or a line before the one above it. This puts them back in reading
+        order, page by page, so that assert_main_text_is_sorted() doesn't fail the import.
+
+        The nodes of a page with the most common font size are clustered into baselines: a node
+        whose "top" is within BASELINE_TOLERANCE of the highest node of the line is on that line,
+        which is how check_main_text_node_is_sorted() tells lines apart too.
+        They're then stably sorted by baseline and "left", and put back in the places the main
+        text nodes had, so the other nodes (e.g. superscripts) stay where they were. Pages in
+        order, which are almost all of them, are left alone. The number of nodes moved is in the
+        "reordered_nodes" diagnostics.
+
+        Args:
+            xml: The XML to operate on, as a list of tags.
+        """
+        # Attributes may be strings or ints, as they're matched by find_all().
+        fontsize = unicode(self.find_most_common_fontsize(xml))
+        # pdftohtml puts all the nodes of a page right in the <page>.
+        pages = {}
+        for node in xml.find_all("text"):
+            if unicode(node.get("fontsize")) == fontsize:
+                pages.setdefault(id(node.parent), []).append(node)
+        moved = 0
+        for nodes in pages.itervalues():
+            parent = nodes[0].parent
+            baselines = {}
+            line_top = None
+            for node in sorted(nodes, key = lambda node: int(node["top"])):
+                top = int(node["top"])
+                if line_top is None or top > line_top + self.BASELINE_TOLERANCE:
+                    line_top = top
+                baselines[id(node)] = line_top
+            ordered = sorted(nodes, key = lambda node: (baselines[id(node)], int(node["left"])))
+            misplaced = sum(1 for node, other in zip(nodes, ordered) if node is not other)
+            if not misplaced:
+                continue
+            moved += misplaced
+            places = set(id(node) for node in nodes)
+            ordered = iter(ordered)
+            contents = [next(ordered) if id(child) in places else child
+                        for child in list(parent.contents)]
+            parent.clear()
+            for child in contents:
+                parent.append(child)
+        if self.diagnostics is not None and moved:
+            self.diagnostics["reordered_nodes"] = (
+                self.diagnostics.get("reordered_nodes", 0) + moved)
+
     def add_line_nums_to_law_text(self, xml):
         """For all <text> tags that represent parts of the law text, add a "line" attribute
         saying which line number a given tag sits, counting from 1. Tags on the same line have
@@ -518,20 +1948,28 @@ class ImporterPL(Importer):
           increasing here is that EITHER of these two must increase with each new tag, and "top"
           must never decrease ("left" may decrease as "top" increases - when moving to new line).
           We ignore the lines that don't conform, assuming they are not the main law text.
-        - Increasing / comparisons of "top" has a tolerance of 2 points. I'm not sure if this
-          is needed, but just in case.
+        - Increasing / comparisons of "top" has a tolerance of BASELINE_TOLERANCE, from the
+          highest node of the line, as in sort_text_nodes_in_reading_order().
           
         Args:
             xml: The XML to operate on, as a list of tags.
         """
-        self.assert_main_text_is_sorted(xml)
+        fast = (self.VALIDATION_LEVEL == "fast")
+        if not fast:
+            self.assert_main_text_is_sorted(xml)
         last_top = 0
         line_num = 0
+        sort_state = {"top": 0, "left": 0, "width": 0}
         for node in xml.find_all(name = "text", 
                                  attrs = {"fontsize": self.find_most_common_fontsize(xml)}):
-            if (int(node["top"]) - 2 > last_top):
-                last_top = int(node["top"])
+            if fast:
+                self.check_main_text_node_is_sorted(node, sort_state)
+            top = int(node["top"])
+            if (top > last_top + self.BASELINE_TOLERANCE):
+                last_top = top
                 line_num = line_num + 1
+            else:
+                last_top = min(top, last_top)
             node["line"] = line_num
                 
     def assert_main_text_is_sorted(self, xml):
@@ -544,25 +1982,56 @@ class ImporterPL(Importer):
             xml: The XML to operate on, as a list of tags.
         """
         most_common_fontsize = self.find_most_common_fontsize(xml)        
-        last_top = 0
-        last_left = 0
-        last_width = 0
+        state = {"top": 0, "left": 0, "width": 0}
         for node in xml.find_all(name = "text", attrs = {"fontsize": most_common_fontsize}):
-            top = int(node["top"])
-            left = int(node["left"])
-            if (top - 2 < last_top) and (top + 2 > last_top):
-                # In theory, the condition should be "if (left <= last_left + last_width):"
-                # But in practice, this happens (e.g. "ustawa o sejmowej komisji śledczej").
-                if (left < last_left + last_width - 1):
-                    raise Exception("Non-increasing 'left' attribute: [" + str(left) 
-                        + "] at node (last_left = [" + str(last_left) + "]): \n" + str(node)) 
-            elif (top > last_top):
-                last_top = top
-            else:
-                raise Exception("Non-increasing 'top' attribute: [" + str(top) 
-                    + "] at node (last_top = [" + str(last_top) + "]): \n" + str(node))
-            last_left = left
-            last_width = int(node["width"])
+            self.check_main_text_node_is_sorted(node, state)
+
+    def check_main_text_node_is_sorted(self, node, state):
+        """Raises if the given node of the main text doesn't come after the previous one (see
+        assert_main_text_is_sorted()).
+
+        A node is on the line of the previous one if its "top" is within BASELINE_TOLERANCE of
+        the highest node of that line, so that any line sorted by
+        sort_text_nodes_in_reading_order() passes, whichever of its nodes comes first.
+
+        Args:
+            node: The <text> node to check.
+            state: Dict with "top" of the highest node of the line of the previous node, and
+                "left" and "width" of the previous node, updated in place.
+        """
+        top = int(node["top"])
+        left = int(node["left"])
+        if abs(top - state["top"]) <= self.BASELINE_TOLERANCE:
+            # In theory, the condition should be "if (left <= last_left + last_width):"
+            # But in practice, this happens (e.g. "ustawa o sejmowej komisji śledczej").
+            if (left < state["left"] + state["width"] - 1):
+                raise Exception("Non-increasing 'left' attribute: [" + str(left) 
+                    + "] at node (last_left = [" + str(state["left"]) + "])"
+                    + self.node_page_info(node) + ": \n" + str(node)) 
+            state["top"] = min(top, state["top"])
+        elif (top > state["top"]):
+            state["top"] = top
+        else:
+            raise Exception("Non-increasing 'top' attribute: [" + str(top) 
+                + "] at node (last_top = [" + str(state["top"]) + "])"
+                + self.node_page_info(node) + ": \n" + str(node))
+        state["left"] = left
+        state["width"] = int(node["width"])
+
+    def node_page_info(self, node):
+        """Returns the part of an error message saying which page the given node is on, or an
+        empty string if the XML isn't split into pages.
+
+        Args:
+            node: The node the error is about.
+
+        Returns:
+            str: E.g. " on page [12]".
+        """
+        page = node.find_parent("page")
+        if page is None or not page.has_attr("number"):
+            return ""
+        return " on page [" + page["number"] + "]"
 
     def find_most_common_fontsize(self, xml):
         """Returns the fontsize value that most of <text> nodes in the doc have.
@@ -573,6 +2042,8 @@ class ImporterPL(Importer):
         Returns:
             int: The font size value that most of <text> nodes have.
         """
+        if self.layout_stats is not None:
+            return self.layout_stats.most_common_fontsize
         fontsizes = {}
         for node in xml.find_all("text"):
             fontsize = int(node["fontsize"])
@@ -591,6 +2062,8 @@ class ImporterPL(Importer):
         Returns:
             int: The height value that most of <text> nodes have.
         """
+        if self.layout_stats is not None:
+            return self.layout_stats.most_common_height
         heights = {}
         for node in xml.find_all("text"):
             height = int(node["height"])
@@ -680,207 +2153,6 @@ class ImporterPL(Importer):
             if (int(node["fontsize"]) != most_common_fontsize):
                 node.extract()
 
-    # Commented out because it's too hard parse outgoing and upcoming sections for now.
-    # Instead of this, remove_outgoing_and_upcoming_section_markers() was added.
-    """
-    def undecorate_outgoing_and_upcoming_sections(self, xml):
-        In ISAP unified texts, when a given article, etc is changing on some future date, they
-        first print the current version in italics and inside '[ ... ]' markers, and immediately
-        after, they print the upcoming version in bold and inside '< ... >' markers.
-
-        This function removes the '[', ']', '<', '>' markers. We rely on the person doing manual
-        post-processing to remove the section that's currently not effective and leave the section
-        that's currently in force.
-
-        Note that we don't currently catch cases when the outgoing/upcoming sections happen inline,
-        for example like this: "2) w okresie między dniem 1 stycznia następnego roku 
-        a [terminem określonym dla złożenia] <upływem terminu określonego na złożenie> zeznania..".
-        
-        Examples of situations this has to deal with (all are checked in test_importer_pl.py):
-        
-        1. Ustawa z dnia 12 października 1990 r. o Straży Granicznej
-           Art. 5aa is coming into force
-           Note here the line with *2* <b> markers (starts "podległych ...").
-           
-        <text ...>3)  BSWSG wykonuje Komendant BSWSG. </text> # This is end of previous unit.
-        <text ...><b>&lt;Art. 5aa. 1.  Komendant  Główny  Straży  Granicznej  może  upoważnić </b></text>
-        <text ...><b>podległych  funkcjonariuszy  lub  pracowników  do  załatwiania</b> <b>spraw  w jego </b></text>
-        <text ...><b>imieniu w określonym zakresie. </b></text>
-        <text ...><b>2. Komendant  oddziału  Straży  Granicznej  może  upoważnić  podległych </b></text>
-        <text ...><b>funkcjonariuszy  pełniących  służbę  w terytorialnym  zasięgu  działania  oddziału </b></text>
-        <text ...><b>lub pracowników do załatwiania spraw w jego imieniu w określonym zakresie. </b></text>
-        <text ...><b>3. Upoważnienia,  o których  mowa  w ust. 1  i 2,  mogą  być  udzielone,  jeżeli </b></text>
-        <text ...><b>zakres  danego  upoważnienia  nie  został  określony  w ustawie  albo  w przepisach </b></text>
-        <text ...><b>wydanych na podstawie ustawy.&gt;</b> </text>
-        <text ...><b>Art. 5b.</b> Kierownicy ... </text> # This is start of next unit.
-        
-        2. Ustawa z dnia 12 października 1990 r. o Straży Granicznej
-           Old version of Art. 16g is being retired.
-           Note here <b></b> inside <i></i>.
-        
-        <text ...><i>zezwolenia ... ostateczna.] </i></text> # This is end of previous unit.
-        <text ...><i>[<b>Art. 16g.</b></i></text>
-        <text ...><i>1.  Organy  administracji  miar  są  uprawnione  do  przeprowadzania </i></text>
-        <text ...><i>kontroli  podmiotów  i przedsiębiorców,  o których  mowa  w art. 16a  i art. 16c, </i></text>
-        <text ...><i>w zakresie  spełniania  warunków  niezbędnych  do  wykonywania  udzielonych </i></text>
-        <text ...><i>upoważnień i zezwoleń oraz przestrzegania przepisów ustawy. </i></text>
-        <text ...><i>2. Do  kontroli  upoważnionych  podmiotów  i uprawnionych  przedsiębiorców </i></text>
-        <text ...><i>stosuje się odpowiednio przepisy art. 21 ust. 1 pkt 1 i 4, ust. 2 i 4.] </i></text>
-        <text ...><b>&lt;Art. 16g. Organy ... </b></text> # This is start of next unit.
-        
-        3. Ustawa z dnia 27 sierpnia 2004 r. o świadczeniach opieki zdrowotnej finansowanych 
-           ze środków publicznych
-           Art. 20, ust. 1 is changing
-           Note here that in one <text> node we have <b>Art. 20.</b> and <i>...</i>.
-        
-        <text ...><b>przepisy ... &gt; </b></text> # This is end of previous unit.
-        <text ...><b>Art. 20.</b> <i>[1.  Świadczenia  opieki  zdrowotnej  w szpitalach  i świadczenia </i></text>
-        <text ...><i>specjalistyczne w ambulatoryjnej opiece zdrowotnej są udzielane według kolejności </i></text>
-        <text ...><i>zgłoszenia  w dniach  i godzinach  ich  udzielania  przez  świadczeniodawcę,  który </i></text>
-        <text ...><i>zawarł umowę o udzielanie świadczeń opieki zdrowotnej.]</i> </text>
-        <text ...><b>&lt;1. Świadczenia </b></text>
-        <text ...><b>opieki </b></text>
-        <text ...><b>zdrowotnej </b></text>
-        <text ...><b>w szpitalach, </b></text>
-        <text ...><b>świadczenia </b></text>
-        <text ...><b>specjalistyczne  w ambulatoryjnej  opiece  zdrowotnej  oraz  stacjonarne </b></text>
-        <text ...><b>i całodobowe  świadczenia  zdrowotne  inne  niż  szpitalne  są  udzielane  według </b></text>
-        <text ...><b>kolejności  zgłoszenia  w dniach  i godzinach  ich  udzielania  przez </b></text>
-        <text ...><b>świadczeniodawcę,  który  zawarł  umowę  o udzielanie  świadczeń  opieki </b></text>
-        <text ...><b>zdrowotnej.&gt; </b></text>
-        <text ...>1a. Na  liście  ... </text> # This is start of next unit.
-        
-        4. Ustawa z dnia 15 lipca 2011 r. o zawodach pielęgniarki i położnej
-           In Art. 80, ust 8, pkt 1 a few words inside a sentence are changing.
-        
-        <text ...>8. Potwierdzenia, o którym mowa w ust. 7, dokonuje się na podstawie wniosku </text>
-        <text ...>o nadanie uprawnień: </text>
-        <text ...>1)  podpisanego  kwalifikowanym  podpisem  elektronicznym  <i>[lub  podpisem </i></text>
-        <text ...><i>zaufanym]</i> <b>&lt;podpisem zaufanym lub podpisem osobistym&gt;</b> lub </text>
-        <text ...>2)  potwierdzonego  przez  właściwą  okręgową  izbę  pielęgniarek  i  położnych  lub </text>
-        <text ...>Naczelną  Izbę  Pielęgniarek  i  Położnych  w  zakresie  danych  podmiotu </text>
-        <text ...>zamierzającego wykonywać działalność w zakresie kształcenia podyplomowego, </text>
-        <text ...>o którym mowa w ust. 1. </text>
-        
-        5. Ustawa z dnia 16 lipca 2004 r. Prawo telekomunikacyjne
-        
-        <text ...><b>Art. 61a.</b> <i>[1. Jeżeli konieczność wprowadzenia zmiany warunków umowy, w tym </i></text>
-        <text ...><i>określonych </i></text>
-        <text ...><i>w regulaminie </i></text>
-        <text ...><i>świadczenia </i></text>
-        <text ...><i>publicznie </i></text>
-        <text ...><i>dostępnych </i></text>
-        <text ...><i>usług </i></text>
-        <text ...><i>telekomunikacyjnych lub w cenniku usług telekomunikacyjnych, wynika wyłącznie ze </i></text>
-        <text ...><i>zmiany stawki podatku od towarów i usług stosowanej dla usług telekomunikacyjnych, </i></text>
-        <text ...><i>dostawca  publicznie  dostępnych  usług  telekomunikacyjnych  wykonuje  obowiązki, </i></text>
-        <text ...><i>o których  mowa  w art. 60a  ust. 1  i 1b  oraz  art. 61  ust. 5  i 5a,  poprzez  podanie  do </i></text>
-        <text ...><i>publicznej  wiadomości  informacji:]</i> <b>&lt;Jeżeli  konieczność  wprowadzenia  zmiany </b></text>
-        <text ...><b>warunków  umowy,  w tym  określonych  w regulaminie  świadczenia  publicznie </b></text>
-        <text ...><b>dostępnych </b></text>
-        <text ...><b>usług </b></text>
-        <text ...><b>telekomunikacyjnych </b></text>
-        <text ...><b>lub </b></text>
-        <text ...><b>w cenniku </b></text>
-        <text ...><b>usług </b></text>
-        <text ...><b>telekomunikacyjnych, wynika wyłącznie ze zmiany stawki podatku od towarów </b></text>
-        <text ...><b>i usług  stosowanej  dla  usług  telekomunikacyjnych,  dostawca  publicznie </b></text>
-        <text ...><b>dostępnych  usług  telekomunikacyjnych  wykonuje  obowiązki,  o których  mowa </b></text>
-        <text ...><b>w art. 60a ust. 1 i 1b oraz art. 61 ust. 5 i 5a, przez publikację na swojej stronie </b></text>
-        <text ...><b>internetowej informacji:&gt;</b> </text>
-        <text ...>1)  o  zmianie  warunków  umowy,  w tym  określonych  w regulaminie  świadczenia </text>
-        <text ...>publicznie  dostępnych  usług  telekomunikacyjnych,  zmianie  w cenniku  usług </text>
-        <text ...>telekomunikacyjnych, terminie ich wprowadzenia, wraz ze wskazaniem miejsca </text>
-        <text ...>udostępnienia  treści  zmiany  lub  warunków  umowy  lub  cennika </text>
-        <text ...>uwzględniających tę zmianę; </text>
-        <text ...>2)  o prawie wypowiedzenia umowy przez abonenta w przypadku braku akceptacji </text>
-        <text ...>tych zmian; </text>
-
-        6. Ustawa z dnia 25 sierpnia 2006 r. o biokomponentach i biopaliwach ciekłych (Art. 23)
-        Note how someone at ISAP excluded ".&gt;" from <b></b>.
-
-        <text ...>ciekłych i biopaliw ciekłych. </text> # This is end of previous unit.
-        <text ...><b>&lt;1d.  Podmiot  realizujący  Narodowy  Cel  Wskaźnikowy  może  zrealizować </b></text>
-        <text ...><b>obowiązek,  o którym  mowa  w ust. 1,  z wykorzystaniem  biokomponentów </b></text>
-        <text ...><b>zawartych w paliwach powstałych w wyniku współuwodornienia. </b></text>
-        <text ...><b>1e. Minister właściwy do spraw energii określi, w drodze rozporządzenia, </b></text>
-        <text ...><b>metodykę  obliczania  zawartości  biokomponentów  zawartych  w paliwach </b></text>
-        <text ...><b>powstałych  w wyniku  współuwodornienia,  biorąc  pod  uwagę  stan  wiedzy </b></text>
-        <text ...><b>technicznej  w tym  zakresie  wynikający  z badań  tych  paliw  lub  doświadczenia </b></text>
-        <text ...><b>w ich stosowaniu</b>.&gt;<b> </b></text>
-        <text ...>2. Minimalny udział, o którym mowa w ust. 1: </text> # This is start of next unit.
-
-        Args:
-            xml: The XML to operate on, as a list of tags.
-
-
-        is_in_outgoing_part = False
-        is_in_upcoming_part = False
-        for node in xml.find_all('text'):
-            i_tags = node.find_all('i') # Find italics.
-            b_tags = node.find_all('b') # Find bold.
-
-            # Get the following texts without any tags, with and without whitespaces:
-            # (1) entire text in the node,
-            # (2) concatenated text pieces in all <i> tags,
-            # (3) concatenated text pieces in all <b> tags.
-            text = node.get_text().strip()
-            text_no_whitespace = node.get_text().replace(" ", "")
-            itext_no_whitespace = ""
-            itext = ""
-            for i_tag in i_tags:
-                itext_no_whitespace = itext_no_whitespace + i_tag.get_text().replace(" ", "")
-                itext = itext + i_tag.get_text().strip()
-            btext_no_whitespace = ""
-            btext = ""
-            for b_tag in b_tags:
-                btext_no_whitespace = btext_no_whitespace + b_tag.get_text().replace(" ", "")
-                btext = btext + b_tag.get_text().strip()
-
-            if (is_in_outgoing_part and is_in_upcoming_part):
-                raise Exception("Impossible to be in outgoing and upcoming section at same time.")
-            elif (is_in_outgoing_part and not is_in_upcoming_part):
-                # For a line fully belonging to an outgoing section.
-                if (itext_no_whitespace == text_no_whitespace):
-                    if text.endswith("]"):
-                        is_in_outgoing_part = False
-                        node.string = text.rstrip("]")
-                # For a line combining outgoing section and upcoming section (see the method
-                # comment, example from "Ustawa z dnia 16 lipca 2004 r. Prawo telekomunikacyjne").
-                elif ((itext_no_whitespace + btext_no_whitespace == text_no_whitespace) 
-                      and itext.endswith("]") and btext.startswith("<")):
-                    is_in_outgoing_part = False
-                    node.string = itext.rstrip("]") + u" " + btext.lstrip("<").rstrip(">")
-                    if not btext.endswith(">"): # Needed in case upcoming section is one line only.
-                        is_in_upcoming_part = True
-                else:
-                    raise Exception("Expected italics while being in outgoing section.")
-            elif (not is_in_outgoing_part and is_in_upcoming_part):
-                if ((btext_no_whitespace == text_no_whitespace)
-                    # In case someone excludes ".&gt;" from <b></b> markers.
-                    or (btext_no_whitespace + u".>") == text_no_whitespace):                    
-                    if text.endswith(">"):
-                        is_in_upcoming_part = False
-                        node.string = text.rstrip(">")
-                else:
-                    raise Exception("Expected bold while being in upcoming section.")
-            else:
-                if (itext_no_whitespace == text_no_whitespace) and text.startswith("["):
-                    node.string = text.lstrip("[").rstrip("]")
-                    if not text.endswith("]"): # Needed in case outgoing section is one line only.
-                        is_in_outgoing_part = True
-                elif (btext_no_whitespace == text_no_whitespace) and text.startswith("<"):
-                    node.string = text.lstrip("<").rstrip(">")
-                    if not text.endswith(">"): # Needed in case upcoming section is one line only.
-                        is_in_upcoming_part = True
-                # For cases like: "<text ...><b>Art. 22c.</b> <i>[1. Some text </i></text>."
-                elif ((btext_no_whitespace + itext_no_whitespace == text_no_whitespace)
-                    and btext.startswith("Art.") and itext.startswith("[")):
-                    node.string = btext + u" " + itext.lstrip("[").rstrip("]")
-                    if not itext.endswith("]"): # Needed in case outgoing section is one line only.
-                        is_in_outgoing_part = True
-    """
-
     def assert_only_text_nodes_with_most_common_fontsize_left(self, xml):
         """Asserts that all <text> nodes have the most common fontsize.
         
@@ -889,23 +2161,45 @@ class ImporterPL(Importer):
         """
         most_common_fontsize = self.find_most_common_fontsize(xml)  
         for node in xml.find_all("text"):
-            if int(node["fontsize"]) != most_common_fontsize:
-                raise Exception("Found <text> node not having most common font size:\n" + str(node))
+            self.check_text_node_has_fontsize(node, most_common_fontsize)
+
+    def check_text_node_has_fontsize(self, node, fontsize):
+        """Raises if the given <text> node doesn't have the given font size.
+
+        Args:
+            node: The <text> node to check.
+            fontsize: The expected font size.
+        """
+        if int(node["fontsize"]) != fontsize:
+            raise Exception("Found <text> node not having most common font size"
+                            + self.node_page_info(node) + ":\n" + str(node))
 
     def join_text_nodes_on_same_lines(self, xml):
         """Concatenates nodes that are on the same line. Note that this may remove HTML formatting
         inside nodes.
 
+        In the "fast" validation level, this also checks the invariants of
+        assert_only_text_nodes_with_most_common_fontsize_left() and
+        assert_each_text_node_has_increasing_line_attr().
+
         Args:
             xml: The XML to operate on, as a list of tags.
         """
+        fast = (self.VALIDATION_LEVEL == "fast")
+        if fast:
+            most_common_fontsize = self.find_most_common_fontsize(xml)
         last_node = None
         for node in xml.find_all("text"):
             if node.has_attr("line"):
                 last_node = node
                 break
         for node in xml.find_all("text"):
+            if fast:
+                self.check_text_node_has_fontsize(node, most_common_fontsize)
             if not node.has_attr("line"):
+                if fast:
+                    raise Exception("Missing 'line' attribute" + self.node_page_info(node)
+                                    + ":\n" + str(node))
                 continue
             if int(node["line"]) > int(last_node["line"]):
                 last_node = node
@@ -915,6 +2209,10 @@ class ImporterPL(Importer):
                 last_node.string = last_node.get_text().strip() + " " + node.get_text().strip()
                 last_node["width"] = int(last_node["width"]) + int(node["width"])
                 node.extract()
+            elif fast and (node is not last_node):
+                # The node stays, but its line isn't greater than the line of the node before.
+                raise Exception("Non-increasing 'line' attribute" + self.node_page_info(node)
+                                + ":\n" + str(node))
     
     def assert_each_text_node_has_increasing_line_attr(self, xml):
         """Asserts that:
@@ -928,9 +2226,11 @@ class ImporterPL(Importer):
         last_line = 0
         for node in xml.find_all("text"):
             if not node.has_attr("line"):
-                raise Exception("Missing 'line' attribute:\n" + str(node))
+                raise Exception("Missing 'line' attribute" + self.node_page_info(node)
+                                + ":\n" + str(node))
             if int(node["line"]) <= last_line:
-                raise Exception("Non-increasing 'line' attribute:\n" + str(node))
+                raise Exception("Non-increasing 'line' attribute" + self.node_page_info(node)
+                                + ":\n" + str(node))
             last_line = int(node["line"])
 
     def add_indent_info_for_dashed_lines(self, xml):
@@ -951,8 +2251,17 @@ class ImporterPL(Importer):
         Args:
             xml: The XML to operate on, as a list of tags.
         """
+        self.add_indent_levels(xml)
+        self.join_dash_lines(xml, {})
+        self.remove_indent_info_except_for_dashed_lines(xml)
 
-        # For each line, add its indent level.
+    def add_indent_levels(self, xml):
+        """For each line, add its indent level, both as "indent" attribute and as plaintext
+        prefix (see add_indent_info_for_dashed_lines()).
+
+        Args:
+            xml: The XML to operate on, as a list of tags.
+        """
         indent_levels = self.get_all_indent_levels(xml)
         for node in xml.find_all('text'):
             left = int(node["left"])
@@ -961,12 +2270,19 @@ class ImporterPL(Importer):
                 node["indent"] = indent_level
                 node.string = "@@INDENT" + str(indent_level) + "@@" + node.get_text().strip()
 
-        # Check all line starts. If they begin with a dash, and the dash is just in a running
-        # piece of text (as opposed to e.g. a list of tirets, or explanatory section at the end
-        # of a list of points) - then move the dash to the line above.
-        last_seen_top = 0
-        last_line_start = None
-        last_node = None
+    def join_dash_lines(self, xml, state):
+        """Check all line starts. If they begin with a dash, and the dash is just in a running
+        piece of text (as opposed to e.g. a list of tirets, or explanatory section at the end
+        of a list of points) - then move the dash to the line above.
+
+        Args:
+            xml: The XML to operate on, as a list of tags.
+            state: Dict with the last nodes seen, carried over between pages when the XML
+                holds just a single page. Empty at the start of the document.
+        """
+        last_seen_top = state.get("last_seen_top", 0)
+        last_line_start = state.get("last_line_start")
+        last_node = state.get("last_node")
         for node in xml.find_all("text"):
             if (int(node["top"]) > last_seen_top):
                 if ((not last_node is None) and (not last_line_start is None)
@@ -978,8 +2294,15 @@ class ImporterPL(Importer):
                 last_line_start = node
                 last_seen_top = int(node["top"])
             last_node = node
+        state.update(last_seen_top = last_seen_top, last_line_start = last_line_start,
+                     last_node = last_node)
+
+    def remove_indent_info_except_for_dashed_lines(self, xml):
+        """Remove indent info for all lines except ones still starting with dash.
 
-        # Remove indent info for all lines except ones still starting with dash.
+        Args:
+            xml: The XML to operate on, as a list of tags.
+        """
         for node in xml.find_all("text"):
             if not re.match(self.DASH_PREFIX_WITH_INDENT, node.get_text()):
                 node.string = re.sub(r"^@@INDENT\d@@", "", node.get_text().strip())
@@ -995,28 +2318,91 @@ class ImporterPL(Importer):
         """
 
         # Get list of indent levels, with corresponding "left" attribute.
-        last_seen_top = 0
-        lefts = {}
-        for node in xml.find_all('text'):
-            if (int(node["top"]) <= last_seen_top):
+        if self.layout_stats is not None:
+            stats = self.layout_stats
+            lefts = stats.line_start_lefts.get(stats.most_common_fontsize, {})
+        else:
+            last_seen_top = 0
+            lefts = {}
+            for node in xml.find_all('text'):
+                if (int(node["top"]) <= last_seen_top):
+                    continue
+                last_seen_top = int(node["top"])
+                left = int(node["left"])
+                lefts[left] = ((lefts[left] + 1) if lefts.has_key(left) else 1)
+
+        if self.layout_stats is not None and self.layout_stats.indent_profile is not None:
+            return self.layout_stats.indent_profile
+        profile = self.find_indent_profile(lefts)
+        if self.layout_stats is not None:
+            self.layout_stats.indent_profile = profile
+        if self.diagnostics is not None:
+            self.diagnostics["indent_levels"] = {"source": profile.source, "levels": list(profile)}
+        return profile
+
+    def find_indent_profile(self, lefts):
+        """Finds the indent levels of a document from the histogram of "left" attributes of its
+        line starts. If the leftmost line starts at the first level of one of
+        KNOWN_INDENT_PROFILES, that's the one. Otherwise, the levels are inferred by
+        infer_indent_levels().
+
+        Args:
+            lefts: Map from "left" attribute of line starts to their number.
+
+        Returns:
+            IndentProfile: The indent levels.
+        """
+        if not lefts:
+            raise Exception('Could not find any lines to get indent levels from.')
+        for name in self.KNOWN_INDENT_PROFILES:
+            levels = getattr(self, name)
+            if min(lefts) == levels[0]:
+                return IndentProfile(levels, self.INDENT_TOLERANCE, name)
+        return IndentProfile(self.infer_indent_levels(lefts), self.INDENT_TOLERANCE, "inferred")
+
+    def infer_indent_levels(self, lefts):
+        """Infers indent levels from the histogram of "left" attributes of line starts, using
+        simple 1-D peak clustering: neighboring "left" values (see INDENT_CLUSTER_GAP) make up a
+        peak, placed at its most common value. Peaks too small to matter are dropped, the
+        leftmost remaining one is indent level 0, and peaks too far right to be indents (e.g.
+        centered headings) are dropped too. Levels missing in the document (e.g. there are lines
+        at levels 0 and 2 only) are filled in, so that the level numbers mean the same as in
+        documents matching KNOWN_INDENT_PROFILES.
+
+        Args:
+            lefts: Map from "left" attribute of line starts to their number.
+
+        Returns:
+            list: Increasing list of indent levels.
+        """
+        min_count = max(1, int(sum(lefts.values()) * self.INDENT_PEAK_MIN_SHARE))
+        peaks = []
+        # Each cluster is a list: [last left, total count, most common left, its count].
+        cluster = None
+        for left, count in sorted(lefts.items()):
+            if cluster is not None and left - cluster[0] <= self.INDENT_CLUSTER_GAP:
+                cluster[0] = left
+                cluster[1] += count
+                if count > cluster[3]:
+                    cluster[2:] = [left, count]
                 continue
-            last_seen_top = int(node["top"])
-            left = int(node["left"])
-            lefts[left] = ((lefts[left] + 1) if lefts.has_key(left) else 1)
-
-        # Sort by the "left" offset.
-        lefts = sorted(lefts.items(), key=lambda x: x[0])
-        # Check which of the two options of indent levels we have.
-        lefts = [item[0] for item in lefts]
-        if (lefts[0] == 96):
-            return self.INDENT_LEVELS1
-        if (lefts[0] == 76):
-            return self.INDENT_LEVELS2
-        if (lefts[0] == 77):
-            return self.INDENT_LEVELS3
-        if (lefts[0] == 80):
-            return self.INDENT_LEVELS4
-        raise Exception('Could not match any indent level set to the document.')
+            if cluster is not None and cluster[1] >= min_count:
+                peaks.append(cluster[2])
+            cluster = [left, count, left, count]
+        if cluster[1] >= min_count:
+            peaks.append(cluster[2])
+
+        max_left = (peaks[0] + (self.INDENT_MAX_LEVELS - 1) * self.INDENT_STEP
+                    + self.INDENT_TOLERANCE)
+        levels = [peaks[0]]
+        for peak in peaks[1:]:
+            if peak > max_left:
+                break
+            missing = int(round(float(peak - levels[-1]) / self.INDENT_STEP)) - 1
+            step = float(peak - levels[-1]) / (missing + 1)
+            levels.extend(int(round(levels[-1] + step * (i + 1))) for i in xrange(missing))
+            levels.append(peak)
+        return levels[:self.INDENT_MAX_LEVELS]
 
     def get_indent_level(self, left, indents):
         """For a given value of "left" parameter of an XML node and list of increasing indent
@@ -1029,17 +2415,15 @@ class ImporterPL(Importer):
 
         Args:
             left: The value of the "left" attribute (offset from left edge of PDF page).
-            indents: One-dimensional increasing list of indent levels found in the PDF.
+            indents: One-dimensional increasing list of indent levels found in the PDF,
+                preferably an IndentProfile, so that the lookup table isn't built every time.
 
         Returns:
             int|None: Index of the indent in the list, or None if not found.
         """
-        idx = 0
-        for indent in indents:
-            if ((left - 13) < indent) and ((left + 13) > indent):
-                return idx
-            idx = idx + 1
-        return None
+        if not isinstance(indents, IndentProfile):
+            indents = IndentProfile(indents, self.INDENT_TOLERANCE)
+        return indents.level_of(left)
     
     def should_join_dash_line(self, node, last_node, last_line_start):
         """Returns whether text in param node starts with a dash, and if so, whether it should be
@@ -1171,3 +2555,21 @@ class ImporterPL(Importer):
         for line in text.splitlines():
             result = result + line.strip() + "\n"
         return result
+
+
+_page_worker = None
+_page_buffer = None
+
+
+def init_page_worker(importer_class, config, path):
+    """Sets up the importer of a worker process of the "parallel" import mode, and maps the
+    PageBuffer with the pages of the document."""
+    global _page_worker, _page_buffer
+    _page_worker = importer_class()
+    for name, value in config.iteritems():
+        setattr(_page_worker, name, value)
+    _page_buffer = PageBuffer(path)
+
+
+def reformat_pages_in_worker(index):
+    return _page_worker.reformat_pages(_page_buffer[index])
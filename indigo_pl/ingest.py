@@ -0,0 +1,402 @@
+# -*- coding: utf-8 -*-
+import ctypes
+import ctypes.util
+import hashlib
+import json
+import logging
+import os
+import re
+import select
+import struct
+import time
+from datetime import date
+from multiprocessing import Pool
+
+from indigo_pl.metrics import exception_message
+
+log = logging.getLogger(__name__)
+
+ISAP_FILENAME_RE = re.compile(r"^(?P<journal>[DM])(?P<year>\d{4})(?P<poz>\d+)(?:L\w*)?\.pdf$",
+                              re.IGNORECASE)
+"""Regex catching the names of PDFs downloaded from ISAP, e.g. "D20161579Lj.pdf" for the
+unified text of Dz.U. 2016 poz. 1579."""
+
+JOURNAL_KEYS = {"D": "dzu", "M": "mp"}
+"""Map from the journal letter of ISAP file names to the journal part of work keys."""
+
+
+def work_key(filename):
+    """Returns the key of the work the given PDF is a version of, used as the name of its output
+    directory.
+
+    Args:
+        filename: Name of the PDF, e.g. "D20161579Lj.pdf".
+
+    Returns:
+        str: E.g. "dzu-2016-1579", or the name without extension if it's not an ISAP name.
+    """
+    match = ISAP_FILENAME_RE.match(filename)
+    if not match:
+        return os.path.splitext(filename)[0]
+    return "%s-%s-%d" % (JOURNAL_KEYS[match.group("journal").upper()], match.group("year"),
+                         int(match.group("poz")))
+
+
+def fingerprint(path):
+    """Returns the SHA-1 of the file's content, as hex."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_atomic(path, data):
+    """Writes the file so that readers never see it half-written."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.rename(tmp_path, path)
+
+
+def write_expressions(importer, text, work_dir, digest, today=None):
+    """Writes "<digest>@<date>.txt" with the plain text of the act as in force from the date on,
+    for today and each later date on which a change in the unified text comes into force (see
+    ExpressionMaterializer). Nothing is written for acts without such changes.
+
+    Args:
+        importer: The ImporterPL.
+        text: String containing XML produced by ImporterPL.pdf_to_text().
+        work_dir: The output directory of the work.
+        digest: Fingerprint of the PDF.
+        today: The first date, or None for today.
+
+    Returns:
+        dict: Map from the dates, in ISO format, to the names of the files.
+    """
+    from indigo_pl.expressions import ExpressionMaterializer
+
+    materializer = ExpressionMaterializer(importer, text)
+    if not materializer.effective_dates:
+        return {}
+    names = {}
+    for day, expression in materializer.expressions(today or date.today()).iteritems():
+        names[day.isoformat()] = "%s@%s.txt" % (digest, day.isoformat())
+        write_atomic(os.path.join(work_dir, names[day.isoformat()]), expression.encode('utf-8'))
+    return names
+
+
+def ingest_pdf(path, digest, work_dir, artifacts=None):
+    """Imports one PDF with ImporterPL, writing the results to the work's output directory:
+    "<digest>.txt" with the plain text ready to be parsed, "<digest>@<date>.txt" with the text
+    in force from each date on if some changes come into force later (see write_expressions()),
+    "<digest>.json" with the status, and "latest.json" with the status of the last successful
+    import. Runs in a worker process.
+
+    Args:
+        path: Path to the PDF.
+        digest: Fingerprint of the PDF.
+        work_dir: The output directory of the work.
+        artifacts: Path to the ArtifactStore to keep the intermediates of the import in, under
+            the work key and the fingerprint, or None not to keep them.
+
+    Returns:
+        dict: The status.
+    """
+    from indigo_pl.artifacts import ArtifactStore
+    from indigo_pl.importer import ImporterPL
+
+    importer = ImporterPL()
+    if artifacts:
+        importer.artifact_store = ArtifactStore(artifacts)
+        importer.artifact_key = (os.path.basename(work_dir), digest)
+    stat = os.stat(path)
+    status = {
+        "source": path,
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "fingerprint": digest,
+        "started_at": time.time(),
+    }
+    try:
+        with open(path, 'rb') as f:
+            xml = importer.pdf_to_text(f)
+            text = importer.reformat_text(xml)
+        write_atomic(os.path.join(work_dir, digest + ".txt"), text.encode('utf-8'))
+        status["expressions"] = write_expressions(importer, xml, work_dir, digest)
+        status["ok"] = True
+    except Exception as e:
+        log.exception("Importing %s failed", path)
+        status["ok"] = False
+        status["error"] = exception_message(e)
+    finally:
+        if importer.artifact_store is not None:
+            importer.artifact_store.close()
+    status["finished_at"] = time.time()
+    status["diagnostics"] = importer.diagnostics
+    data = json.dumps(status, indent=2, sort_keys=True)
+    write_atomic(os.path.join(work_dir, digest + ".json"), data)
+    if status["ok"]:
+        write_atomic(os.path.join(work_dir, "latest.json"), data)
+    return status
+
+
+class PollingWatcher(object):
+    """ Finds new and changed files by listing the directory tree every now and then.
+    """
+
+    def __init__(self, directory, interval):
+        self.directory = directory
+        self.interval = interval
+        self.seen = {}
+        self.last_scan = None
+
+    def changes(self, timeout):
+        """Waits up to timeout seconds, and returns the set of paths of files which changed
+        since the last call, or all files on the first call.
+        """
+        if self.last_scan is not None:
+            time.sleep(max(0, min(timeout, self.last_scan + self.interval - time.time())))
+        if self.last_scan is not None and time.time() < self.last_scan + self.interval:
+            return set()
+        self.last_scan = time.time()
+        changed = set()
+        current = {}
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                current[path] = (stat.st_size, stat.st_mtime)
+                if self.seen.get(path) != current[path]:
+                    changed.add(path)
+        self.seen = current
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+    """ Finds new and changed files using Linux inotify, through ctypes, so that files are seen
+    as soon as they land. The first call to changes() returns all existing files.
+    """
+
+    IN_MODIFY = 0x2
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_ISDIR = 0x40000000
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init failed")
+        self.watches = {}
+        self.initial = set()
+        for root, dirs, files in os.walk(directory):
+            self.add_watch(root)
+            self.initial.update(os.path.join(root, name) for name in files)
+
+    def add_watch(self, directory):
+        mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        wd = self.libc.inotify_add_watch(self.fd, directory.encode('utf-8'), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed for " + directory)
+        self.watches[wd] = directory
+
+    def changes(self, timeout):
+        if self.initial:
+            changed, self.initial = self.initial, set()
+            return changed
+        changed = set()
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return changed
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0").decode('utf-8', 'replace')
+            offset += length
+            if wd not in self.watches or not name:
+                continue
+            path = os.path.join(self.watches[wd], name)
+            if mask & self.IN_ISDIR:
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    for root, dirs, files in os.walk(path):
+                        self.add_watch(root)
+                        changed.update(os.path.join(root, f) for f in files)
+            else:
+                changed.add(path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+def create_watcher(directory, use_inotify=True, poll_interval=2.0):
+    """Returns an InotifyWatcher for the directory if possible, a PollingWatcher otherwise."""
+    if use_inotify:
+        try:
+            return InotifyWatcher(directory)
+        except (OSError, AttributeError) as e:
+            log.warning("Can't use inotify (%s), falling back to polling", e)
+    return PollingWatcher(directory, poll_interval)
+
+
+class Debouncer(object):
+    """ Tracks files which are still being written. A file is ready once its size and
+    modification time haven't changed for "settle" seconds.
+    """
+
+    def __init__(self, settle, clock=time.time):
+        self.settle = settle
+        self.clock = clock
+        self.pending = {}
+
+    def touch(self, path):
+        """Marks the file as changed."""
+        self.pending[path] = (None, self.clock())
+
+    def ready(self):
+        """Returns the list of files which have settled, forgetting about them. Files which
+        disappeared are forgotten too.
+        """
+        now = self.clock()
+        ready = []
+        for path, (signature, since) in self.pending.items():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self.pending[path]
+                continue
+            current = (stat.st_size, stat.st_mtime)
+            if current != signature:
+                self.pending[path] = (current, now)
+            elif now - since >= self.settle:
+                del self.pending[path]
+                ready.append(path)
+        return sorted(ready)
+
+
+class IngestDaemon(object):
+    """ Watches a directory (e.g. a local mirror of ISAP) for new and changed PDFs, and
+    imports each of them with ImporterPL, in a pool of worker processes. The results go to a
+    directory per work in the output directory (see ingest_pdf()). PDFs whose content was
+    imported before are skipped.
+    """
+
+    def __init__(self, source, output, workers=2, settle=5.0, use_inotify=True,
+                 poll_interval=2.0, artifacts=None, ingest=ingest_pdf):
+        """
+        Args:
+            source: The directory to watch.
+            output: The directory to write the results to.
+            workers: Number of worker processes, or 0 to import in this process.
+            settle: Seconds a file must stay unchanged before it's imported.
+            use_inotify: Whether to try inotify before falling back to polling.
+            poll_interval: Seconds between directory listings when polling.
+            artifacts: Path to the ArtifactStore to keep the intermediates of imports in, or
+                None not to keep them.
+            ingest: Function importing a single PDF, see ingest_pdf().
+        """
+        self.source = source
+        self.output = output
+        self.workers = workers
+        self.max_in_flight = max(1, workers * 2)
+        self.watcher = create_watcher(source, use_inotify, poll_interval)
+        self.debouncer = Debouncer(settle)
+        self.artifacts = artifacts
+        self.ingest = ingest
+        self.pool = Pool(workers) if workers else None
+        self.queue = []
+        self.in_flight = {}
+
+    def run(self, once=False):
+        """Runs the daemon until interrupted. With once=True, it returns as soon as all the
+        files present at start are imported.
+        """
+        try:
+            while True:
+                for path in self.watcher.changes(timeout=1.0):
+                    if path.lower().endswith(".pdf"):
+                        self.debouncer.touch(path)
+                self.queue.extend(p for p in self.debouncer.ready() if p not in self.queue)
+                self.dispatch()
+                self.collect()
+                if once and not (self.debouncer.pending or self.queue or self.in_flight):
+                    return
+        finally:
+            self.close()
+
+    def dispatch(self):
+        """Starts imports of queued files, keeping at most max_in_flight of them running."""
+        while self.queue and len(self.in_flight) < self.max_in_flight:
+            path = self.queue.pop(0)
+            if path in self.in_flight.values():
+                # Still being imported, look at it again later.
+                self.debouncer.touch(path)
+                continue
+            job = self.prepare(path)
+            if job is None:
+                continue
+            if self.pool is None:
+                self.report(path, self.ingest(*job))
+            else:
+                self.in_flight[self.pool.apply_async(self.ingest, job)] = path
+
+    def prepare(self, path):
+        """Returns the arguments for importing the file, or None if its content was successfully
+        imported before.
+        """
+        work_dir = os.path.join(self.output, work_key(os.path.basename(path)))
+        if not os.path.isdir(work_dir):
+            os.makedirs(work_dir)
+        stat = os.stat(path)
+        latest = self.read_status(os.path.join(work_dir, "latest.json"))
+        if (latest and latest.get("source") == path and latest.get("size") == stat.st_size
+                and latest.get("mtime") == stat.st_mtime):
+            return None
+        digest = fingerprint(path)
+        previous = self.read_status(os.path.join(work_dir, digest + ".json"))
+        if previous is not None and previous.get("ok"):
+            log.info("Skipping %s, already imported as %s", path, digest)
+            return None
+        if self.artifacts:
+            return path, digest, work_dir, self.artifacts
+        return path, digest, work_dir
+
+    def collect(self):
+        for result, path in self.in_flight.items():
+            if result.ready():
+                del self.in_flight[result]
+                try:
+                    self.report(path, result.get())
+                except Exception:
+                    log.exception("Worker failed on %s", path)
+
+    def report(self, path, status):
+        if status.get("ok"):
+            log.info("Imported %s (%s)", path, status["fingerprint"])
+        else:
+            log.error("Failed to import %s: %s", path, status.get("error"))
+
+    def read_status(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def close(self):
+        self.watcher.close()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
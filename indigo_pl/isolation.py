@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+import cPickle as pickle
+import os
+import resource
+import signal
+import socket
+import struct
+import tempfile
+import time
+from multiprocessing import Process, current_process
+
+from indigo_pl.metrics import exception_message
+from indigo_pl.pagebuffer import MappedText
+
+RESULT_ATTRIBUTES = ("diagnostics", "features", "alternatives")
+"""Attributes of the importer of an ImportWorker which are sent back to the importer in the web
+worker once an import is done."""
+
+INHERITED_SIGNALS = (signal.SIGHUP, signal.SIGINT, signal.SIGQUIT, signal.SIGTERM,
+                     signal.SIGUSR1, signal.SIGUSR2)
+"""Signals which gunicorn handles in its workers, and whose handlers an ImportWorker resets, so
+that e.g. SIGTERM stops it rather than the gunicorn worker it was forked from."""
+
+HEADER = struct.Struct("<Q")
+"""Format of the size of a message between an ImportWorker and its child, before the message."""
+
+_limits = None
+_pid = None
+_idle = []
+
+
+class ImportWorkerError(Exception):
+    """ Raised when an import in an ImportWorker is stopped because it went over its limits, or
+    the worker died. The message is shown to the editor.
+    """
+    pass
+
+
+class ImportWorker(object):
+    """ A short-lived child process running ImporterPL.iter_reformatted_text() for a web worker,
+    so that an import which goes wrong (e.g. a regex backtracking for ever) doesn't take the web
+    worker down with it, and the memory of the soups goes back to the OS when the child exits,
+    instead of staying in the heap of the web worker for good.
+
+    The child is forked on first use and runs up to max_imports imports, one at a time, then
+    exits and is replaced by a fresh one. Its address space is capped by RLIMIT_AS (Linux doesn't
+    enforce RLIMIT_RSS), so that an import using too much memory gets a MemoryError, and each
+    import may use up to max_cpu_seconds of CPU before the kernel kills the child with SIGXCPU.
+    The web worker kills it too when an import takes over timeout seconds, or is abandoned, e.g.
+    when a streamed preview is cancelled.
+
+    The raw XML is written to a temporary file, which the child maps as MappedText, and the plain
+    text comes back in chunks as soon as they're ready, followed by the RESULT_ATTRIBUTES of the
+    importer, or the exception it raised. Messages go over a socket, so under gevent other
+    requests of the web worker are served while it waits for them.
+
+    The child may start the pool of the "parallel" import mode. It's in a process group of its
+    own, so that the workers of the pool are killed together with it.
+    """
+
+    def __init__(self, max_memory, max_cpu_seconds, max_imports, timeout):
+        """
+        Args:
+            max_memory: Maximal size of the address space of the child, in bytes, or 0 for no
+                limit.
+            max_cpu_seconds: Maximal CPU time of a single import, in seconds, or 0 for no limit.
+            max_imports: Number of imports after which the child is replaced.
+            timeout: Maximal duration of a single import, in seconds.
+        """
+        self.max_memory = max_memory
+        self.max_cpu_seconds = max_cpu_seconds
+        self.max_imports = max_imports
+        self.timeout = timeout
+        self.process = None
+        self.connection = None
+        self.imports = 0
+
+    def start(self):
+        self.connection, child_connection = socket.socketpair()
+        self.process = Process(target=serve_imports, args=(
+            child_connection, self.connection, self.max_memory, self.max_cpu_seconds,
+            self.max_imports))
+        # Terminated rather than waited for when the web worker exits.
+        self.process.daemon = True
+        self.process.start()
+        child_connection.close()
+        self.imports = 0
+
+    def stop(self):
+        """Stops the child and its workers, if any, straight away if they're still busy."""
+        if self.process is not None:
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except OSError:
+                # Not in a group of its own yet, or gone already.
+                if self.process.is_alive():
+                    os.kill(self.process.pid, signal.SIGKILL)
+            self.process.join()
+            self.connection.close()
+        self.process = self.connection = None
+
+    @property
+    def reusable(self):
+        """Whether the child can run another import."""
+        return self.process is not None and self.imports < self.max_imports
+
+    def iter_reformatted_text(self, importer, text, progress=False):
+        """Runs importer.iter_reformatted_text() in the child, on an importer configured in the
+        same way (see ImporterPL.get_import_worker_config()), and copies the RESULT_ATTRIBUTES
+        back to the importer when it's done.
+
+        Args:
+            importer: The ImporterPL.
+            text: String containing XML produced by pdf_to_text.
+            progress: Whether to yield how far the import is along with the chunks.
+
+        Yields:
+            The chunks yielded by importer.iter_reformatted_text().
+
+        Raises:
+            ImportWorkerError: If the import went over its limits.
+        """
+        if self.process is None:
+            self.start()
+        artifacts = getattr(importer.artifact_store, "path", None)
+        deadline = time.time() + self.timeout
+        self.imports += 1
+        done = False
+        path = write_text(text)
+        try:
+            send_message(self.connection, (importer.__class__,
+                                           importer.get_import_worker_config(), artifacts, path,
+                                           progress))
+            while not done:
+                kind, value = self.receive(deadline)
+                if kind == "chunk":
+                    yield value
+                elif kind == "error":
+                    # The child exits after a MemoryError, see serve_imports().
+                    done = not isinstance(value, MemoryError)
+                    raise value
+                else:
+                    done = True
+                    for name, result in value.iteritems():
+                        setattr(importer, name, result)
+        finally:
+            os.remove(path)
+            if not (done and self.reusable):
+                # Gone over its limits, or abandoned half-way, e.g. when a preview is cancelled.
+                self.stop()
+
+    def receive(self, deadline):
+        """Waits for the next message from the child until the deadline."""
+        try:
+            return receive_message(self.connection, deadline)
+        except socket.timeout:
+            raise ImportWorkerError(u"The import took over %d seconds and was stopped."
+                                    % self.timeout)
+        except EOFError:
+            self.process.join()
+            raise ImportWorkerError(describe_exit(self.process.exitcode, self.max_cpu_seconds))
+
+
+def describe_exit(code, max_cpu_seconds):
+    """Returns the message of the ImportWorkerError for a child which died with the exit code."""
+    if code == -signal.SIGXCPU:
+        return u"The import took over %d seconds of CPU time and was stopped." % max_cpu_seconds
+    if code == -signal.SIGKILL:
+        return u"The import ran out of memory and was stopped."
+    return u"The import stopped unexpectedly (exit code %s)." % code
+
+
+def serve_imports(connection, parent_connection, max_memory, max_cpu_seconds, max_imports):
+    """Main loop of the child process of an ImportWorker."""
+    global _limits
+    from indigo_pl.artifacts import ArtifactStore
+
+    parent_connection.close()
+    # Imports in here run in this process, whatever the web worker was configured with, and
+    # may start the workers of the "parallel" import mode, in the process group of this one.
+    _limits = None
+    current_process().daemon = False
+    os.setpgrp()
+    for signum in INHERITED_SIGNALS:
+        signal.signal(signum, signal.SIG_DFL)
+    if max_memory:
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory, resource.getrlimit(
+            resource.RLIMIT_AS)[1]))
+    for _ in xrange(max_imports):
+        try:
+            importer_class, config, artifacts, path, progress = receive_message(connection)
+        except EOFError:
+            return
+        text = MappedText.open(path) if os.path.getsize(path) else u""
+        if max_cpu_seconds:
+            # The limit is on the CPU time of the process, so it's moved on for every import.
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            resource.setrlimit(resource.RLIMIT_CPU, (
+                int(usage.ru_utime + usage.ru_stime) + max_cpu_seconds,
+                resource.getrlimit(resource.RLIMIT_CPU)[1]))
+        importer = importer_class()
+        for name, value in config.iteritems():
+            setattr(importer, name, value)
+        if artifacts:
+            importer.artifact_store = ArtifactStore(artifacts)
+        try:
+            for chunk in importer.iter_reformatted_text(text, progress):
+                send_message(connection, ("chunk", chunk))
+            send_message(connection, ("done", dict((name, getattr(importer, name))
+                                                   for name in RESULT_ATTRIBUTES)))
+        except Exception as e:
+            send_message(connection, ("error", picklable(e)))
+            if isinstance(e, MemoryError):
+                # Whatever is left of the heap isn't worth reusing.
+                return
+        finally:
+            if importer.artifact_store is not None:
+                importer.artifact_store.close()
+        # Nothing of the import is kept while waiting for the next one.
+        if isinstance(text, MappedText):
+            text.close()
+        importer = text = None
+
+
+def write_text(text):
+    """Writes the raw XML of an import to a new temporary file, a block at a time, and returns
+    its path."""
+    handle, path = tempfile.mkstemp(prefix="indigo-pl-import-")
+    try:
+        with os.fdopen(handle, "wb") as f:
+            if isinstance(text, unicode):
+                for start in xrange(0, len(text), MappedText.BLOCK_SIZE):
+                    f.write(text[start:start + MappedText.BLOCK_SIZE].encode("utf-8"))
+            elif isinstance(text, MappedText):
+                for block in text:
+                    f.write(block)
+            else:
+                f.write(text)
+    except:
+        os.remove(path)
+        raise
+    return path
+
+
+def send_message(connection, message):
+    data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    connection.sendall(HEADER.pack(len(data)))
+    connection.sendall(data)
+
+
+def receive_message(connection, deadline=None):
+    """Returns the next message sent with send_message().
+
+    Raises:
+        EOFError: If the other end is closed.
+        socket.timeout: If the message didn't come before the deadline.
+    """
+    size, = HEADER.unpack(receive_bytes(connection, HEADER.size, deadline))
+    return pickle.loads(receive_bytes(connection, size, deadline))
+
+
+def receive_bytes(connection, size, deadline):
+    blocks = []
+    while size:
+        if deadline is not None:
+            connection.settimeout(max(deadline - time.time(), 0.001))
+        block = connection.recv(min(size, MappedText.BLOCK_SIZE))
+        if not block:
+            raise EOFError()
+        blocks.append(block)
+        size -= len(block)
+    return "".join(blocks)
+
+
+def picklable(e):
+    """Returns the exception, or an ImportWorkerError with the same message if it can't be sent
+    back to the web worker."""
+    try:
+        pickle.dumps(e, pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return ImportWorkerError(exception_message(e))
+    return e
+
+
+def configure(max_memory, max_cpu_seconds, max_imports, timeout):
+    """Starts running imports in ImportWorkers with the given limits, see ImportWorker. Until this
+    is called, imports run in the process which asks for them."""
+    global _limits
+    _limits = (max_memory, max_cpu_seconds, max_imports, timeout)
+    stop_idle()
+
+
+def stop_idle():
+    """Stops the idle ImportWorkers of this process, e.g. when the configuration they were forked
+    with (limits, metrics, admission) changes. New ones are started when needed."""
+    global _idle
+    if _pid == os.getpid():
+        for worker in _idle:
+            worker.stop()
+    _idle = []
+
+
+def enabled():
+    """Whether imports run in ImportWorkers. They don't in daemonic processes, e.g. the workers
+    of IngestDaemon, which can't start processes of their own, and are separate processes
+    already."""
+    return _limits is not None and not current_process().daemon
+
+
+def iter_reformatted_text(importer, text, progress=False):
+    """ImportWorker.iter_reformatted_text() in an idle worker of this process, or a new one if
+    they're all busy (e.g. with other requests of a gevent worker)."""
+    global _pid, _idle
+    if _pid != os.getpid():
+        # The workers of the parent of a forked process aren't its own.
+        _pid = os.getpid()
+        _idle = []
+    worker = _idle.pop() if _idle else ImportWorker(*_limits)
+    chunks = worker.iter_reformatted_text(importer, text, progress)
+    try:
+        for chunk in chunks:
+            yield chunk
+    finally:
+        chunks.close()
+        if worker.reusable:
+            _idle.append(worker)
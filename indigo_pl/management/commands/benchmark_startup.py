@@ -0,0 +1,100 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+PROBE = r"""
+import json, os, sys, time
+
+def read_kb(path, fields):
+    total = 0
+    with open(path) as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            if name in fields:
+                total += int(value.split()[0])
+    return total
+
+def rss():
+    return read_kb('/proc/self/status', ('VmRSS',))
+
+def private():
+    path = '/proc/self/smaps_rollup'
+    if not os.path.exists(path):
+        path = '/proc/self/smaps'
+    return read_kb(path, ('Private_Clean', 'Private_Dirty'))
+
+start = time.time()
+from django.core.wsgi import get_wsgi_application
+get_wsgi_application()
+result = {'boot': time.time() - start, 'rss': rss()}
+
+# What a worker forked by gunicorn pays on its first import request.
+read_end, write_end = os.pipe()
+pid = os.fork()
+if pid == 0:
+    os.close(read_end)
+    start = time.time()
+    from indigo_pl.plugins import LazyImporterPL
+    LazyImporterPL()
+    os.write(write_end, json.dumps({'first_use': time.time() - start,
+                                    'worker_private': private()}).encode('utf-8'))
+    os._exit(0)
+os.close(write_end)
+child = b''
+while True:
+    data = os.read(read_end, 4096)
+    if not data:
+        break
+    child += data
+os.waitpid(pid, 0)
+result.update(json.loads(child.decode('utf-8')))
+sys.stdout.write(json.dumps(result))
+"""
+"""Script run in a fresh interpreter for each measurement: boots the app the way a WSGI server
+does, then forks a worker which uses the importer once."""
+
+
+class Command(BaseCommand):
+    help = ('Measures how long the app takes to boot and how much memory it takes, with the '
+            'plugins imported lazily (the default) and eagerly, as with gunicorn --preload.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5,
+                            help='Number of fresh processes to measure for each configuration.')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+
+    def handle(self, *args, **options):
+        if not os.path.exists('/proc/self/status'):
+            raise CommandError('Memory is measured using /proc, which is only there on Linux.')
+        results = {}
+        for name, preload in (('lazy', ''), ('preload', 'true')):
+            runs = [self.measure(preload) for _ in range(options['runs'])]
+            results[name] = {key: median([run[key] for run in runs]) for key in runs[0]}
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2, sort_keys=True))
+            return
+        self.stdout.write('%-8s %9s %9s %12s %15s' % ('', 'boot (s)', 'RSS (MB)',
+                                                     'first use (s)', 'worker own (MB)'))
+        for name in ('lazy', 'preload'):
+            r = results[name]
+            self.stdout.write('%-8s %9.3f %9.1f %12.3f %15.1f' % (
+                name, r['boot'], r['rss'] / 1024.0, r['first_use'],
+                r['worker_private'] / 1024.0))
+
+    def measure(self, preload):
+        env = dict(os.environ, INDIGO_PL_PRELOAD_PLUGINS=preload)
+        env.setdefault('DJANGO_SETTINGS_MODULE', 'indigo_pl.settings')
+        output = subprocess.check_output([sys.executable, '-c', PROBE], env=env)
+        return json.loads(output.strip().splitlines()[-1])
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
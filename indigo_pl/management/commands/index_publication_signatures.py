@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from indigo_api.models import Document
+from indigo_pl import signatures
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the publication signature index for all documents.'
+
+    def handle(self, *args, **options):
+        count = 0
+        for document in Document.objects.undeleted().defer('document_xml').iterator():
+            if signatures.index_document(document) is not None:
+                count += 1
+        self.stdout.write('Indexed %d documents.' % count)
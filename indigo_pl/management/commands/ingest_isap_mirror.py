@@ -0,0 +1,39 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from indigo_pl.ingest import IngestDaemon
+
+
+class Command(BaseCommand):
+    help = ('Watches a directory with PDFs of unified texts from ISAP and imports new and '
+            'changed ones, writing the results to a directory per work.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='Directory to watch, e.g. the local ISAP mirror.')
+        parser.add_argument('output', help='Directory to write the results to.')
+        parser.add_argument('--workers', type=int, default=2,
+                            help='Number of worker processes, 0 to import in this process.')
+        parser.add_argument('--settle', type=float, default=5.0,
+                            help='Seconds a file must stay unchanged before it is imported.')
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Seconds between directory listings when polling.')
+        parser.add_argument('--no-inotify', action='store_true',
+                            help='Poll the directory even if inotify is available.')
+        parser.add_argument('--artifacts',
+                            help='SQLite file of the store to keep the import intermediates in.')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the files present at start are imported.')
+
+    def handle(self, *args, **options):
+        logging.basicConfig(level=logging.INFO if options['verbosity'] < 2 else logging.DEBUG)
+        daemon = IngestDaemon(options['source'], options['output'],
+                              workers=options['workers'], settle=options['settle'],
+                              use_inotify=not options['no_inotify'],
+                              poll_interval=options['poll_interval'],
+                              artifacts=options['artifacts'])
+        self.stdout.write('Watching %s' % options['source'])
+        try:
+            daemon.run(once=options['once'])
+        except KeyboardInterrupt:
+            self.stdout.write('Stopped.')
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from indigo_api.models import Document
+from indigo_pl import search
+
+
+class Command(BaseCommand):
+    help = ('Brings the full-text search index up to date with all documents, re-indexing only '
+            'the units which changed.')
+
+    def handle(self, *args, **options):
+        index = search.get_index()
+        try:
+            indexed = set()
+            for document in Document.objects.undeleted().only('pk', 'document_xml').iterator():
+                index.index_document(document.pk, document.document_xml)
+                indexed.add(document.pk)
+            for document_id in index.documents() - indexed:
+                index.remove_document(document_id)
+            stats = index.stats()
+        finally:
+            index.close()
+        self.stdout.write('Indexed %(units)d units of %(documents)d documents, '
+                          '%(terms)d distinct terms.' % stats)
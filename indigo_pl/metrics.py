@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+import atexit
+import json
+import os
+import re
+import sqlite3
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    name TEXT NOT NULL,
+    labels TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (name, labels)
+);
+"""
+
+FLUSH_INTERVAL = 5.0
+"""Seconds for which samples are kept in the process before they're added to the store, unless
+flush() is called sooner."""
+
+FLUSH_TIMEOUT = 0.1
+"""Seconds for which a flush waits for the store when another process is writing to it. It runs
+in requests, so it rather tries again at the next one than holds them up."""
+
+ERROR_KIND_RE = re.compile(r"[^\[\]:(\d]*")
+"""Regex catching the beginning of an exception message, before any page number, node or
+other detail, e.g. "Non-increasing 'top' attribute"."""
+
+_path = None
+_pid = None
+_pending = {}
+_last_flush = 0
+
+
+class MetricsStore(object):
+    """ Counters and histograms of all the processes of the app (gunicorn workers, the ingest
+    daemon and its workers), in a single SQLite file in a local directory.
+
+    Processes collect samples in memory and add them up in the store at most FLUSH_INTERVAL
+    seconds later, at the end of every import and on exit, so the store has the totals of all
+    the processes, even the ones which are gone. Buckets of histograms are stored as they are
+    observed, and made cumulative only in the exposition.
+    """
+
+    def __init__(self, path, timeout=60):
+        """
+        Args:
+            path: Path to the SQLite file, created if it doesn't exist.
+            timeout: Seconds to wait for other processes writing to it.
+        """
+        self.db = sqlite3.connect(path, timeout=timeout)
+        self.db.executescript(SCHEMA)
+
+    def add(self, increments):
+        """Adds the increments to the samples, in a single transaction.
+
+        Args:
+            increments: Map from (name, labels) to the amount to add, where labels is a tuple of
+                (label, value) pairs.
+        """
+        with self.db:
+            for (name, labels), amount in increments.iteritems():
+                labels = json.dumps(labels)
+                if not self.db.execute("UPDATE samples SET value = value + ? "
+                                       "WHERE name = ? AND labels = ?",
+                                       (amount, name, labels)).rowcount:
+                    self.db.execute("INSERT INTO samples VALUES (?, ?, ?)", (name, labels, amount))
+
+    def samples(self):
+        """Returns the map from (name, labels) to the values of all the samples."""
+        return {(name, tuple(tuple(label) for label in json.loads(labels))): value
+                for name, labels, value in self.db.execute("SELECT * FROM samples")}
+
+    def close(self):
+        self.db.close()
+
+
+class Metric(object):
+    """ A metric with a fixed set of labels, whose samples are recorded in the process, see
+    record()."""
+
+    TYPE = None
+    """Type of the metric in the exposition, e.g. "counter"."""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        METRICS.append(self)
+
+    def labels(self, labels):
+        """Returns the labels given as keyword arguments as a tuple of (label, value) pairs, in
+        the order of labelnames."""
+        return tuple((name, unicode(labels[name])) for name in self.labelnames)
+
+    def expose(self, samples):
+        """Returns the lines of the exposition of the metric, given all the samples."""
+        return []
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def inc(self, amount=1, **labels):
+        record(self.name, self.labels(labels), amount)
+
+    def expose(self, samples):
+        return [format_sample(self.name, labels, value)
+                for (name, labels), value in sorted(samples.iteritems()) if name == self.name]
+
+
+class Histogram(Metric):
+    TYPE = "histogram"
+
+    DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, float("inf"))
+    """Upper bounds of the buckets, in seconds, suited to imports and requests."""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(float(bound) for bound in buckets)
+        if self.buckets[-1] != float("inf"):
+            self.buckets += (float("inf"),)
+
+    def observe(self, value, **labels):
+        labels = self.labels(labels)
+        bound = self.buckets[bisect_left(self.buckets, value)]
+        record(self.name + "_bucket", labels + (("le", format_bound(bound)),), 1)
+        record(self.name + "_sum", labels, value)
+        record(self.name + "_count", labels, 1)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes how long the block takes, even if it raises."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - start, **labels)
+
+    def expose(self, samples):
+        lines = []
+        for (name, labels), value in sorted(samples.iteritems()):
+            if name != self.name + "_count":
+                continue
+            total = 0
+            for bound in self.buckets:
+                bucket_labels = labels + (("le", format_bound(bound)),)
+                total += samples.get((self.name + "_bucket", bucket_labels), 0)
+                lines.append(format_sample(self.name + "_bucket", bucket_labels, total))
+            lines.append(format_sample(self.name + "_sum", labels,
+                                       samples.get((self.name + "_sum", labels), 0)))
+            lines.append(format_sample(name, labels, value))
+        return lines
+
+
+class Gauge(Metric):
+    """ A metric whose samples aren't recorded but read when exposed, from a function set with
+    set_function(), e.g. the state of a queue."""
+
+    TYPE = "gauge"
+
+    function = None
+
+    def set_function(self, function):
+        """
+        Args:
+            function: Function returning a map from labels, as tuples of (label, value) pairs,
+                to values.
+        """
+        self.function = function
+
+    def expose(self, samples):
+        if self.function is None:
+            return []
+        return [format_sample(self.name, labels, value)
+                for labels, value in sorted(self.function().iteritems())]
+
+
+METRICS = []
+"""All the metrics, in the order of the exposition."""
+
+IMPORT_DURATION = Histogram(
+    "indigo_pl_import_duration_seconds", "Time taken by ImporterPL.reformat_text().",
+    ["mode"])
+IMPORT_STAGE_DURATION = Histogram(
+    "indigo_pl_import_stage_duration_seconds", "Time taken by each stage of an import.",
+    ["stage"])
+IMPORT_PAGES = Histogram(
+    "indigo_pl_import_pages", "Number of pages of imported documents.",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000))
+IMPORT_ERRORS = Counter(
+    "indigo_pl_import_errors_total", "Exceptions raised by the stages of imports, by the "
+    "beginning of their message.", ["stage", "error"])
+PDFTOHTML_FAILURES = Counter(
+    "indigo_pl_pdftohtml_failures_total", "Runs of pdftohtml which exited with an error.",
+    ["code"])
+REQUEST_DURATION = Histogram(
+    "indigo_pl_request_duration_seconds", "Time taken by API requests, e.g. /api/parse.",
+    ["endpoint", "status"])
+TOC_BUILD_DURATION = Histogram(
+    "indigo_pl_toc_build_duration_seconds", "Time taken to build the TOC of a document.")
+ADMISSION_WAIT = Histogram(
+    "indigo_pl_admission_wait_seconds", "Time spent by imports queued for a resource of the "
+    "host, e.g. pdftohtml.", ["resource"])
+ADMISSION_QUEUE = Gauge(
+    "indigo_pl_admission_queue", "Imports of the host waiting for or running on each resource, "
+    "and the pages running.", ["resource", "state"])
+
+
+def configure(directory):
+    """Starts recording metrics into the store in the directory, which is created if needed.
+    Until this is called, nothing is recorded."""
+    global _path
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    if _path is None:
+        atexit.register(flush)
+    _path = os.path.join(directory, "metrics.sqlite")
+
+
+def record(name, labels, amount):
+    """Adds the amount to a sample, in the process. The samples are added to the store by
+    flush(), which is called here too if the last flush was over FLUSH_INTERVAL seconds ago."""
+    global _pid, _pending
+    if _path is None:
+        return
+    if _pid != os.getpid():
+        # A forked process doesn't flush what its parent has collected.
+        _pid = os.getpid()
+        _pending = {}
+    key = (name, labels)
+    _pending[key] = _pending.get(key, 0) + amount
+    if time.time() - _last_flush >= FLUSH_INTERVAL:
+        flush()
+
+
+def flush():
+    """Adds the samples collected in the process to the store. If the store is busy for over
+    FLUSH_TIMEOUT seconds, or can't be written, they're kept for the next flush."""
+    global _pending, _last_flush
+    _last_flush = time.time()
+    if _path is None or _pid != os.getpid() or not _pending:
+        return
+    pending, _pending = _pending, {}
+    try:
+        store = MetricsStore(_path, FLUSH_TIMEOUT)
+        try:
+            store.add(pending)
+        finally:
+            store.close()
+    except sqlite3.Error:
+        for key, amount in pending.iteritems():
+            _pending[key] = _pending.get(key, 0) + amount
+
+
+def error_kind(e):
+    """Returns the label of an exception for IMPORT_ERRORS: the beginning of its message,
+    without any details which would make the number of labels grow without bounds."""
+    kind = ERROR_KIND_RE.match(exception_message(e)).group().strip()[:80]
+    return kind or e.__class__.__name__
+
+
+def exception_message(e):
+    """Returns the message of an exception as unicode. Messages of the importer are often UTF-8
+    strings, e.g. with str(node) in them, which unicode(e) can't decode."""
+    try:
+        return unicode(e)
+    except UnicodeDecodeError:
+        return str(e).decode("utf-8", "replace")
+    except Exception:
+        return repr(e).decode("utf-8", "replace")
+
+
+def exposition():
+    """Returns the metrics of all the processes in the Prometheus text format."""
+    flush()
+    if _path is None:
+        samples = {}
+    else:
+        store = MetricsStore(_path)
+        try:
+            samples = store.samples()
+        finally:
+            store.close()
+    lines = []
+    for metric in METRICS:
+        lines.append("# HELP %s %s" % (metric.name, metric.documentation))
+        lines.append("# TYPE %s %s" % (metric.name, metric.TYPE))
+        lines.extend(metric.expose(samples))
+    return "\n".join(lines) + "\n"
+
+
+def format_bound(bound):
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+
+def format_sample(name, labels, value):
+    if labels:
+        name += "{%s}" % ",".join('%s="%s"' % (label, value.replace("\\", "\\\\").replace(
+            '"', '\\"').replace("\n", "\\n")) for label, value in labels)
+    return "%s %s" % (name, repr(float(value)))
+
+
+class RequestMetricsMiddleware(object):
+    """ Observes how long API requests take in REQUEST_DURATION, labelled by the name of their
+    URL pattern (e.g. the one of /api/parse). Works both in MIDDLEWARE and MIDDLEWARE_CLASSES."""
+
+    def __init__(self, get_response=None):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.time()
+        response = self.get_response(request)
+        self.observe(request, response, start)
+        return response
+
+    def process_request(self, request):
+        request._metrics_start = time.time()
+
+    def process_response(self, request, response):
+        start = getattr(request, "_metrics_start", None)
+        if start is not None:
+            self.observe(request, response, start)
+        return response
+
+    def observe(self, request, response, start):
+        if request.path.startswith("/api/"):
+            match = getattr(request, "resolver_match", None)
+            endpoint = (match.url_name or match.view_name) if match else "unknown"
+            REQUEST_DURATION.observe(time.time() - start, endpoint=endpoint,
+                                     status="%dxx" % (response.status_code // 100))
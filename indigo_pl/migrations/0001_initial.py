@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('indigo_api', '__first__'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PublicationSignature',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('journal', models.CharField(help_text=b'Journal abbreviation: Dz.U. or M.P.', max_length=16)),
+                ('year', models.IntegerField()),
+                ('number', models.IntegerField(blank=True, help_text=b'The "Nr" part, if any', null=True)),
+                ('poz', models.IntegerField()),
+                ('frbr_uri', models.CharField(max_length=512)),
+                ('document', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='publication_signature', to='indigo_api.Document')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='publicationsignature',
+            index_together=set([('journal', 'year', 'number', 'poz')]),
+        ),
+    ]
@@ -0,0 +1,25 @@
+from django.db import models
+
+
+class PublicationSignature(models.Model):
+    """ Index of publication signatures of documents, e.g. "Dz.U. 1997 Nr 88 poz. 553".
+
+    Kept up to date whenever a document is saved (see indigo_pl.signals), so that citations can
+    be resolved to works with a single index lookup, and so that the parsed number and poz
+    don't need to be worked out from "publication_number" again and again.
+    """
+    document = models.OneToOneField('indigo_api.Document', on_delete=models.CASCADE,
+                                    related_name='publication_signature')
+    journal = models.CharField(max_length=16, help_text="Journal abbreviation: Dz.U. or M.P.")
+    year = models.IntegerField()
+    number = models.IntegerField(null=True, blank=True, help_text="The \"Nr\" part, if any")
+    poz = models.IntegerField()
+    frbr_uri = models.CharField(max_length=512)
+
+    class Meta:
+        index_together = [['journal', 'year', 'number', 'poz']]
+
+    def __unicode__(self):
+        if self.number is not None:
+            return u"%s %d Nr %d poz. %d" % (self.journal, self.year, self.number, self.poz)
+        return u"%s %d poz. %d" % (self.journal, self.year, self.poz)
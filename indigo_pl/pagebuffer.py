@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import mmap
+import os
+import struct
+import tempfile
+
+COUNT = struct.Struct("<q")
+"""Format of the number of pages, at the very end of the file."""
+
+
+class PageBuffer(object):
+    """ The raw XML of the pages of a document, packed into a single temporary file mapped into
+    memory, for the worker processes of the "parallel" import mode (see
+    ImporterPL.iter_reformatted_text_parallel()).
+
+    Instead of pickling every page over a pipe to a worker, the parent writes all of them once,
+    and the workers map the same file and read pages by their index, which is all they're sent.
+    The pages share the page cache of the file, so there's a single copy of them in memory
+    however many workers there are.
+
+    The file is an arena with the UTF-8 text of the pages, one after the other, followed by a
+    column with their start offsets (and the end of the last page) as 64-bit integers, and by
+    the number of pages.
+    """
+
+    def __init__(self, path, owner=False):
+        """
+        Args:
+            path: Path to a file written by create().
+            owner: Whether to remove the file on close().
+        """
+        self.path = path
+        self.owner = owner
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        count, = COUNT.unpack_from(self.map, len(self.map) - COUNT.size)
+        column = struct.Struct("<%dq" % (count + 1))
+        self.offsets = column.unpack_from(self.map, len(self.map) - COUNT.size - column.size)
+
+    @classmethod
+    def create(cls, pages):
+        """Writes the pages into a new temporary file, and maps it.
+
+        Args:
+            pages: Iterable of strings with the raw XML of the pages.
+
+        Returns:
+            PageBuffer: The buffer, which removes the file when closed.
+        """
+        handle, path = tempfile.mkstemp(prefix="indigo-pl-pages-")
+        try:
+            with os.fdopen(handle, "wb") as f:
+                offsets = [0]
+                for page in pages:
+                    data = page.encode("utf-8")
+                    f.write(data)
+                    offsets.append(offsets[-1] + len(data))
+                f.write(struct.pack("<%dq" % len(offsets), *offsets))
+                f.write(COUNT.pack(len(offsets) - 1))
+            return cls(path, owner=True)
+        except:
+            os.remove(path)
+            raise
+
+    @property
+    def size(self):
+        """Size of the file, in bytes."""
+        return len(self.map)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        """Returns the raw XML of the page with the index."""
+        return self.map[self.offsets[index]:self.offsets[index + 1]].decode("utf-8")
+
+    def close(self):
+        self.map.close()
+        if self.owner:
+            os.remove(self.path)
+
+
+class MappedText(mmap.mmap):
+    """ The XML produced by pdftohtml, in a file mapped into memory rather than decoded into a
+    unicode string (see ImporterPL.PDF_OUTPUT).
+
+    The regexes of the importer run directly on the mapped bytes, and in the "windowed" and
+    "parallel" import modes pages are decoded one at a time, so the document is kept once, in
+    the page cache, instead of as bytes and as a unicode string 2-4 times their size. It has just
+    enough of a string for the importer: substring checks, count() and decode().
+    """
+
+    BLOCK_SIZE = 1024 * 1024
+    """Size of the blocks yielded when iterating, e.g. by ArtifactStore.put()."""
+
+    @classmethod
+    def open(cls, path):
+        """Maps the file at the path. The mapping stays valid once the file is removed."""
+        with open(path, "rb") as f:
+            return cls(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __contains__(self, sub):
+        return self.find(sub.encode("utf-8")) != -1
+
+    def __iter__(self):
+        for start in xrange(0, len(self), self.BLOCK_SIZE):
+            yield self[start:start + self.BLOCK_SIZE]
+
+    def count(self, sub):
+        sub = sub.encode("utf-8")
+        count = 0
+        position = self.find(sub)
+        while position != -1:
+            count += 1
+            position = self.find(sub, position + len(sub))
+        return count
+
+    def decode(self, encoding="utf-8"):
+        return self[:].decode(encoding)
@@ -0,0 +1,55 @@
+from importlib import import_module
+
+from indigo.plugins import plugins
+
+
+class LazyPlugin(object):
+    """ Stand-in registered with Indigo's plugin registry instead of a plugin whose module is
+    expensive to import (e.g. ImporterPL, which pulls in BeautifulSoup and compiles dozens of
+    regexes).
+
+    The registry only looks at the locale of the class, so the module is imported the first
+    time the plugin is instantiated, and an instance of the real plugin is returned instead. Web
+    workers which never import a document never import the importer at all.
+    """
+
+    plugin = None
+    """Dotted path to the real plugin class, e.g. "indigo_pl.importer.ImporterPL"."""
+
+    locale = None
+    """Same as the locale of the real plugin, which the registry matches documents against."""
+
+    _plugin_class = None
+
+    def __new__(cls, *args, **kwargs):
+        return cls.load()(*args, **kwargs)
+
+    @classmethod
+    def load(cls):
+        """Imports the module of the real plugin, if it isn't yet, and returns its class."""
+        if cls._plugin_class is None:
+            module, name = cls.plugin.rsplit('.', 1)
+            cls._plugin_class = getattr(import_module(module), name)
+        return cls._plugin_class
+
+
+@plugins.register('importer')
+class LazyImporterPL(LazyPlugin):
+    plugin = 'indigo_pl.importer.ImporterPL'
+    locale = ('pl', None, None)
+
+
+@plugins.register('toc')
+class LazyTOCBuilderPL(LazyPlugin):
+    plugin = 'indigo_pl.toc.TOCBuilderPL'
+    locale = ('pl', 'pol', None)
+
+
+LAZY_PLUGINS = [LazyImporterPL, LazyTOCBuilderPL]
+
+
+def load_all():
+    """Imports the modules of all the lazy plugins straight away, e.g. in the master process of
+    gunicorn --preload, so that they're shared by the workers it forks."""
+    for plugin in LAZY_PLUGINS:
+        plugin.load()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import re
+
+
+class PreflightError(ValueError):
+    """ Raised when a PDF is rejected by the preflight, before it's converted. The message
+    says why, and is shown to the editor who uploaded the file.
+    """
+    pass
+
+
+class PDFPreflight(object):
+    """ Cheap checks of an uploaded PDF, run before the expensive pdftohtml conversion and
+    reformat_text() pipeline. They use poppler-utils (see Aptfile) only: "pdfinfo" for metadata
+    and page count, "pdffonts" for the text layer, and "pdftotext" on the first page for the
+    document type. Each of them only looks at the first few pages, so the whole preflight takes
+    well under a second even for huge files.
+    """
+
+    MIN_PAGES = 1
+    """Minimal number of pages of a PDF we import."""
+
+    MAX_PAGES = 3000
+    """Maximal number of pages of a PDF we import. The longest unified texts (e.g. codes)
+    have well under 1000 pages."""
+
+    SAMPLE_PAGES = 5
+    """Number of pages at the start of the PDF looked at by "pdffonts"."""
+
+    REJECTED_PRODUCERS_RE = re.compile(r"scan|ocr|abbyy|tesseract|capture|image", re.IGNORECASE)
+    """Regex catching "Producer" or "Creator" metadata of PDFs made by scanners and OCR
+    software, which don't have the layout we rely on."""
+
+    REJECTED_TEXTS = [
+        (re.compile(u"jednolitego\s+tekstu", re.UNICODE),
+         u"This is the announcement of a consolidated text (\"tekst jednolity\") published in "
+         u"the journal. Please upload the unified text (\"tekst ujednolicony\") from ISAP instead."),
+    ]
+    """List of (regex, reason) pairs. A PDF whose first page matches the regex is rejected."""
+
+    def __init__(self, shell):
+        """
+        Args:
+            shell: Function running a command given as a list, returning a tuple (return code,
+                stdout, stderr), e.g. Importer.shell.
+        """
+        self.shell = shell
+
+    def check(self, path):
+        """Runs all the checks on the given PDF.
+
+        Args:
+            path: Path to the PDF file.
+
+        Returns:
+            dict: The "pdfinfo" metadata of the PDF.
+
+        Raises:
+            PreflightError: If the PDF shouldn't be imported.
+        """
+        info = self.get_info(path)
+        self.check_pages(info)
+        self.check_producer(info)
+        self.check_text_layer(path)
+        self.check_document_type(path)
+        return info
+
+    def get_info(self, path):
+        """Returns the "pdfinfo" metadata of the PDF, as a dict, e.g. {"Pages": "12", ...}."""
+        code, stdout, stderr = self.shell(["pdfinfo", path])
+        if code > 0:
+            raise PreflightError(u"The file is not a valid PDF: " + stderr.decode('utf-8', 'replace'))
+        info = {}
+        for line in stdout.decode('utf-8', 'replace').splitlines():
+            key, sep, value = line.partition(u":")
+            if sep:
+                info[key.strip()] = value.strip()
+        return info
+
+    def check_pages(self, info):
+        try:
+            pages = int(info.get("Pages"))
+        except (TypeError, ValueError):
+            raise PreflightError(u"Could not read the number of pages of the PDF.")
+        if pages < self.MIN_PAGES or pages > self.MAX_PAGES:
+            raise PreflightError(u"The PDF has %d pages, but only PDFs with %d to %d pages can be "
+                                 u"imported." % (pages, self.MIN_PAGES, self.MAX_PAGES))
+
+    def check_producer(self, info):
+        for key in ("Producer", "Creator"):
+            value = info.get(key, u"")
+            if self.REJECTED_PRODUCERS_RE.search(value):
+                raise PreflightError(u"The PDF was made by \"%s\", which looks like a scanner or "
+                                     u"OCR software. Please upload the unified text from ISAP "
+                                     u"instead." % value)
+
+    def check_text_layer(self, path):
+        """Checks that the first pages of the PDF use fonts, i.e. that they have text at all.
+        Scanned PDFs are just images.
+        """
+        code, stdout, stderr = self.shell(["pdffonts", "-l", str(self.SAMPLE_PAGES), path])
+        if code > 0:
+            raise PreflightError(u"Could not read the fonts of the PDF: "
+                                 + stderr.decode('utf-8', 'replace'))
+        # The output is a header of two lines, followed by one line per font.
+        if len(stdout.decode('utf-8', 'replace').strip().splitlines()) <= 2:
+            raise PreflightError(u"The PDF has no text layer, it's probably a scan. Please upload "
+                                 u"the unified text from ISAP instead.")
+
+    def check_document_type(self, path):
+        code, stdout, stderr = self.shell(["pdftotext", "-f", "1", "-l", "1", path, "-"])
+        if code > 0:
+            raise PreflightError(u"Could not read the text of the PDF: "
+                                 + stderr.decode('utf-8', 'replace'))
+        text = stdout.decode('utf-8', 'replace')
+        for regex, reason in self.REJECTED_TEXTS:
+            if regex.search(text):
+                raise PreflightError(reason)
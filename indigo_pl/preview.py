@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+
+from indigo_pl.metrics import exception_message
+
+log = logging.getLogger(__name__)
+
+LEADING_PAGES = 10
+"""Number of pages at the beginning of a PDF which are converted and imported on their own
+first, so that editors see them within seconds however long the act is."""
+
+
+def iter_preview_events(importer, f):
+    """Imports a PDF, yielding server-sent events with the plain text as soon as the first pages
+    are done, rather than all of it at the end, so that editors can see straight away whether a
+    long act comes out right:
+
+    - "progress": {"stage": "extraction", "pages": <pages converted>} while pdftohtml runs, with
+      "pages" being None for the whole PDF, then {"stage": "reformat", "pages": <pages done>,
+      "total": <total pages>} before each chunk of text.
+    - "draft": The plain text of the first LEADING_PAGES pages, as a JSON string, if the PDF is
+      longer than that. They're converted and imported on their own, before the whole PDF is
+      converted, which takes minutes for the longest codes. The text may differ from the final
+      one, as the layout of the rest of the act isn't known yet, and is replaced by the "text"
+      events which follow.
+    - "text": The next chunk of plain text, as a JSON string.
+    - "done": {"diagnostics": <diagnostics of the import>}.
+    - "error": {"detail": <message>}, if the import fails. Nothing follows.
+
+    The import runs in the "windowed" mode, unless the importer is in the "parallel" one.
+    Closing the generator, which WSGI servers do when the editor closes the connection, stops
+    the import.
+
+    Args:
+        importer: The ImporterPL.
+        f: The input PDF, a named file, which is closed when the import ends.
+
+    Yields:
+        str: The events.
+    """
+    try:
+        try:
+            if importer.IMPORT_MODE == "in-memory":
+                importer.IMPORT_MODE = "windowed"
+            yield format_event("progress", {"stage": "extraction", "pages": LEADING_PAGES})
+            text = importer.pdf_to_text(f, (1, LEADING_PAGES))
+            if text.count("<page ") >= LEADING_PAGES:
+                for event in iter_draft_events(importer, text):
+                    yield event
+                yield format_event("progress", {"stage": "extraction", "pages": None})
+                text = importer.pdf_to_text(f)
+            # Otherwise, that's the whole PDF already.
+            for pages, total, chunk in importer.iter_reformatted_text(text, progress=True):
+                yield format_event("progress", {"stage": "reformat", "pages": pages,
+                                                "total": total})
+                if chunk:
+                    yield format_event("text", chunk)
+        except Exception as e:
+            log.exception("Preview of %s failed", f.name)
+            yield format_event("error", {"detail": exception_message(e)})
+            return
+        yield format_event("done", {"diagnostics": importer.diagnostics})
+    finally:
+        f.close()
+
+
+def iter_draft_events(importer, text):
+    """Yields the "draft" events of the leading pages, see iter_preview_events(). They're only a
+    preview, so if they can't be imported on their own (e.g. they end in the middle of a
+    formula), there are none, and any real problem is reported by the import of the whole PDF."""
+    try:
+        for chunk in importer.iter_reformatted_text(text):
+            if chunk:
+                yield format_event("draft", chunk)
+    except Exception:
+        log.info("Draft of the leading pages failed", exc_info=True)
+
+
+def format_event(event, data):
+    """Returns a server-sent event with the data as JSON, which has no line breaks."""
+    return "event: %s\ndata: %s\n\n" % (event, json.dumps(data))
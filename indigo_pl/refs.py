@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import re
+
+from lxml import etree
+
+from indigo.plugins import LocaleBasedMatcher, plugins
+
+
+@plugins.register('refs')
+class RefsFinderPL(LocaleBasedMatcher):
+    """ Finds references to other units of the same act, e.g. "o których mowa w art. 60a ust. 1
+    i 1b oraz art. 61 ust. 5 i 5a", and turns them into <ref> elements.
+
+    We first build an index from unit numbers to AKN ids in one walk over the document, then
+    scan each text node once with a single compiled reference grammar, and finally insert all
+    the <ref> elements for that text node at once.
+    """
+
+    locale = ('pl', None, None)
+
+    NUM = (r"\d+[a-ząćęłńóśźż]*(?:@@SUPERSCRIPT@@[^#]+##SUPERSCRIPT##)?")
+    """Regex catching a unit number, including the superscript part, e.g. "5a" or
+    "5@@SUPERSCRIPT@@1##SUPERSCRIPT##"."""
+
+    LETTER = r"[a-ząćęłńóśźż]{1,3}(?:@@SUPERSCRIPT@@[^#]+##SUPERSCRIPT##)?"
+    """Regex catching a letter unit number, e.g. "a" or "ab"."""
+
+    SEPARATOR = r"(?:\s*,\s*|\s*[–-]\s*|\s+(?:i|oraz|lub|albo|do)\s+)"
+    """Regex catching what may stand between numbers in a list or range, e.g. "1 i 1b"."""
+
+    REFERENCE_RE = re.compile(
+        r"(?<![\wąćęłńóśźż])"
+        r"(?:(?P<unit>[Aa]rt\.|ust\.|pkt)\s*(?P<nums>%s(?:%s%s)*)"
+        r"|lit\.\s*(?P<letters>%s(?:%s%s)*(?![\wąćęłńóśźż])))" % (
+            NUM, SEPARATOR, NUM, LETTER, SEPARATOR, LETTER), re.UNICODE)
+    """The reference grammar: a unit label followed by a list or range of numbers."""
+
+    NUM_RE = re.compile(NUM, re.UNICODE)
+    LETTER_RE = re.compile(r"(?<![\wąćęłńóśźż])%s(?![\wąćęłńóśźż])" % LETTER, re.UNICODE)
+    UNIT_LEVELS = {'art.': 0, 'ust.': 1, 'pkt': 2, 'lit.': 3}
+    """Unit levels we link to, from the highest. Units are indexed by a tuple with one number
+    per level, e.g. ("60a", "1", None, None) for "art. 60a ust. 1"."""
+
+    CHAIN_GAP_RE = re.compile(r"^(?:\s*,\s*|\s+(?:i|oraz|lub|albo|a także|a)\s+|\s+)$", re.UNICODE)
+    """Regex catching the text allowed between two parts of the same reference chain, e.g.
+    ", " in "art. 21 ust. 1 pkt 1 i 4, ust. 2 i 4"."""
+
+    EXTERNAL_RE = re.compile(r"^\s*(?:ustawy|ustawie|ustawą|kodeksu|Kodeksu|rozporządzenia|"
+                             r"dyrektywy|Konstytucji|Traktatu|umowy|k\.\s?[a-z]+\.)", re.UNICODE)
+    """Regex catching text following references to other acts, which we don't link."""
+
+    SKIP_ELEMENTS = {'num', 'heading', 'ref', 'quotedStructure', 'embeddedStructure', 'meta'}
+    """Elements whose text is never scanned for references."""
+
+    def find_references_in_document(self, document):
+        """Find references in the given Indigo document and link them.
+
+        Args:
+            document: The Indigo Document object.
+        """
+        root = etree.fromstring(document.content.encode('utf-8'))
+        self.find_references(root)
+        document.content = etree.tostring(root, encoding='UTF-8').decode('utf-8')
+
+    def find_references(self, root):
+        """Find and link the references in the given XML.
+
+        Args:
+            root: Root lxml element of the Akoma Ntoso document.
+
+        Returns:
+            int: Number of <ref> elements added.
+        """
+        self.namespace = root.nsmap.get(None)
+        self.index = self.build_index(root)
+        self.count = 0
+        self.link_element(root, (None, None, None, None))
+        return self.count
+
+    def build_index(self, root):
+        """Build the index from unit number tuples to AKN ids.
+
+        Args:
+            root: Root lxml element of the Akoma Ntoso document.
+
+        Returns:
+            dict: Map from tuples like ("60a", "1", None, None) to AKN ids.
+        """
+        index = {}
+        for elem in root.iter('{*}article'):
+            if self.is_quoted(elem):
+                continue
+            self.index_unit(elem, (None, None, None, None), index)
+        return index
+
+    def index_unit(self, elem, context, index):
+        key = self.unit_key(elem, context)
+        if key is not context and elem.get('id'):
+            index.setdefault(key, elem.get('id'))
+        for child in elem.iterchildren('{*}paragraph', '{*}point', '{*}list', '{*}intro',
+                                       '{*}content', '{*}hcontainer'):
+            self.index_unit(child, key, index)
+
+    def unit_key(self, elem, context):
+        """Returns the index key of the given element, or context if it's not a unit we index.
+        """
+        tag = elem.tag.rpartition('}')[2]
+        if tag == 'article':
+            level = 0
+        elif tag == 'paragraph':
+            level = 1
+        elif tag == 'point':
+            # Points in points are letters.
+            level = 3 if context[2] is not None else 2
+        else:
+            return context
+        num = elem.find('{*}num')
+        if num is None:
+            return context
+        num = self.normalize_num(''.join(num.itertext()))
+        if not num:
+            return context
+        return context[:level] + (num,) + (None,) * (3 - level)
+
+    def normalize_num(self, num):
+        num = num.replace(" ", "").replace("@@SUPERSCRIPT@@", "^").replace("##SUPERSCRIPT##", "")
+        return num.strip().rstrip(".)").lower()
+
+    def is_quoted(self, elem):
+        for ancestor in elem.iterancestors():
+            if ancestor.tag.rpartition('}')[2] in ('quotedStructure', 'embeddedStructure'):
+                return True
+        return False
+
+    def link_element(self, elem, context):
+        if not isinstance(elem.tag, basestring):
+            # Comments and processing instructions.
+            return
+        if elem.tag.rpartition('}')[2] in self.SKIP_ELEMENTS:
+            return
+        context = self.unit_key(elem, context)
+
+        if elem.text:
+            spans = self.find_spans(elem.text, context)
+            if spans:
+                elem.text = self.insert_refs(elem, elem.text, spans, 0)
+
+        for child in list(elem):
+            self.link_element(child, context)
+            if child.tail:
+                spans = self.find_spans(child.tail, context)
+                if spans:
+                    child.tail = self.insert_refs(elem, child.tail, spans,
+                                                  elem.index(child) + 1)
+
+    def find_spans(self, text, context):
+        """Scan the text once with the reference grammar.
+
+        Args:
+            text: The text to scan.
+            context: Index key of the unit the text is in, for relative references like
+                "ust. 2".
+
+        Returns:
+            list: List of (start, end, id) tuples for the numbers to link, in text order.
+        """
+        spans = []
+        chain = []
+        chain_key = None
+        last_end = None
+        for match in self.REFERENCE_RE.finditer(text):
+            if last_end is None or not self.CHAIN_GAP_RE.match(text[last_end:match.start()]):
+                self.flush_chain(text, last_end, chain, spans)
+                chain = []
+                chain_key = None
+
+            if match.group('unit'):
+                level = self.UNIT_LEVELS[match.group('unit').lower()]
+                items = self.NUM_RE.finditer(match.group('nums'))
+                items_start = match.start('nums')
+            else:
+                level = 3
+                items = self.LETTER_RE.finditer(match.group('letters'))
+                items_start = match.start('letters')
+
+            if chain_key is None:
+                # Start of a chain: "art." is absolute, everything else is relative to the
+                # unit we're in.
+                base = tuple(context[:level])
+            else:
+                base = chain_key[:level]
+
+            key = None
+            for item in items:
+                key = base + (self.normalize_num(item.group()),) + (None,) * (3 - level)
+                chain.append((items_start + item.start(), items_start + item.end(), key))
+            chain_key = key
+            last_end = match.end()
+        self.flush_chain(text, last_end, chain, spans)
+        return spans
+
+    def flush_chain(self, text, end, chain, spans):
+        if not chain:
+            return
+        # References to other acts, e.g. "art. 5 ustawy z dnia ...", are not ours.
+        if self.EXTERNAL_RE.match(text[end:]):
+            return
+        for start, stop, key in chain:
+            id_ = self.index.get(key)
+            if id_:
+                spans.append((start, stop, id_))
+
+    def insert_refs(self, parent, text, spans, position):
+        """Insert <ref> elements for all the spans of a text node at once.
+
+        Args:
+            parent: The element to insert the <ref> elements into.
+            text: The text of the text node.
+            spans: List of (start, end, id) tuples.
+            position: Index in parent at which the text node is.
+
+        Returns:
+            str: The text to keep in the text node, before the first <ref>.
+        """
+        tag = '{%s}ref' % self.namespace if self.namespace else 'ref'
+        refs = []
+        for i, (start, end, id_) in enumerate(spans):
+            ref = etree.Element(tag, href='#' + id_)
+            ref.text = text[start:end]
+            ref.tail = text[end:spans[i + 1][0]] if i + 1 < len(spans) else text[end:]
+            refs.append(ref)
+        parent[position:position] = refs
+        self.count += len(refs)
+        return text[:spans[0][0]]
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import re
+import sqlite3
+from collections import OrderedDict
+
+from indigo_pl.diff import unit_fingerprints
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS units (
+    id INTEGER PRIMARY KEY,
+    document INTEGER NOT NULL,
+    unit TEXT NOT NULL,
+    hash BLOB NOT NULL,
+    text TEXT NOT NULL,
+    UNIQUE (document, unit)
+);
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT NOT NULL,
+    unit INTEGER NOT NULL,
+    positions TEXT NOT NULL,
+    PRIMARY KEY (term, unit)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_unit ON postings (unit);
+CREATE TABLE IF NOT EXISTS terms (
+    term TEXT PRIMARY KEY,
+    count INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+FOLDED_LETTERS = {ord(a): b for a, b in zip("ąćęłńóśźż", "acelnoszz")}
+"""Polish letters with diacritics, mapped to the ones without, e.g. "ł" to "l"."""
+
+SUFFIXES = sorted([
+    "ami", "ach", "owi", "owie", "ow", "om", "em", "iem", "ie",
+    "ego", "emu", "ej", "ym", "im", "ymi", "imi", "ych", "ich",
+    "a", "e", "i", "o", "u", "y",
+], key=len, reverse=True)
+"""Inflectional endings (after folding) stripped from terms, longest first, so that e.g.
+"podpisu", "podpisem" and "podpis" are the same term."""
+
+MIN_STEM_LENGTH = 3
+"""Endings aren't stripped if what's left would be shorter than this."""
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+PHRASE_RE = re.compile(r'^\s*"(.*)"\s*$', re.UNICODE)
+"""Regex catching a query in double quotes, i.e. a phrase."""
+
+
+def normalize(word):
+    """Returns the index term of a word: lowercase, without diacritics and without its
+    inflectional ending, e.g. "zaufan" for "Zaufanego".
+    """
+    word = word.lower().translate(FOLDED_LETTERS)
+    if word.isdigit():
+        return word
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= MIN_STEM_LENGTH:
+            return word[:-len(suffix)]
+    return word
+
+
+def analyze(text):
+    """Returns the list of terms of the text, in order."""
+    return [normalize(word) for word in WORD_RE.findall(text)]
+
+
+class SearchIndex(object):
+    """ Full-text inverted index of the units (articles, paragraphs, points, ...) of all
+    documents, kept in a single SQLite file.
+
+    Each unit's own text (see indigo_pl.diff.unit_fingerprints) is split into terms, which are
+    normalized (see normalize()), and each term has a posting per unit it's in, with its
+    positions in the unit, so that phrases can be found too. Units keep the fingerprint of
+    their text, so that re-indexing a document only touches the units which changed.
+
+    Queries look up the postings of the rarest term first and only keep the units which have
+    all the other terms, so even corpus-wide queries take milliseconds.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path: Path to the SQLite file, created if it doesn't exist.
+        """
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.executescript(SCHEMA)
+
+    def index_document(self, document_id, xml):
+        """Indexes the units of a document, replacing the ones indexed before.
+
+        Args:
+            document_id: Id of the document.
+            xml: String with the Akoma Ntoso XML of the document.
+
+        Returns:
+            int: Number of units which were (re-)indexed, i.e. new or changed.
+        """
+        units = OrderedDict()
+        for unit in unit_fingerprints(xml).itervalues():
+            units.setdefault(unit.id or unit.path, unit)
+        indexed = {key: (rowid, bytes(hash_)) for rowid, key, hash_ in self.db.execute(
+            "SELECT id, unit, hash FROM units WHERE document = ?", (document_id,))}
+        count = 0
+        with self.db:
+            for key, (rowid, hash_) in indexed.iteritems():
+                unit = units.get(key)
+                if unit is None or unit.hash != hash_:
+                    self.remove_unit(rowid)
+            for key, unit in units.iteritems():
+                if key in indexed and indexed[key][1] == unit.hash:
+                    continue
+                self.add_unit(document_id, key, unit)
+                count += 1
+        return count
+
+    def add_unit(self, document_id, key, unit):
+        rowid = self.db.execute("INSERT INTO units (document, unit, hash, text) "
+                                "VALUES (?, ?, ?, ?)",
+                                (document_id, key, buffer(unit.hash), unit.text)).lastrowid
+        positions = {}
+        for i, term in enumerate(analyze(unit.text)):
+            positions.setdefault(term, []).append(str(i))
+        self.db.executemany("INSERT INTO postings (term, unit, positions) VALUES (?, ?, ?)",
+                            [(term, rowid, " ".join(p)) for term, p in positions.iteritems()])
+        self.update_counts(positions, 1)
+
+    def remove_unit(self, rowid):
+        terms = [row[0] for row in self.db.execute("SELECT term FROM postings WHERE unit = ?",
+                                                   (rowid,))]
+        self.db.execute("DELETE FROM postings WHERE unit = ?", (rowid,))
+        self.db.execute("DELETE FROM units WHERE id = ?", (rowid,))
+        self.update_counts(terms, -1)
+
+    def update_counts(self, terms, delta):
+        """Keeps the number of units with each term, used to find the rarest term of a query."""
+        self.db.executemany("INSERT OR IGNORE INTO terms (term, count) VALUES (?, 0)",
+                            [(term,) for term in terms])
+        self.db.executemany("UPDATE terms SET count = count + ? WHERE term = ?",
+                            [(delta, term) for term in terms])
+        if delta < 0:
+            # Only the terms of the unit, rather than a scan of the whole vocabulary.
+            self.db.executemany("DELETE FROM terms WHERE term = ? AND count <= 0",
+                                [(term,) for term in terms])
+
+    def remove_document(self, document_id):
+        """Removes all the units of the document from the index."""
+        with self.db:
+            for row in self.db.execute("SELECT id FROM units WHERE document = ?",
+                                       (document_id,)).fetchall():
+                self.remove_unit(row[0])
+
+    def documents(self):
+        """Returns the set of ids of the indexed documents."""
+        return set(row[0] for row in self.db.execute("SELECT DISTINCT document FROM units"))
+
+    def search(self, query, limit=50):
+        """Finds the units with all the words of the query, or with the words one after another
+        if the query is in double quotes, e.g. '"podpis zaufany"'. Words match regardless of
+        case, diacritics and inflection, so the latter finds "podpisem zaufanym" too.
+
+        Args:
+            query: The query.
+            limit: Maximum number of results.
+
+        Returns:
+            list: Dicts with "document" (id), "unit" (AKN id of the unit) and "text", ordered by
+                document.
+        """
+        match = PHRASE_RE.match(query)
+        phrase = match is not None
+        terms = analyze(match.group(1) if phrase else query)
+        if not terms:
+            return []
+        counts = dict(self.db.execute(
+            "SELECT term, count FROM terms WHERE term IN (%s)" % ",".join("?" * len(set(terms))),
+            list(set(terms))).fetchall())
+        if len(counts) < len(set(terms)):
+            # Some term isn't anywhere.
+            return []
+
+        # Start with the rarest term, and narrow down the candidates with the others.
+        # Map from unit to the positions of the terms in it.
+        candidates = None
+        for term in sorted(set(terms), key=counts.get):
+            narrowed = {}
+            for unit, positions in self.db.execute(
+                    "SELECT unit, positions FROM postings WHERE term = ?", (term,)):
+                if candidates is None:
+                    narrowed[unit] = {term: positions}
+                elif unit in candidates:
+                    narrowed[unit] = candidates[unit]
+                    narrowed[unit][term] = positions
+            candidates = narrowed
+            if not candidates:
+                return []
+
+        if phrase and len(terms) > 1:
+            candidates = {unit: positions for unit, positions in candidates.iteritems()
+                          if self.has_phrase(terms, positions)}
+
+        results = []
+        ids = list(candidates)
+        for i in xrange(0, len(ids), 500):
+            batch = ids[i:i + 500]
+            results.extend(self.db.execute(
+                "SELECT document, unit, text, id FROM units WHERE id IN (%s)"
+                % ",".join("?" * len(batch)), batch))
+        results.sort(key=lambda r: (r[0], r[3]))
+        return [{"document": document, "unit": unit, "text": text}
+                for document, unit, text, _ in results[:limit]]
+
+    def has_phrase(self, terms, positions):
+        """Returns whether the terms appear one after another, given their positions in the unit
+        as strings of space-separated numbers.
+        """
+        positions = {term: set(int(p) for p in ps.split()) for term, ps in positions.iteritems()}
+        return any(all(start + i in positions[term] for i, term in enumerate(terms))
+                   for start in positions[terms[0]])
+
+    def stats(self):
+        """Returns a dict with the number of "documents", "units" and distinct "terms"."""
+        documents, units = self.db.execute("SELECT COUNT(DISTINCT document), COUNT(*) "
+                                           "FROM units").fetchone()
+        terms = self.db.execute("SELECT COUNT(*) FROM terms").fetchone()[0]
+        return {"documents": documents, "units": units, "terms": terms}
+
+    def close(self):
+        self.db.close()
+
+
+def get_index():
+    """Opens the search index at settings.INDIGO_PL_SEARCH_INDEX."""
+    from django.conf import settings
+
+    return SearchIndex(settings.INDIGO_PL_SEARCH_INDEX)
+
+
+def index_document(document):
+    """Updates the search index entries of the given document, removing them if it's deleted.
+
+    Args:
+        document: The document to index.
+
+    Returns:
+        int: Number of units which were (re-)indexed.
+    """
+    index = get_index()
+    try:
+        if document.deleted or not document.document_xml:
+            index.remove_document(document.pk)
+            return 0
+        return index.index_document(document.pk, document.document_xml)
+    finally:
+        index.close()
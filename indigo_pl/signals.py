@@ -0,0 +1,40 @@
+import logging
+
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from indigo_api.models import Document
+from indigo_pl import search, signatures
+
+log = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=Document)
+def update_publication_signature(sender, instance, **kwargs):
+    """ Keep the publication signature index up to date, both for imported and edited documents.
+    """
+    if kwargs.get('raw'):
+        return
+    signatures.index_document(instance)
+
+
+@receiver(post_save, sender=Document)
+def update_search_index(sender, instance, **kwargs):
+    """ Keep the full-text search index up to date, both for imported and edited documents.
+    Only the units which changed since the document was last saved are re-indexed.
+
+    The index is updated once the document is committed, and a failure (e.g. a locked index
+    file or XML which doesn't parse) is only logged, as the document is saved already. It's
+    picked up by the next rebuild_search_index.
+    """
+    if kwargs.get('raw'):
+        return
+    transaction.on_commit(lambda: index_for_search(instance))
+
+
+def index_for_search(document):
+    try:
+        search.index_document(document)
+    except Exception:
+        log.exception("Indexing document %s for search failed", document.pk)
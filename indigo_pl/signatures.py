@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+import re
+
+SIGNATURE_RE = re.compile(r"^\s*(?P<journal>Dz\.\s?U\.|M\.\s?P\.)\s+(?P<year>\d{4})\s+"
+                          r"(?:Nr\s+(?P<number>\d+)\s+)?poz\.\s+(?P<poz>\d+)\s*$")
+"""Regex catching a publication signature, e.g. "Dz.U. 2018 poz. 1234" or
+"Dz.U. 1997 Nr 88 poz. 553". Same as ImporterPL.SIGNATURE_REGEX, but with named groups."""
+
+JOURNALS = {
+    u"dz.u.": u"Dz.U.",
+    u"dziennik ustaw": u"Dz.U.",
+    u"m.p.": u"M.P.",
+    u"monitor polski": u"M.P.",
+}
+"""Known spellings of the publication journals, mapped to the abbreviation used in signatures."""
+
+
+def normalize_journal(name):
+    """Returns the abbreviation ("Dz.U." or "M.P.") for the given journal name, or None if
+    it's not a journal we know.
+
+    Args:
+        name: The journal name, e.g. "Dziennik Ustaw" or "Dz. U.".
+    """
+    if not name:
+        return None
+    key = re.sub(r"\.\s+", ".", name.strip().lower())
+    return JOURNALS.get(key)
+
+
+def parse_signature(text):
+    """Parses a publication signature.
+
+    Args:
+        text: The signature, e.g. "Dz.U. 1997 Nr 88 poz. 553".
+
+    Returns:
+        tuple|None: Tuple (journal, year, number, poz), with number being None if the signature
+            doesn't have one, or None if the text isn't a signature.
+    """
+    match = SIGNATURE_RE.match(text)
+    if not match:
+        return None
+    number = match.group("number")
+    return (normalize_journal(match.group("journal")), int(match.group("year")),
+            int(number) if number else None, int(match.group("poz")))
+
+
+def split_publication_number(publication_number):
+    """Splits the publication number of a document. It can be split with a - which
+    indicates a number and a poz, e.g. "88-553". Pages showing documents read the split
+    numbers from their PublicationSignature instead, see indigo_pl.templatetags.
+
+    Args:
+        publication_number: The "publication_number" field of a document.
+
+    Returns:
+        tuple: Tuple (number, poz), with number being None if there isn't one.
+    """
+    if not publication_number:
+        return None, publication_number
+    if '-' in publication_number:
+        return tuple(publication_number.split("-")[:2])
+    return None, publication_number
+
+
+def signature_for_document(document):
+    """Returns the signature of the given document.
+
+    Args:
+        document: The document.
+
+    Returns:
+        tuple|None: Tuple (journal, year, number, poz), or None if the document doesn't have
+            enough publication info or isn't published in a journal we know.
+    """
+    journal = normalize_journal(document.publication_name)
+    if not journal or not document.publication_date:
+        return None
+    number, poz = split_publication_number(document.publication_number)
+    try:
+        number = int(number) if number else None
+        poz = int(poz)
+    except (TypeError, ValueError):
+        return None
+    return journal, document.publication_date.year, number, poz
+
+
+def index_document(document):
+    """Updates the publication signature index entry for the given document.
+
+    Args:
+        document: The document to index.
+
+    Returns:
+        PublicationSignature|None: The index entry, or None if the document doesn't have
+            a signature.
+    """
+    from indigo_pl.models import PublicationSignature
+
+    signature = signature_for_document(document)
+    if signature is None or document.deleted:
+        PublicationSignature.objects.filter(document=document).delete()
+        return None
+    journal, year, number, poz = signature
+    entry, _ = PublicationSignature.objects.update_or_create(document=document, defaults={
+        'journal': journal,
+        'year': year,
+        'number': number,
+        'poz': poz,
+        'frbr_uri': document.frbr_uri,
+    })
+    return entry
+
+
+def resolve(journal, year, number, poz):
+    """Find the work published under the given signature.
+
+    Args:
+        journal: Journal name or abbreviation, e.g. "Dz.U.".
+        year: Year of publication.
+        number: The "Nr" part of the signature, or None.
+        poz: The "poz." part of the signature.
+
+    Returns:
+        str|None: The FRBR URI of the work, or None if there's no such work.
+    """
+    from indigo_pl.models import PublicationSignature
+
+    return (PublicationSignature.objects
+            .filter(journal=normalize_journal(journal), year=year, number=number, poz=poz)
+            .values_list('frbr_uri', flat=True)
+            .first())
+
+
+def resolve_citation(text):
+    """Find the work cited by the given signature, e.g. "Dz.U. 2018 poz. 1234".
+
+    Args:
+        text: The citation.
+
+    Returns:
+        str|None: The FRBR URI of the work, or None if the citation isn't a signature or
+            there's no such work.
+    """
+    signature = parse_signature(text)
+    if signature is None:
+        return None
+    return resolve(*signature)
@@ -1,15 +1,30 @@
 from django import template
 
+from indigo_pl.signatures import split_publication_number
+
 register = template.Library()
 
 
+def publication_signature(document):
+    """ The PublicationSignature of the document, which has the number and poz parsed already
+    when it's saved, if it was fetched together with the document, e.g. with
+    select_related('publication_signature'). Otherwise None, rather than a query for each
+    document of a list page, which costs more than splitting the publication number.
+    """
+    if type(document).publication_signature.is_cached(document):
+        return document.publication_signature
+    return None
+
+
 @register.filter
 def publication_number(document):
     """ The publication number can be split with a - which indicates
     a number and a poz.
     """
-    if document.publication_number and '-' in document.publication_number:
-        return document.publication_number.split("-")[0]
+    signature = publication_signature(document)
+    if signature is not None:
+        return signature.number
+    return split_publication_number(document.publication_number)[0]
 
 
 @register.filter
@@ -17,6 +32,7 @@ def publication_poz(document):
     """ The publication number can be split with a - which indicates
     a number and a poz.
     """
-    if document.publication_number and '-' in document.publication_number:
-        return document.publication_number.split("-")[1]
-    return document.publication_number
+    signature = publication_signature(document)
+    if signature is not None:
+        return signature.poz
+    return split_publication_number(document.publication_number)[1]
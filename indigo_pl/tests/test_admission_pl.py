@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import subprocess
+import tempfile
+
+from nose.tools import *  # noqa
+
+from django.test import testcases
+from indigo_pl import admission, metrics
+
+
+class AdmissionPLTestCase(testcases.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'admission.sqlite')
+        admission.configure(self.path, {'extraction': 100, 'reformat': 10})
+        self.controller = admission._controller
+
+    def tearDown(self):
+        admission._controller = None
+        metrics.ADMISSION_QUEUE.set_function(None)
+        shutil.rmtree(self.dir)
+
+    def test_fair_queueing(self):
+        first = self.controller.enqueue('reformat', 6)
+        second = self.controller.enqueue('reformat', 6)
+        third = self.controller.enqueue('reformat', 1)
+        # Tickets are admitted in order, even when a later one would fit.
+        assert_false(self.controller.try_admit(second, 'reformat', 6))
+        assert_true(self.controller.try_admit(first, 'reformat', 6))
+        assert_false(self.controller.try_admit(second, 'reformat', 6))
+        assert_false(self.controller.try_admit(third, 'reformat', 1))
+        assert_equal(self.controller.queue()['reformat'],
+                     {'waiting': 2, 'running': 1, 'running_weight': 6})
+        lines = metrics.exposition().splitlines()
+        assert_in('indigo_pl_admission_queue{resource="reformat",state="waiting"} 2.0', lines)
+        assert_in('indigo_pl_admission_queue{resource="extraction",state="running"} 0.0', lines)
+
+        self.controller.release(first)
+        assert_true(self.controller.try_admit(second, 'reformat', 6))
+        assert_true(self.controller.try_admit(third, 'reformat', 1))
+        # Too heavy for the capacity, but admitted once nothing else is running.
+        heavy = self.controller.enqueue('reformat', 50)
+        assert_false(self.controller.try_admit(heavy, 'reformat', 50))
+        self.controller.release(second)
+        self.controller.release(third)
+        assert_true(self.controller.try_admit(heavy, 'reformat', 50))
+
+    def test_orphans_and_timeout(self):
+        # A ticket left behind by a process which was killed.
+        process = subprocess.Popen(['true'])
+        process.wait()
+        orphan = self.controller.enqueue('reformat', 10)
+        assert_true(self.controller.try_admit(orphan, 'reformat', 10))
+        db = self.controller.connect()
+        db.execute('UPDATE tickets SET pid = ?', (process.pid,))
+        db.close()
+
+        with admission.admit('reformat', 10) as waited:
+            assert_equal(self.controller.queue()['reformat'],
+                         {'waiting': 0, 'running': 1, 'running_weight': 10})
+            self.controller.MAX_WAIT = 0
+            with assert_raises(admission.AdmissionError):
+                with admission.admit('reformat', 1):
+                    pass
+        assert_less(waited, self.controller.MAX_WAIT + 1)
+        assert_equal(self.controller.queue()['reformat'],
+                     {'waiting': 0, 'running': 0, 'running_weight': 0})
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+
+from nose.tools import *  # noqa
+
+from django.test import testcases
+from indigo_pl.artifacts import ArtifactStore
+from indigo_pl.importer import ImporterPL
+
+from indigo_pl.tests.test_importer_pl import make_fontspec_tag, make_tag
+
+
+def make_version(n, changed_article):
+    lines = []
+    for article in xrange(1, n + 1):
+        lines.append(u"Art. %d. Przepis numer %d dotyczy kiełbasy%s." % (
+            article, article, u" i musztardy" if article == changed_article else u""))
+        lines.extend(u"%d) punkt %d artykułu %d;" % (i, i, article) for i in xrange(1, 6))
+    return u"\n".join(lines) + u"\n"
+
+
+class ArtifactStoreTestCase(testcases.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.store = ArtifactStore(os.path.join(self.dir, "artifacts.sqlite"))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.dir)
+
+    def test_roundtrip(self):
+        text = make_version(50, None)
+        self.store.put("dzu-2016-1579", "v1", "text", [text[:1000], text[1000:]])
+        assert_equal(self.store.get("dzu-2016-1579", "v1", "text").decode('utf-8'), text)
+        assert_equal(self.store.get("dzu-2016-1579", "v1", "raw"), None)
+        assert_equal(self.store.stages("dzu-2016-1579", "v1"), ["text"])
+        assert_raises(KeyError, list, self.store.iter_artifact("dzu-2016-1579", "v2", "text"))
+
+    def test_versions_share_chunks(self):
+        versions = [make_version(2000, changed) for changed in (None, 10, 1500, 700)]
+        for i, text in enumerate(versions):
+            self.store.put("dzu-2016-1579", "v%d" % i, "text", text)
+        stats = self.store.stats()
+        assert_equal(stats["size"], sum(len(v.encode('utf-8')) for v in versions))
+        # Compressed and stored mostly once.
+        assert_less(stats["stored_size"] * 10, stats["size"])
+        assert_equal(self.store.get("dzu-2016-1579", "v2", "text").decode('utf-8'), versions[2])
+        assert_equal(self.store.versions("dzu-2016-1579"), ["v0", "v1", "v2", "v3"])
+
+        self.store.delete("dzu-2016-1579", "v0")
+        assert_equal(self.store.get("dzu-2016-1579", "v3", "text").decode('utf-8'), versions[3])
+        self.store.delete("dzu-2016-1579")
+        assert_equal(self.store.stats()["stored_size"], 0)
+
+    def test_importer_keeps_intermediates(self):
+        importer = ImporterPL()
+        importer.artifact_store = self.store
+        importer.artifact_key = ("dzu-2016-1579", "abc")
+        raw = make_tag(u"<i>[Art. 1. Bla.]</i>") + make_fontspec_tag()
+        text = importer.reformat_text(raw)
+        assert_equal(self.store.stages("dzu-2016-1579", "abc"), ["raw", "stripped", "text"])
+        assert_equal(self.store.get("dzu-2016-1579", "abc", "raw").decode('utf-8'), raw)
+        assert_equal(self.store.get("dzu-2016-1579", "abc", "text").decode('utf-8'), text)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import time
+
+from nose.tools import *  # noqa
+
+from django.test import testcases
+from indigo_pl.diff import diff_documents, unit_fingerprints
+
+OLD = u"""<akomaNtoso xmlns="http://www.akomantoso.org/2.0"><act><body>
+  <article id="art-1"><num>1.</num>
+    <paragraph id="art-1.ust-1"><num>1.</num><content><p>Ustawa określa zasady.</p></content></paragraph>
+    <paragraph id="art-1.ust-2"><num>2.</num><intro><p>Ustawa stosuje się do:</p></intro>
+      <point><num>1)</num><content><p>kiełbas;</p></content></point>
+      <point><num>2)</num><content><p>musztardy.</p></content></point>
+    </paragraph>
+  </article>
+  <article id="art-2"><num>2.</num><content><p>Uchyla się ustawę.</p></content></article>
+  <article id="art-3"><num>3.</num><content><p>Ustawa wchodzi w życie.</p></content></article>
+</body></act></akomaNtoso>
+"""
+
+NEW = u"""<akomaNtoso xmlns="http://www.akomantoso.org/2.0"><act><body>
+  <article id="art-1"><num>1.</num>
+    <paragraph id="art-1.ust-1"><num>1.</num><content><p>Ustawa określa ogólne zasady.</p></content></paragraph>
+    <paragraph id="art-1.ust-2"><num>2.</num><intro><p>Ustawa stosuje się do:</p></intro>
+      <point><num>1)</num><content><p>kiełbas;</p></content></point>
+      <point><num>2)</num><content><p>musztardy;</p></content></point>
+      <point><num>3)</num><content><p>chrzanu.</p></content></point>
+    </paragraph>
+  </article>
+  <article id="art-2a"><num>2a.</num><content><p>Ustawa wchodzi w życie.</p></content></article>
+</body></act></akomaNtoso>
+"""
+
+
+def make_act(articles, changed = None):
+    units = []
+    for i in xrange(1, articles + 1):
+        points = u"".join(u"<point id='art-%d.pkt-%d'><num>%d)</num><content><p>punkt %d "
+                          u"artykułu %d%s;</p></content></point>" % (
+                              i, j, j, j, i, u" zmieniony" if (i, j) == changed else u"")
+                          for j in xrange(1, 6))
+        units.append(u"<article id='art-%d'><num>%d.</num><intro><p>Artykuł %d stosuje się "
+                     u"do:</p></intro>%s</article>" % (i, i, i, points))
+    return (u"<akomaNtoso xmlns='http://www.akomantoso.org/2.0'><act><body>%s</body></act>"
+            u"</akomaNtoso>" % u"".join(units))
+
+
+class DiffPLTestCase(testcases.TestCase):
+
+    def test_unit_paths(self):
+        units = unit_fingerprints(OLD)
+        assert_equal(units.keys(), ["art-1", "art-1/ust-1", "art-1/ust-2", "art-1/ust-2/pkt-1",
+                                    "art-1/ust-2/pkt-2", "art-2", "art-3"])
+        assert_equal(units["art-1/ust-2"].text, u"Ustawa stosuje się do:")
+
+    def test_diff(self):
+        diff = diff_documents(OLD, NEW)
+        assert_equal([c['path'] for c in diff['changed']], ["art-1/ust-1", "art-1/ust-2/pkt-2"])
+        assert_equal([op for op in diff['changed'][0]['diff'] if op['op'] != 'equal'],
+                     [{'op': 'insert', 'old': u'', 'new': u'ogólne'}])
+        assert_equal([a['path'] for a in diff['added']], ["art-1/ust-2/pkt-3"])
+        assert_equal([r['path'] for r in diff['removed']], ["art-2"])
+        assert_equal(diff['moved'], [{'from': "art-3", 'to': "art-2a"}])
+        assert_equal(diff['unchanged'], 3)
+
+    def test_diff_large_act(self):
+        old = make_act(2000)
+        new = make_act(2000, changed = (1234, 3))
+        start = time.time()
+        diff = diff_documents(old, new)
+        assert_less(time.time() - start, 1.0)
+        assert_equal([c['path'] for c in diff['changed']], ["art-1234/pkt-3"])
+        assert_equal(diff['unchanged'], 11999)
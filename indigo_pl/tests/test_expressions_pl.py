@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+from datetime import date
+
+from nose.tools import *  # noqa
+
+from django.test import testcases
+from indigo_pl.expressions import ExpressionMaterializer
+from indigo_pl.importer import ImporterPL
+from indigo_pl.tests.test_importer_pl import make_fontspec_tag, make_page, make_tag
+
+TEXT = (make_page(1, make_fontspec_tag()
+                  + make_tag(u"Art. 1. Ustawa stosuje się do <i>[kiełbas]</i> "
+                             u"<b>&lt;kiełbas i musztardy&gt;</b>.", top = 100)
+                  + make_tag(u"<i>[Art. 2. Kiełbasy są smaczne. </i>", top = 120))
+        + make_page(2, make_tag(u"<i>Musztarda też.]</i>", top = 100)
+                    + make_tag(u"Art. 3. Kiełbasy je się z musztardą.", top = 120)
+                    + make_tag(u"<b>&lt;Art. 4. Ustawa wchodzi w życie.&gt;</b>", top = 140)))
+
+
+def make_marker(number, top):
+    return make_tag(u"%d)" % number, top = top, left = 700, height = 10, font = 2)
+
+
+# The footnotes give the dates on which the changes to Art. 1 and Art. 4 come into force, and
+# there's none for Art. 2.
+FOOTNOTED_TEXT = make_page(1, make_fontspec_tag() + make_fontspec_tag(font_id = 2, size = 10)
+                           + make_tag(u"Art. 1. Ustawa stosuje się do <i>[kiełbas]</i> "
+                                      u"<b>&lt;kiełbas i musztardy&gt;</b>", top = 100)
+                           + make_marker(1, 98)
+                           + make_tag(u"<i>[Art. 2. Kiełbasy są smaczne.]</i>", top = 120)
+                           + make_tag(u"Art. 3. Kiełbasy je się z musztardą.", top = 130)
+                           + make_tag(u"<b>&lt;Art. 4. Ustawa wchodzi w życie.&gt;</b>",
+                                      top = 140)
+                           + make_marker(2, 138)
+                           + make_tag(u"Art. 5. Ustawa stosuje się do 3) kiełbas.", top = 160)
+                           + make_tag(u"1) Zmieniony przez art. 1 ustawy z dnia 9 listopada "
+                                      u"2018 r. (Dz. U. poz. 2244), która wchodzi w", top = 900,
+                                      height = 10, font = 2)
+                           + make_tag(u"życie z dniem 1 stycznia 2020 r.", top = 910,
+                                      height = 10, font = 2)
+                           + make_tag(u"2) Dodany przez art. 2 tej ustawy, która wejdzie w życie "
+                                      u"z dniem 1 lipca 2021 r.", top = 920, height = 10,
+                                      font = 2))
+
+class ExpressionsPLTestCase(testcases.TestCase):
+
+    def setUp(self):
+        self.importer = ImporterPL()
+        self.importer.IMPORT_MODE = "in-memory"
+        self.materializer = ExpressionMaterializer(self.importer, TEXT, {
+            0: date(2020, 1, 1), 1: date(2020, 1, 1), 2: date(2021, 1, 1)})
+
+    def test_alternatives(self):
+        assert_equal([(a.outgoing is not None, a.upcoming is not None)
+                      for a in self.materializer.alternatives],
+                     [(True, True), (True, False), (False, True)])
+
+    def test_expressions(self):
+        expressions = self.materializer.expressions(date(2019, 6, 1))
+        assert_equal(expressions.keys(), [date(2019, 6, 1), date(2020, 1, 1), date(2021, 1, 1)])
+        assert_equal(expressions.values(), [
+            u"Art. 1. Ustawa stosuje się do kiełbas.\n"
+            u"Art. 2. Kiełbasy są smaczne. Musztarda też.\n"
+            u"Art. 3. Kiełbasy je się z musztardą.\n",
+            u"Art. 1. Ustawa stosuje się do kiełbas i musztardy.\n"
+            u"Art. 3. Kiełbasy je się z musztardą.\n",
+            u"Art. 1. Ustawa stosuje się do kiełbas i musztardy.\n"
+            u"Art. 3. Kiełbasy je się z musztardą.\n"
+            u"Art. 4. Ustawa wchodzi w życie.\n",
+        ])
+        # Dates with the same versions in force share the text.
+        assert_equal(len(self.materializer.cache), 3)
+        self.materializer.text_at(date(2020, 6, 1))
+        assert_equal(len(self.materializer.cache), 3)
+        assert_equal(self.importer.upcoming_in_force, None)
+
+    def test_expressions_windowed(self):
+        self.importer.IMPORT_MODE = "windowed"
+        assert_equal(self.materializer.text_at(date(2019, 6, 1)),
+                     u"Art. 1. Ustawa stosuje się do kiełbas.\n"
+                     u"Art. 2. Kiełbasy są smaczne. Musztarda też.\n"
+                     u"Art. 3. Kiełbasy je się z musztardą.\n")
+
+    def test_effective_dates_from_footnotes(self):
+        materializer = ExpressionMaterializer(self.importer, FOOTNOTED_TEXT)
+        assert_equal(len(materializer.alternatives), 3)
+        assert_equal(materializer.effective_dates, {0: date(2020, 1, 1), 2: date(2021, 7, 1)})
+        assert_equal(materializer.expressions(date(2019, 6, 1)).keys(),
+                     [date(2019, 6, 1), date(2020, 1, 1), date(2021, 7, 1)])
@@ -17,6 +17,10 @@ def make_fontspec_tag(font_id = 1, size = 18):
     return (u"<fontspec id='" + utfify(font_id) 
             + u"' size='" + utfify(size) + u"'></fontspec>")
 
+def make_page(number, content):
+    return (u"<page number='" + utfify(number) + u"' position='absolute' top='0' left='0'>"
+            + content + u"</page>")
+
 def utfify(num):
     return str(num).encode("utf-8").decode("utf-8")
 
@@ -443,6 +447,62 @@ class ImporterPLTestCase(testcases.TestCase):
                      + u"słuchacza,  o którym  mowa  w art.  36  ust. 16  pkt  1  ustawy  –  Prawo "
                      + u"oświatowe niepełnoletniego słuchacza – również dla jego rodziców.\n")
 
+    def test_find_alternatives(self):
+        # Ustawa z dnia 7 września 1991 r. o systemie oświaty
+        line1 = u"2. W <i>[szkole  dla  dorosłych]</i> <b>&lt;szkole  dla  dorosłych,  branżowej </b>"
+        line2 = u"<b>szkole  policealnej&gt;  </b>oceny  są  jawne  dla  słuchacza,  a w przypadku "
+        line3 = u"<i>[słuchacza,  o którym  mowa  w art.  36  ust. 16  pkt  1  ustawy  –  Prawo </i>"
+        line4 = u"<i>oświatowe]</i> – również dla jego rodziców. "
+        line5 = u"<b>&lt;3. Oceny są uzasadniane.&gt;</b>"
+        text = (make_tag(line1, top = 100) + u"\n" + make_tag(line2, top = 110) + u"\n"
+                + make_tag(line3, top = 120) + u"\n" + make_tag(line4, top = 130) + u"\n"
+                + make_tag(line5, top = 140) + u"\n" + make_fontspec_tag())
+        alternatives = self.importer.find_alternatives(text)
+        assert_equal([(a.outgoing is not None, a.upcoming is not None) for a in alternatives],
+                     [(True, True), (True, False), (False, True)])
+        assert_equal(text[alternatives[0].outgoing.text_start:alternatives[0].outgoing.text_end],
+                     u"szkole  dla  dorosłych")
+
+        self.importer.upcoming_in_force = set()
+        assertEquals(self.importer.reformat_text(text), u""
+                     + u"2. W szkole  dla  dorosłych oceny  są  jawne  dla  słuchacza,  a w przypadku "
+                     + u"słuchacza,  o którym  mowa  w art.  36  ust. 16  pkt  1  ustawy  –  Prawo "
+                     + u"oświatowe – również dla jego rodziców.\n")
+        assert_equal(self.importer.diagnostics["alternatives"], 3)
+        self.importer.upcoming_in_force = set([0, 1, 2])
+        assertEquals(self.importer.reformat_text(text), u""
+                     + u"2. W szkole  dla  dorosłych,  branżowej szkole  policealnej oceny  są  jawne  "
+                     + u"dla  słuchacza,  a w przypadku – również dla jego rodziców.\n"
+                     + u"3. Oceny są uzasadniane.\n")
+
+    def test_pdf_to_text_mmap(self):
+        text = (make_page(1, make_fontspec_tag()
+                          + make_tag(u"1. W <i>[szkole]</i> <b>&lt;szkole branżowej&gt;</b>", top = 100)
+                          + make_tag(u"oceny są jawne dla <i>[słuchacza</i>", top = 110))
+                + make_page(2, make_tag(u"<i>i rodziców]</i>.", top = 100)))
+
+        def shell(cmd):
+            with open(cmd[-1] + ".xml", "wb") as f:
+                f.write(text.encode("utf-8"))
+            return 0, "", ""
+
+        class PDF(object):
+            name = "ustawa.pdf"
+
+        self.importer.preflight_class = None
+        self.importer.shell = shell
+        self.importer.PDF_OUTPUT = "mmap"
+        for mode in ["in-memory", "windowed"]:
+            for upcoming_in_force in [None, set([0])]:
+                self.importer.IMPORT_MODE = mode
+                self.importer.upcoming_in_force = upcoming_in_force
+                mapped = self.importer.pdf_to_text(PDF())
+                assert_not_equal(type(mapped), unicode)
+                assertEquals(self.importer.reformat_text(mapped),
+                             self.importer.reformat_text(text))
+        assert_equal(self.importer.reformat_text(mapped),
+                     u"1. W szkole branżowej oceny są jawne dla słuchacza i rodziców.\n")
+
     def test_reformat_text_remove_hyphenation(self):
         line1 = u"All your base are be-"
         line2 = u"long to Legia Warszawa FC."
@@ -622,6 +682,89 @@ class ImporterPLTestCase(testcases.TestCase):
         assertEquals(reformatted, text1.strip() + u" " + text2.strip() + u" " + text3.strip() + u" "
                     + text4.strip() + u" " + text5.strip() + u"\n")
         
+    def test_reformat_remove_formula_region(self):
+        indent = ImporterPL.INDENT_LEVELS1[0]
+        reformatted = self.importer.reformat_text(u""
+            + make_tag(u"Art. 1. Kwota jest", top = 70)
+            + make_tag(u"obliczana na każdy", top = 80)
+            + make_tag(u"dzień w sposób", top = 90)
+            + make_tag(u"określony za pomocą:", top = 100)
+            # Formula: unusual spacing, smaller font for the subscript.
+            + make_tag(u"W = A", top = 125, left = indent + 100)
+            + make_tag(u"n", top = 131, left = indent + 130, height = 12, font = 2)
+            + make_tag(u"+ B", top = 125, left = indent + 150)
+            + make_tag(u"gdzie:", top = 150)
+            + make_tag(u"W – wartość,", top = 160)
+            + make_tag(u"A – kwota.", top = 170)
+            + make_fontspec_tag(font_id = 1, size = 18)
+            + make_fontspec_tag(font_id = 2, size = 12))
+        assertEquals(reformatted, u"Art. 1. Kwota jest obliczana na każdy dzień w sposób "
+                     + u"określony za pomocą: (sprawdź wzór w tekście oficjalnym) gdzie: "
+                     + u"W – wartość, A – kwota.\n")
+
+    def test_reformat_keep_point_list_after_colon(self):
+        indent = ImporterPL.INDENT_LEVELS1
+        lines = (u"Art. 1. Kwota jest",
+                 u"obliczana na każdy",
+                 u"dzień w sposób",
+                 u"określony następująco:")
+        head = u"".join(make_tag(line, top = 70 + i * 10) for i, line in enumerate(lines))
+        tail = (make_tag(u"Art. 2. Ustawa wchodzi", top = 200)
+                + make_tag(u"w życie.", top = 210)
+                + make_fontspec_tag())
+        # Points with their numbers apart from their text, as two columns.
+        numbered = (make_tag(u"1)", top = 125, left = indent[1])
+                    + make_tag(u"kwota A,", top = 125, left = indent[1] + 34)
+                    + make_tag(u"2)", top = 150, left = indent[1])
+                    + make_tag(u"kwota B.", top = 150, left = indent[1] + 34))
+        # Points with paragraph spacing.
+        spaced = (make_tag(u"1) kwota A,", top = 125, left = indent[1])
+                  + make_tag(u"2) kwota B.", top = 150, left = indent[1]))
+        for points in [numbered, spaced]:
+            reformatted = self.importer.reformat_text(head + points + tail)
+            assert_not_in(ImporterPL.FORMULA_REPLACEMENT, reformatted)
+            assert_in(u"kwota A,", reformatted)
+            assert_in(u"kwota B.", reformatted)
+            assert_true(reformatted.startswith(u"Art. 1. Kwota jest obliczana na każdy dzień w "
+                                               u"sposób określony następująco:"))
+
+    def test_reformat_keep_point_with_footnote_after_colon(self):
+        indent = ImporterPL.INDENT_LEVELS1
+        text = (make_tag(u"Art. 1. Ilekroć w", top = 70)
+                + make_tag(u"ustawie jest", top = 80)
+                + make_tag(u"mowa o:", top = 90)
+                + make_tag(u"1) podatniku", top = 125, left = indent[1])
+                + make_tag(u"1)", top = 122, left = indent[1] + 120, height = 10, font = 2)
+                + make_tag(u"– rozumie się przez to osobę fizyczną,", top = 125,
+                           left = indent[1] + 150)
+                + make_tag(u"2) płatniku – rozumie się przez to", top = 150, left = indent[1])
+                + make_tag(u"osobę prawną.", top = 160, left = indent[1])
+                + make_tag(u"Art. 2. Ustawa wchodzi", top = 200)
+                + make_tag(u"w życie.", top = 210)
+                + make_fontspec_tag() + make_fontspec_tag(font_id = 2, size = 10))
+        reformatted = self.importer.reformat_text(text)
+        assert_not_in(ImporterPL.FORMULA_REPLACEMENT, reformatted)
+        assert_in(u"1) podatniku – rozumie się przez to osobę fizyczną,", reformatted)
+        assert_in(u"2) płatniku – rozumie się przez to osobę prawną.", reformatted)
+
+    def test_reformat_remove_table_region(self):
+        indent = ImporterPL.INDENT_LEVELS1[0]
+        reformatted = self.importer.reformat_text(u""
+            + make_tag(u"Art. 1. Stawki wynoszą", top = 100)
+            + make_tag(u"Wartość", top = 110, left = indent)
+            + make_tag(u"Stawka", top = 110, left = indent + 150)
+            + make_tag(u"Uwagi", top = 110, left = indent + 300)
+            + make_tag(u"do 100", top = 120, left = indent)
+            + make_tag(u"1%", top = 120, left = indent + 150)
+            + make_tag(u"brak", top = 120, left = indent + 300)
+            + make_tag(u"ponad 100", top = 130, left = indent)
+            + make_tag(u"2%", top = 130, left = indent + 150)
+            + make_tag(u"brak", top = 130, left = indent + 300)
+            + make_tag(u"i są płatne z góry.", top = 140)
+            + make_fontspec_tag())
+        assertEquals(reformatted, u"Art. 1. Stawki wynoszą (sprawdź tabelę w tekście oficjalnym) "
+                     + u"i są płatne z góry.\n")
+
     def test_reformat_add_newline_if_level0_unit_starts_with_level1_unit_case_1(self):
         line1 = u"Art. 123. 1. All your base are belong to Legia Warszawa FC."
         reformatted = self.importer.reformat_text(make_tag(line1) + make_fontspec_tag())
@@ -1117,3 +1260,197 @@ class ImporterPLTestCase(testcases.TestCase):
                     + u"@@INDENT4@@– – – sausage fast\n")
 
         # TODO: A few more test cases could be added.
+
+    def test_reformat_text_windowed_joins_across_pages(self):
+        indent = ImporterPL.INDENT_LEVELS1
+        text = (make_page(1, make_fontspec_tag()
+                + make_tag(u"Art. 1. Kwota jest obliczana", top = 100, left = indent[0])
+                + make_tag(u"jak niżej:", top = 110, left = indent[0]))
+            + make_page(2, make_tag(u"gdzie poszczególne symbole oznaczają koszty", top = 100,
+                                    left = indent[0])
+                + make_tag(u"Art. 2. Sausages are a fundamental human right, which shall be",
+                           top = 110, left = indent[0])
+                + make_tag(u"enjoyed by every citizen of the Republic of Poland and its", top = 120,
+                           left = indent[0])
+                + make_tag(u"in-", top = 130, left = indent[0]))
+            + make_page(3, make_tag(u"habitants", top = 100, left = indent[0])
+                + make_tag(u"– without exception.", top = 110, left = indent[0])))
+        expected = self.importer.reformat_text(text)
+        self.importer.IMPORT_MODE = "windowed"
+        chunks = list(self.importer.iter_reformatted_text_windowed(text))
+        assert_greater(len(chunks), 1)
+        assertEquals(u"".join(chunks), expected)
+        assertEquals(expected, u"Art. 1. Kwota jest obliczana jak niżej: gdzie poszczególne "
+                     + u"symbole oznaczają koszty\n"
+                     + u"Art. 2. Sausages are a fundamental human right, which shall be enjoyed by "
+                     + u"every citizen of the Republic of Poland and its inhabitants – without "
+                     + u"exception.\n")
+
+    def test_reformat_text_parallel(self):
+        indent = ImporterPL.INDENT_LEVELS1
+        pages = [make_fontspec_tag()]
+        for i in xrange(1, 7):
+            pages.append(make_tag(u"Art. %d. Kwota jest równa iloczynowi, wyrażony" % i, top = 100,
+                                  left = indent[0])
+                         + make_tag(u"wzorem:", top = 110, left = indent[0])
+                         + make_tag(u"K = A × B", top = 120, left = indent[0] + 100)
+                         + make_tag(u"gdzie poszczególne symbole oznaczają koszty i", top = 130,
+                                    left = indent[0]))
+            pages.append(make_tag(u"– kwoty.", top = 100, left = indent[0])
+                         + make_tag(u"Art. %d. Kwota jest równa, wyrażony wzorem:" % (i + 10),
+                                    top = 110, left = indent[0])
+                         + make_tag(u"K = A × B", top = 120, left = indent[0] + 100))
+            pages.append(make_tag(u"gdzie poszczególne symbole oznaczają koszty.", top = 100,
+                                  left = indent[0]))
+        text = u"".join(make_page(i + 1, page) for i, page in enumerate(pages))
+        self.importer.IMPORT_MODE = "windowed"
+        expected = self.importer.reformat_text(text)
+        self.importer.IMPORT_MODE = "parallel"
+        self.importer.PARALLEL_WORKERS = 2
+        self.importer.PARALLEL_CHUNK_SIZE = 1
+        self.importer.PARALLEL_MIN_PAGES = 0
+        assertEquals(self.importer.reformat_text(text), expected)
+        assert_in(u"Art. 1. Kwota jest równa iloczynowi, wyrażony wzorem: gdzie poszczególne "
+                  + u"symbole oznaczają koszty i – kwoty.\n", expected)
+        assert_not_in(u"K = A", expected)
+        # Pages which end in a formula, and the ones after them, are done in the parent.
+        assert_equal(self.importer.diagnostics["pages_redone"], 12)
+        transfer = self.importer.diagnostics["transfer"]
+        assert_equal(transfer["pages"], 19)
+        assert_greater(transfer["buffer_bytes"], len(text))
+        assert_greater(transfer["result_chars"], len(expected))
+
+    def test_reformat_text_reading_order(self):
+        left = ImporterPL.INDENT_LEVELS1[0]
+        text = (make_page(1, make_fontspec_tag()
+                          + make_tag(u"Art. 2. Ustawa wchodzi", top = 120)
+                          + make_tag(u"Art. 1. All your base", top = 100)
+                          + make_tag(u"Warszawa FC.", top = 110, left = left + 200)
+                          + make_tag(u"are belong to Legia", top = 111))
+                + make_page(2, make_tag(u"w życie.", top = 100)))
+        for level in ["strict", "fast"]:
+            self.importer.VALIDATION_LEVEL = level
+            assertEquals(self.importer.reformat_text(text),
+                         u"Art. 1. All your base are belong to Legia Warszawa FC.\n"
+                         u"Art. 2. Ustawa wchodzi w życie.\n")
+            assert_equal(self.importer.diagnostics["reordered_nodes"], 3)
+
+    def test_reformat_text_reading_order_uneven_baseline(self):
+        left = ImporterPL.INDENT_LEVELS1[0]
+        text = make_page(1, make_fontspec_tag()
+                         + make_tag(u"base are belong to us.", top = 100, left = left + 300)
+                         + make_tag(u"Art. 1. All your", top = 101, left = left)
+                         + make_tag(u"Legia Warszawa FC.", top = 102, left = left + 50))
+        for level in ["strict", "fast"]:
+            self.importer.VALIDATION_LEVEL = level
+            assertEquals(self.importer.reformat_text(text),
+                         u"Art. 1. All your base are belong to us. Legia Warszawa FC.\n")
+            assert_equal(self.importer.diagnostics["reordered_nodes"], 2)
+            # The node 2 points below the highest one of the line starts the next line, both
+            # when sorting and when numbering lines.
+            xml = BeautifulSoup(text)
+            self.importer.add_fontsize_to_all_text_nodes(xml)
+            self.importer.sort_text_nodes_in_reading_order(xml)
+            self.importer.add_line_nums_to_law_text(xml)
+            assert_equal([(node.get_text(), node["line"]) for node in xml.find_all("text")],
+                         [(u"Art. 1. All your", 1), (u"base are belong to us.", 1),
+                          (u"Legia Warszawa FC.", 2)])
+
+    def test_reformat_text_validation_levels_report_same_errors(self):
+        # Overlapping nodes on the same line, which can't be put in order.
+        unsorted = make_page(1, make_fontspec_tag()
+            + make_tag(u"All your base are belong", top = 100)
+            + make_tag(u"to Legia Warszawa FC.", top = 100,
+                       left = ImporterPL.INDENT_LEVELS1[0] + 5))
+        no_font = make_page(1, make_fontspec_tag()
+            + u"<text top='100' left='96' height='18' width='10'>No font.</text>")
+        for text, message in [(unsorted, u"Non-increasing 'left'"), (no_font, u"on page [1]")]:
+            for level in ["strict", "fast"]:
+                self.importer.VALIDATION_LEVEL = level
+                with assert_raises(Exception) as context:
+                    self.importer.reformat_text(text)
+                assert_in(message, str(context.exception))
+                assert_in(u"on page [1]", str(context.exception))
+
+    def test_reformat_text_fast_validation_level(self):
+        text = make_page(1, make_fontspec_tag()
+            + make_tag(u"Art. 1. All your base are belong", top = 100)
+            + make_tag(u"to Legia", top = 110) + make_tag(u"Warszawa FC.", top = 110, left = 300))
+        expected = self.importer.reformat_text(text)
+        self.importer.VALIDATION_LEVEL = "fast"
+        assertEquals(self.importer.reformat_text(text), expected)
+
+    def test_reformat_text_disabled_stage(self):
+        text = u"All your base are belong to Legia Warszawa FC."
+        margin_text = u"Section 123 has been abrogated."
+        self.importer.disabled_stages = frozenset(["remove_right_margin"])
+        reformatted = self.importer.reformat_text(""
+            + make_tag(text) 
+            + make_tag(margin_text, 100, ImporterPL.RIGHT_MARGIN_START_OFFSET + 1)
+            + make_fontspec_tag())
+        assertEquals(reformatted, text + u" " + margin_text + u"\n")
+
+    def test_run_node_stages_fused(self):
+        xml = BeautifulSoup(u"<page number='1'>" + make_fontspec_tag()
+            + make_tag(u"Header", top = ImporterPL.HEADER_END_OFFSET - 1) + make_tag(u"  ")
+            + make_tag(u"Text", font = 2) + u"</page>")
+        traversals = []
+        find_all = xml.find_all
+        def counting_find_all(name = None, *args, **kwargs):
+            traversals.append(name)
+            return find_all(name, *args, **kwargs)
+        xml.find_all = counting_find_all
+        self.importer.run_pipeline(xml, ["remove_empty_text_nodes", "remove_header_and_footer",
+                                         "remove_right_margin", "add_fontsize_to_all_text_nodes"])
+        assert_equal(traversals.count("text"), 1)
+        assert_equal([(n.get_text(), n["fontsize"]) for n in find_all("text")],
+                     [(u"Text", ImporterPL.NO_FONTSIZE)])
+
+    def test_scan_features(self):
+        text = (make_tag(u"Art. 1. Kwota jest obliczana według wzoru:") + make_tag(u"<i>[Art. 2.")
+                + make_tag(u"1", height = 10) + make_tag(u"<b> . Bla bla]</b>"))
+        assert_equal(self.importer.scan_features(text), {
+            "markers": True, "formulas": True, "specific_phrases": True, "superscripts": True})
+        assert_equal(self.importer.scan_features(make_tag(u"Art. 1. Bla. Bla.")), {
+            "markers": False, "formulas": False, "specific_phrases": False,
+            "superscripts": False})
+
+    def test_reformat_text_diagnostics(self):
+        self.importer.IMPORT_MODE = "in-memory"
+        self.importer.VALIDATION_LEVEL = "strict"
+        reformatted = self.importer.reformat_text(
+            make_tag(u"All your base are belong to Legia Warszawa FC.") + make_fontspec_tag())
+        assertEquals(reformatted, u"All your base are belong to Legia Warszawa FC.\n")
+        assert_equal(self.importer.diagnostics["skipped_stages"], {
+            "remove_outgoing_and_upcoming_section_markers": "no markers",
+            "remove_formulas": "no formulas",
+            "remove_specific_unparsable_text_units": "no specific_phrases",
+            "process_superscripts": "no superscripts",
+        })
+
+    def test_get_indent_level(self):
+        indents = [96, 110, 130]
+        assert_equal(self.importer.get_indent_level(84, indents), 0)
+        assert_equal(self.importer.get_indent_level(83, indents), None)
+        assert_equal(self.importer.get_indent_level(108, indents), 0)
+        assert_equal(self.importer.get_indent_level(109, indents), 1)
+        assert_equal(self.importer.get_indent_level(142, indents), 2)
+        assert_equal(self.importer.get_indent_level(143, indents), None)
+
+    def test_find_indent_profile(self):
+        profile = self.importer.find_indent_profile({96: 10, 162: 3, 400: 1})
+        assert_equal((profile.source, profile), ("INDENT_LEVELS1", ImporterPL.INDENT_LEVELS1))
+        # Unknown layout: levels 0, 1 and 3 are used, level 2 is filled in and the centered
+        # heading is ignored.
+        profile = self.importer.find_indent_profile(
+            {58: 1, 60: 40, 61: 5, 93: 20, 94: 2, 157: 7, 400: 4})
+        assert_equal((profile.source, profile), ("inferred", [60, 93, 125, 157]))
+
+    def test_reformat_text_inferred_indent_levels(self):
+        reformatted = self.importer.reformat_text(""
+            + make_tag(u"Art. 1. All your base are belong to", top = 100, left = 60)
+            + make_tag(u"– Legia Warszawa FC.", top = 110, left = 60)
+            + make_tag(u"1) sausages;", top = 120, left = 93)
+            + make_fontspec_tag())
+        assertEquals(reformatted, u"Art. 1. All your base are belong to – Legia Warszawa FC.\n"
+                     + u"1) sausages;\n")
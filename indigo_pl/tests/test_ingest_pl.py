@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+from datetime import date
+
+from nose.tools import *  # noqa
+
+from django.test import testcases
+from indigo_pl.importer import ImporterPL
+from indigo_pl.ingest import Debouncer, IngestDaemon, work_key, write_expressions
+from indigo_pl.tests.test_expressions_pl import FOOTNOTED_TEXT
+
+
+class IngestTestCase(testcases.TestCase):
+
+    def setUp(self):
+        self.source = tempfile.mkdtemp()
+        self.output = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.source)
+        shutil.rmtree(self.output)
+
+    def write_pdf(self, name, content):
+        with open(os.path.join(self.source, name), 'wb') as f:
+            f.write(content)
+
+    def test_work_key(self):
+        assert_equal(work_key("D20161579Lj.pdf"), "dzu-2016-1579")
+        assert_equal(work_key("M20180012L.pdf"), "mp-2018-12")
+        assert_equal(work_key("ustawa.pdf"), "ustawa")
+
+    def test_debouncer_waits_for_file_to_settle(self):
+        now = [100.0]
+        debouncer = Debouncer(5, clock=lambda: now[0])
+        path = os.path.join(self.source, "D20161579Lj.pdf")
+        self.write_pdf("D20161579Lj.pdf", b"%PDF-1.4 partial")
+        debouncer.touch(path)
+        assert_equal(debouncer.ready(), [])
+        now[0] += 6
+        assert_equal(debouncer.ready(), [path])
+        assert_equal(debouncer.pending, {})
+
+    def test_daemon_imports_new_content_once(self):
+        imported = []
+
+        def ingest(path, digest, work_dir):
+            imported.append((os.path.basename(path), os.path.basename(work_dir)))
+            with open(os.path.join(work_dir, digest + ".json"), 'w') as f:
+                f.write('{"ok": true}')
+            return {"ok": True, "fingerprint": digest}
+
+        self.write_pdf("D20161579Lj.pdf", b"%PDF-1.4 one")
+        os.mkdir(os.path.join(self.source, "old"))
+        self.write_pdf(os.path.join("old", "D20161579Lj.pdf"), b"%PDF-1.4 one")
+        self.write_pdf("D20180012Lj.pdf", b"%PDF-1.4 two")
+        self.write_pdf("notes.txt", b"not a pdf")
+        for _ in range(2):
+            daemon = IngestDaemon(self.source, self.output, workers=0, settle=0,
+                                  use_inotify=False, poll_interval=0, ingest=ingest)
+            daemon.run(once=True)
+        # The copy in "old" has the same content, and nothing changed before the second run.
+        assert_equal(sorted(imported), [("D20161579Lj.pdf", "dzu-2016-1579"),
+                                        ("D20180012Lj.pdf", "dzu-2018-12")])
+
+    def test_write_expressions(self):
+        importer = ImporterPL()
+        importer.IMPORT_MODE = "in-memory"
+        names = write_expressions(importer, FOOTNOTED_TEXT, self.output, "abc",
+                                  today=date(2020, 3, 1))
+        assert_equal(names, {"2020-03-01": "abc@2020-03-01.txt",
+                             "2021-07-01": "abc@2021-07-01.txt"})
+        assert_equal(sorted(os.listdir(self.output)), ["abc@2020-03-01.txt", "abc@2021-07-01.txt"])
+        with open(os.path.join(self.output, "abc@2021-07-01.txt")) as f:
+            assert_in(u"Art. 4. Ustawa wchodzi w życie.", f.read().decode('utf-8'))
+        with open(os.path.join(self.output, "abc@2020-03-01.txt")) as f:
+            assert_not_in(u"Art. 4.", f.read().decode('utf-8'))
+        # Nothing comes into force later.
+        assert_equal(write_expressions(importer, FOOTNOTED_TEXT, self.output, "abc",
+                                       today=date(2022, 1, 1)),
+                     {"2022-01-01": "abc@2022-01-01.txt"})
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import os
+
+from nose.tools import *  # noqa
+
+from django.test import testcases
+from indigo_pl import isolation
+from indigo_pl.importer import ImporterPL
+from indigo_pl.pagebuffer import MappedText
+from indigo_pl.tests.test_importer_pl import make_fontspec_tag, make_page, make_tag
+
+
+class SpinningImporterPL(ImporterPL):
+    """ An importer whose imports never end."""
+
+    def reformat_text_in_memory(self, text):
+        while True:
+            pass
+
+
+class IsolationPLTestCase(testcases.TestCase):
+
+    def setUp(self):
+        isolation.configure(0, 0, 2, 60)
+
+    def tearDown(self):
+        isolation.stop_idle()
+        isolation._limits = None
+
+    def test_import_in_worker(self):
+        text = make_page(1, make_fontspec_tag() + make_tag(u"Art. 1. Tekst."))
+        importer = ImporterPL()
+        assert_equal(importer.reformat_text(text), u"Art. 1. Tekst.\n")
+        assert_in("stage_seconds", importer.diagnostics)
+        worker, = isolation._idle
+        pid = worker.process.pid
+        # Errors are raised as they are, and the worker is reused, up to 2 imports.
+        unsorted = make_page(1, make_fontspec_tag()
+                             + make_tag(u"All your base are belong", top = 100)
+                             + make_tag(u"to Legia Warszawa FC.", top = 100,
+                                        left = ImporterPL.INDENT_LEVELS1[0] + 5))
+        with assert_raises_regexp(Exception, "Non-increasing 'left' attribute"):
+            importer.reformat_text(unsorted)
+        assert_equal(isolation._idle, [])
+        assert_false(worker.process)
+        importer.IMPORT_MODE = "windowed"
+        path = isolation.write_text(text)
+        mapped = MappedText.open(path)
+        os.remove(path)
+        assert_equal(importer.reformat_text(mapped), u"Art. 1. Tekst.\n")
+        assert_not_equal(isolation._idle[0].process.pid, pid)
+
+    def test_parallel_import_in_worker(self):
+        text = u"".join(make_page(i + 1, (make_fontspec_tag() if i == 0 else u"")
+                                  + make_tag(u"Art. %d. Tekst artykułu." % (i + 1)))
+                        for i in xrange(20))
+        importer = ImporterPL()
+        importer.IMPORT_MODE = "windowed"
+        expected = importer.reformat_text(text)
+        importer.IMPORT_MODE = "parallel"
+        importer.PARALLEL_WORKERS = 2
+        importer.PARALLEL_CHUNK_SIZE = 1
+        importer.PARALLEL_MIN_PAGES = 0
+        assert_equal(importer.reformat_text(text), expected)
+        # The pages were handed to the pool of the worker in a PageBuffer.
+        assert_equal(importer.diagnostics["transfer"]["pages"], 20)
+        assert_equal(importer.diagnostics["pages_redone"], 0)
+
+    def test_limits(self):
+        text = make_page(1, make_fontspec_tag() + make_tag(u"Art. 1. Tekst."))
+        worker = isolation.ImportWorker(0, 1, 2, 60)
+        with assert_raises_regexp(isolation.ImportWorkerError, "CPU time"):
+            list(worker.iter_reformatted_text(SpinningImporterPL(), text))
+        assert_is_none(worker.process)
+        worker = isolation.ImportWorker(0, 0, 2, 1)
+        with assert_raises_regexp(isolation.ImportWorkerError, "took over 1 seconds"):
+            list(worker.iter_reformatted_text(SpinningImporterPL(), text))
+        assert_is_none(worker.process)
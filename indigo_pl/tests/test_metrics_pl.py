@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from nose.tools import *  # noqa
+
+from django.test import testcases
+from indigo_pl import metrics
+from indigo_pl.importer import ImporterPL
+from indigo_pl.tests.test_importer_pl import make_fontspec_tag, make_page, make_tag
+
+
+class MetricsPLTestCase(testcases.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        metrics.configure(self.dir)
+
+    def tearDown(self):
+        metrics._path = None
+        shutil.rmtree(self.dir)
+
+    def test_exposition(self):
+        metrics.PDFTOHTML_FAILURES.inc(code=1)
+        metrics.PDFTOHTML_FAILURES.inc(code=1)
+        metrics.TOC_BUILD_DURATION.observe(0.07)
+        metrics.TOC_BUILD_DURATION.observe(3)
+        metrics.REQUEST_DURATION.observe(0.2, endpoint='parse', status='2xx')
+        lines = metrics.exposition().splitlines()
+        assert_in('# TYPE indigo_pl_pdftohtml_failures_total counter', lines)
+        assert_in('indigo_pl_pdftohtml_failures_total{code="1"} 2.0', lines)
+        # Buckets are cumulative.
+        assert_in('indigo_pl_toc_build_duration_seconds_bucket{le="0.05"} 0.0', lines)
+        assert_in('indigo_pl_toc_build_duration_seconds_bucket{le="0.1"} 1.0', lines)
+        assert_in('indigo_pl_toc_build_duration_seconds_bucket{le="5.0"} 2.0', lines)
+        assert_in('indigo_pl_toc_build_duration_seconds_bucket{le="+Inf"} 2.0', lines)
+        assert_in('indigo_pl_toc_build_duration_seconds_count 2.0', lines)
+        assert_in('indigo_pl_request_duration_seconds_count{endpoint="parse",status="2xx"} 1.0',
+                  lines)
+
+    def test_import_metrics(self):
+        importer = ImporterPL()
+        importer.reformat_text(make_page(1, make_fontspec_tag() + make_tag(u"Art. 1. Tekst.")))
+        assert_in("add_newline_if_level0_unit_starts_with_level1_unit", importer.diagnostics["stage_seconds"])
+        unsorted = make_page(1, make_fontspec_tag()
+                             + make_tag(u"All your base are belong", top = 100)
+                             + make_tag(u"to Legia Warszawa FC.", top = 100,
+                                        left = ImporterPL.INDENT_LEVELS1[0] + 5))
+        for i in xrange(2):
+            with assert_raises(Exception):
+                importer.reformat_text(unsorted)
+
+        store = metrics.MetricsStore(metrics._path)
+        samples = store.samples()
+        store.close()
+        assert_equal(samples[("indigo_pl_import_duration_seconds_count",
+                              (("mode", "in-memory"),))], 3)
+        assert_equal(samples[("indigo_pl_import_pages_bucket", (("le", "1.0"),))], 3)
+        assert_equal(samples[("indigo_pl_import_stage_duration_seconds_count",
+                              (("stage", "add_newline_if_level0_unit_starts_with_level1_unit"),))], 1)
+        errors = [(labels, value) for (name, labels), value in samples.iteritems()
+                  if name == "indigo_pl_import_errors_total"]
+        assert_equal(errors, [((("stage", "add_line_nums_to_law_text"),
+                                ("error", "Non-increasing 'left' attribute")), 2)])
+
+    def test_import_error_with_non_ascii_node(self):
+        text = make_page(1, make_fontspec_tag()
+                         + u"<text left='96' height='18' width='10' font='1'>gęślą</text>")
+        for path in [metrics._path, None]:
+            metrics._path = path
+            with assert_raises_regexp(Exception, "doesn't have all the expected attributes"):
+                ImporterPL().reformat_text(text)
+        assert_equal(metrics.exception_message(Exception(u"gęślą".encode("utf-8"))), u"gęślą")
+        assert_equal(metrics.exception_message(Exception(u"gęślą")), u"gęślą")
+
+    def test_flush_when_store_is_busy(self):
+        metrics.flush()
+        metrics.PDFTOHTML_FAILURES.inc(code=1)
+        lock = sqlite3.connect(metrics._path)
+        lock.execute("BEGIN EXCLUSIVE")
+        start = time.time()
+        metrics.flush()
+        assert_less(time.time() - start, 1)
+        lock.rollback()
+        lock.close()
+        # The samples are kept until the store can be written.
+        metrics.PDFTOHTML_FAILURES.inc(code=1)
+        assert_in('indigo_pl_pdftohtml_failures_total{code="1"} 2.0',
+                  metrics.exposition().splitlines())
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+import os
+
+from nose.tools import *  # noqa
+
+from django.test import testcases
+from indigo_pl.pagebuffer import PageBuffer
+
+
+class PageBufferPLTestCase(testcases.TestCase):
+
+    def test_pages(self):
+        pages = [u"<page number='1'>Zażółć</page>", u"", u"<page number='3'>gęślą jaźń</page>"]
+        buffer = PageBuffer.create(iter(pages))
+        try:
+            assert_equal(len(buffer), 3)
+            assert_equal([buffer[i] for i in xrange(3)], pages)
+            # Workers map the same file.
+            other = PageBuffer(buffer.path)
+            assert_equal(other[2], pages[2])
+            other.close()
+            assert_true(os.path.exists(buffer.path))
+        finally:
+            buffer.close()
+        assert_false(os.path.exists(buffer.path))
+
+    def test_no_pages(self):
+        buffer = PageBuffer.create([])
+        assert_equal(len(buffer), 0)
+        buffer.close()
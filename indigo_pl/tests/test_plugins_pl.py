@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from nose.tools import *  # noqa
+
+from django.test import testcases
+from indigo_pl.plugins import LAZY_PLUGINS, LazyImporterPL
+
+
+class PluginsPLTestCase(testcases.TestCase):
+
+    def test_lazy_plugin_returns_real_plugin(self):
+        from indigo_pl.importer import ImporterPL
+
+        importer = LazyImporterPL()
+        assert_is_instance(importer, ImporterPL)
+        assert_equal(importer.IMPORT_MODE, ImporterPL.IMPORT_MODE)
+
+    def test_lazy_plugins_match_real_locales(self):
+        for plugin in LAZY_PLUGINS:
+            assert_equal(plugin.locale, plugin.load().locale, plugin.plugin)
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import *  # noqa
+
+from django.test import testcases
+from indigo_pl.preflight import PDFPreflight, PreflightError
+
+PDFINFO = b"""Title:          D20161579Lj
+Producer:       Microsoft Word
+Pages:          %d
+Encrypted:      no
+"""
+
+PDFFONTS_HEADER = (b"name                                 type              encoding         emb sub uni\n"
+                   b"------------------------------------ ----------------- ---------------- --- --- ---\n")
+
+PDFFONTS = PDFFONTS_HEADER + b"TimesNewRoman                        TrueType          WinAnsi          yes no  no\n"
+
+
+class FakeShell(object):
+
+    def __init__(self, pages = 12, fonts = PDFFONTS, first_page = u"USTAWA"):
+        self.outputs = {
+            "pdfinfo": PDFINFO % pages,
+            "pdffonts": fonts,
+            "pdftotext": first_page.encode('utf-8'),
+        }
+        self.commands = []
+
+    def __call__(self, cmd):
+        self.commands.append(cmd[0])
+        return 0, self.outputs[cmd[0]], b""
+
+
+class PDFPreflightTestCase(testcases.TestCase):
+
+    def test_accepts_unified_text(self):
+        shell = FakeShell()
+        info = PDFPreflight(shell).check("law.pdf")
+        assert_equal(info["Pages"], "12")
+        assert_equal(shell.commands, ["pdfinfo", "pdffonts", "pdftotext"])
+
+    def test_rejects_scans(self):
+        with assert_raises(PreflightError) as context:
+            PDFPreflight(FakeShell(fonts = PDFFONTS_HEADER)).check("scan.pdf")
+        assert_in("no text layer", str(context.exception))
+
+    def test_rejects_page_count_and_document_type(self):
+        assert_raises(PreflightError, PDFPreflight(FakeShell(pages = 5000)).check, "big.pdf")
+        shell = FakeShell(first_page = u"OBWIESZCZENIE MARSZAŁKA SEJMU\n"
+                                       u"w sprawie ogłoszenia jednolitego tekstu ustawy")
+        with assert_raises(PreflightError) as context:
+            PDFPreflight(shell).check("tj.pdf")
+        assert_in("tekst jednolity", str(context.exception))
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+import json
+import tempfile
+from multiprocessing import active_children
+
+from nose.tools import *  # noqa
+
+from django.test import testcases
+from indigo_pl import isolation
+from indigo_pl.importer import ImporterPL
+from indigo_pl.preview import LEADING_PAGES, iter_preview_events
+from indigo_pl.tests.test_importer_pl import make_fontspec_tag, make_page, make_tag
+
+
+def parse_event(event):
+    name, data = event.rstrip("\n").split("\n")
+    return name[len("event: "):], json.loads(data[len("data: "):])
+
+
+def make_act(first, last):
+    """The XML pdftohtml makes of pages first to last of an act with an article per page."""
+    return u"".join(
+        make_page(i, (make_fontspec_tag() if i == first else u"")
+                  + make_tag(u"Art. %d. Tekst artykułu." % i, top = 100 + i * 10000))
+        for i in xrange(first, last + 1))
+
+
+class PreviewPLTestCase(testcases.TestCase):
+
+    def setUp(self):
+        self.pages = 3
+        self.commands = []
+        self.importer = ImporterPL()
+        self.importer.preflight_class = None
+        self.importer.shell = self.pdftohtml
+
+    def tearDown(self):
+        isolation.stop_idle()
+        isolation._limits = None
+
+    def pdftohtml(self, cmd):
+        self.commands.append(cmd)
+        first, last = 1, self.pages
+        if "-f" in cmd:
+            first = int(cmd[cmd.index("-f") + 1])
+            last = min(int(cmd[cmd.index("-l") + 1]), last)
+        return 0, make_act(first, last).encode("utf-8"), ""
+
+    def test_preview_events(self):
+        f = tempfile.NamedTemporaryFile(suffix=".pdf")
+        events = [parse_event(event) for event in iter_preview_events(self.importer, f)]
+        assert_equal(events[0], ("progress", {"stage": "extraction", "pages": LEADING_PAGES}))
+        # The leading pages are the whole PDF.
+        assert_equal(len(self.commands), 1)
+        assert_not_in("draft", [name for name, data in events])
+        progress = [data["pages"] for name, data in events[1:] if name == "progress"]
+        assert_equal(progress, sorted(progress))
+        assert_equal(progress[-1], 3)
+        assert_equal(u"".join(data for name, data in events if name == "text"),
+                     ImporterPL().reformat_text(make_act(1, 3)))
+        assert_equal(events[-1][0], "done")
+        assert_true(f.closed)
+
+    def test_preview_draft_of_leading_pages(self):
+        self.pages = 25
+        f = tempfile.NamedTemporaryFile(suffix=".pdf")
+        events = [parse_event(event) for event in iter_preview_events(self.importer, f)]
+        names = [name for name, data in events]
+        # The draft comes before the whole PDF is converted.
+        assert_less(names.index("draft"),
+                    events.index(("progress", {"stage": "extraction", "pages": None})))
+        assert_equal(u"".join(data for name, data in events if name == "draft"),
+                     ImporterPL().reformat_text(make_act(1, LEADING_PAGES)))
+        assert_equal(u"".join(data for name, data in events if name == "text"),
+                     ImporterPL().reformat_text(make_act(1, 25)))
+        assert_equal([cmd[5:-1] for cmd in self.commands],
+                     [["-f", "1", "-l", str(LEADING_PAGES)], []])
+
+    def test_preview_error_and_cancel(self):
+        self.importer.shell = lambda cmd: (1, "", "Syntax Error: Couldn't read xref table")
+        f = tempfile.NamedTemporaryFile(suffix=".pdf")
+        events = [parse_event(event) for event in iter_preview_events(self.importer, f)]
+        assert_equal(events[-1], ("error", {"detail": "Syntax Error: Couldn't read xref table"}))
+
+        f = tempfile.NamedTemporaryFile(suffix=".pdf")
+        events = iter_preview_events(self.importer, f)
+        next(events)
+        events.close()
+        assert_true(f.closed)
+
+    def test_preview_cancel_during_import(self):
+        self.pages = 5
+        for workers in [False, True]:
+            if workers:
+                isolation.configure(0, 0, 2, 60)
+            f = tempfile.NamedTemporaryFile(suffix=".pdf")
+            events = iter_preview_events(self.importer, f)
+            while parse_event(next(events))[0] != "text":
+                pass
+            events.close()
+            assert_true(f.closed)
+            if workers:
+                # The import worker was stopped half-way rather than kept for the next import.
+                assert_equal(isolation._idle, [])
+                assert_equal(active_children(), [])
+            else:
+                assert_less(self.importer.pages_done, 5)
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import *  # noqa
+
+from lxml import etree
+from django.test import testcases
+from indigo_pl.refs import RefsFinderPL
+
+AKN = u"""<akomaNtoso xmlns="http://www.akomantoso.org/2.0"><act><body>
+<article id="art-5"><num>5.</num>
+  <paragraph id="art-5.ust-1"><num>1.</num><content><p>Tekst.</p></content></paragraph>
+  <paragraph id="art-5.ust-2"><num>2.</num><content><p>Jak w ust. 1 oraz w art. 7 pkt 1–3.</p></content></paragraph>
+</article>
+<article id="art-6"><num>6@@SUPERSCRIPT@@1##SUPERSCRIPT##.</num><content><p>Tekst.</p></content></article>
+<article id="art-7"><num>7.</num>
+  <list id="art-7.list"><intro><p>Wstęp:</p></intro>
+    <point id="art-7.pkt-1"><num>1)</num><content><p>o których mowa w art. 5 ust. 1 i 2 oraz art. 6@@SUPERSCRIPT@@1##SUPERSCRIPT##;</p></content></point>
+    <point id="art-7.pkt-3"><num>3)</num><content><p>o których mowa w art. 5 ustawy z dnia 1 stycznia 2000 r.</p></content></point>
+  </list>
+</article>
+<article id="art-8"><num>8.</num><content><p>Zmienia się <b>art. 5</b> ust. 2:</p>
+  <quotedStructure><article id="x-art-5"><num>5.</num><content><p>art. 7</p></content></article></quotedStructure>
+</content></article>
+</body></act></akomaNtoso>"""
+
+
+def refs(elem):
+    return [(r.text, r.get('href')) for r in elem.iter('{*}ref')]
+
+
+class RefsFinderPLTestCase(testcases.TestCase):
+
+    def setUp(self):
+        self.finder = RefsFinderPL()
+        self.root = etree.fromstring(AKN)
+        self.finder.find_references(self.root)
+
+    def find(self, id_):
+        return self.root.xpath("//*[@id='%s']" % id_)[0]
+
+    def test_relative_and_absolute_references(self):
+        assert_equal(refs(self.find("art-5.ust-2")),
+                     [(u"1", u"#art-5.ust-1"), (u"7", u"#art-7"),
+                      (u"1", u"#art-7.pkt-1"), (u"3", u"#art-7.pkt-3")])
+        assert_equal(etree.tostring(self.find("art-5.ust-2").find('{*}content/{*}p'),
+                                    encoding='unicode', with_tail=False),
+                     u'<p xmlns="http://www.akomantoso.org/2.0">Jak w ust. '
+                     u'<ref href="#art-5.ust-1">1</ref> oraz w art. <ref href="#art-7">7</ref> '
+                     u'pkt <ref href="#art-7.pkt-1">1</ref>–<ref href="#art-7.pkt-3">3</ref>.</p>')
+
+    def test_lists_and_superscripts(self):
+        assert_equal(refs(self.find("art-7.pkt-1")),
+                     [(u"5", u"#art-5"), (u"1", u"#art-5.ust-1"), (u"2", u"#art-5.ust-2"),
+                      (u"6@@SUPERSCRIPT@@1##SUPERSCRIPT##", u"#art-6")])
+
+    def test_external_references_are_not_linked(self):
+        assert_equal(refs(self.find("art-7.pkt-3")), [])
+
+    def test_quoted_structures_are_not_linked(self):
+        assert_equal(refs(self.find("art-8")), [(u"5", u"#art-5")])
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import time
+
+from nose.tools import *  # noqa
+
+from django.test import testcases
+from indigo_pl.search import SearchIndex, normalize
+from indigo_pl.tests.test_diff_pl import make_act
+
+ACT = u"""<akomaNtoso xmlns="http://www.akomantoso.org/2.0"><act><body>
+  <article id="art-1"><num>1.</num>
+    <paragraph id="art-1.ust-1"><num>1.</num><content><p>Wniosek opatruje się podpisem
+      zaufanym albo podpisem osobistym.</p></content></paragraph>
+    <paragraph id="art-1.ust-2"><num>2.</num><content><p>Profil zaufany potwierdza się
+      w punkcie potwierdzającym.</p></content></paragraph>
+  </article>
+  <article id="art-2"><num>2.</num><content><p>Ustawa wchodzi w życie.</p></content></article>
+</body></act></akomaNtoso>
+"""
+
+
+class SearchPLTestCase(testcases.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.index = SearchIndex(os.path.join(self.dir, "search.sqlite"))
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.dir)
+
+    def units(self, query):
+        return [(r["document"], r["unit"]) for r in self.index.search(query)]
+
+    def test_normalize(self):
+        assert_equal(normalize(u"Zaufanego"), u"zaufan")
+        assert_equal(normalize(u"zaufany"), u"zaufan")
+        assert_equal(normalize(u"podpisem"), normalize(u"podpis"))
+        assert_equal(normalize(u"życie"), u"zyc")
+        assert_equal(normalize(u"ŁÓDŹ"), u"lodz")
+        assert_equal(normalize(u"2018"), u"2018")
+
+    def test_search(self):
+        assert_equal(self.index.index_document(1, ACT), 4)
+        # Any form of the words, anywhere in the unit...
+        assert_equal(self.units(u"podpis zaufany"), [(1, u"art-1.ust-1")])
+        assert_equal(self.units(u"zaufany"), [(1, u"art-1.ust-1"), (1, u"art-1.ust-2")])
+        assert_equal(self.units(u"zycie USTAWY"), [(1, u"art-2")])
+        # ... or as a phrase.
+        assert_equal(self.units(u'"podpis zaufany"'), [(1, u"art-1.ust-1")])
+        assert_equal(self.units(u'"zaufany podpis"'), [])
+        assert_equal(self.units(u"podpis kwalifikowany"), [])
+
+    def test_reindex_only_changed_units(self):
+        self.index.index_document(1, ACT)
+        self.index.index_document(2, ACT)
+        changed = ACT.replace(u"Ustawa wchodzi w życie.", u"Ustawa traci moc.")
+        assert_equal(self.index.index_document(1, changed), 1)
+        assert_equal(self.units(u"ustawa"), [(1, u"art-2"), (2, u"art-2")])
+        assert_equal(self.units(u"życie"), [(2, u"art-2")])
+        terms = self.index.stats()["terms"]
+        self.index.remove_document(2)
+        assert_equal(self.units(u"życie"), [])
+        assert_equal(self.index.stats()["documents"], 1)
+        # "wchodzi" and "życie" were only in the removed unit.
+        assert_equal(self.index.stats()["terms"], terms - 2)
+
+    def test_search_is_fast(self):
+        for document_id in xrange(1, 6):
+            self.index.index_document(document_id, make_act(500, changed=(document_id, 3)))
+        start = time.time()
+        results = self.units(u'"punkt 3 artykułu 4 zmieniony"')
+        assert_less(time.time() - start, 0.05)
+        assert_equal(results, [(4, u"art-4.pkt-3")])
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import *  # noqa
+
+from django.test import testcases
+from indigo_pl import signatures
+
+
+class SignaturesPLTestCase(testcases.TestCase):
+
+    def test_parse_signature(self):
+        assert_equal(signatures.parse_signature(u"Dz.U. 2018 poz. 1234"),
+                     (u"Dz.U.", 2018, None, 1234))
+        assert_equal(signatures.parse_signature(u" Dz.U. 1997 Nr 88 poz. 553 "),
+                     (u"Dz.U.", 1997, 88, 553))
+        assert_equal(signatures.parse_signature(u"M.P. 2001 poz. 12"),
+                     (u"M.P.", 2001, None, 12))
+        assert_equal(signatures.parse_signature(u"Art. 12. Dz.U. 2018 poz. 1234"), None)
+
+    def test_normalize_journal(self):
+        assert_equal(signatures.normalize_journal(u"Dziennik Ustaw"), u"Dz.U.")
+        assert_equal(signatures.normalize_journal(u"Dz. U."), u"Dz.U.")
+        assert_equal(signatures.normalize_journal(u"Monitor Polski"), u"M.P.")
+        assert_equal(signatures.normalize_journal(u"Government Gazette"), None)
+        assert_equal(signatures.normalize_journal(None), None)
+
+    def test_split_publication_number(self):
+        assert_equal(signatures.split_publication_number(u"88-553"), (u"88", u"553"))
+        assert_equal(signatures.split_publication_number(u"1234"), (None, u"1234"))
+        assert_equal(signatures.split_publication_number(u""), (None, u""))
+        assert_equal(signatures.split_publication_number(None), (None, None))
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import *  # noqa
+
+from django.test import testcases
+from indigo_pl.toc import TOCBuilderPL
+
+AKN = u"""<?xml version="1.0" encoding="UTF-8"?>
+<akomaNtoso xmlns="http://www.akomantoso.org/2.0">
+  <act contains="singleVersion">
+    <meta><references><TLCOrganization id="x"/></references></meta>
+    <body>
+      <chapter id="chapter-1">
+        <num>1</num>
+        <heading>Przepisy <b>ogólne</b></heading>
+        <article id="art-1">
+          <num>1.</num>
+          <paragraph id="art-1.ust-1">
+            <num>1.</num>
+            <content><p>Ustawa określa <i>zasady</i>.</p></content>
+          </paragraph>
+        </article>
+        <article id="art-2">
+          <num>2.</num>
+          <content><p>Ustawa zmienia:</p>
+            <quotedStructure>
+              <article id="art-99"><num>99.</num></article>
+            </quotedStructure>
+          </content>
+        </article>
+      </chapter>
+      <article id="art-3">
+        <num>3.</num>
+        <heading>Wejście w życie</heading>
+      </article>
+    </body>
+  </act>
+</akomaNtoso>
+"""
+
+
+class TOCBuilderPLTestCase(testcases.TestCase):
+
+    def setUp(self):
+        self.builder = TOCBuilderPL()
+
+    def test_toc_structure(self):
+        toc = self.builder.table_of_contents_for_xml(AKN)
+        assert_equal([e.id for e in toc], ["chapter-1", "art-3"])
+        chapter = toc[0]
+        assert_equal(chapter.heading, u"Przepisy ogólne")
+        assert_equal(chapter.subcomponent, u"chapter/1")
+        assert_equal([e.id for e in chapter.children], ["art-1", "art-2"])
+        assert_equal([e.id for e in chapter.children[0].children], ["art-1.ust-1"])
+
+    def test_toc_ignores_quoted_structures(self):
+        toc = self.builder.table_of_contents_for_xml(AKN)
+        assert_equal(toc[0].children[1].children, ())
+
+    def test_toc_titles_and_dicts(self):
+        toc = self.builder.table_of_contents_for_xml(AKN.encode('utf-8'))
+        assert_equal(toc[0].title, u"Rozdział  1 - Przepisy ogólne")
+        assert_equal(toc[1].title, u"Art. 3. - Wejście w życie")
+        info = toc[0].as_dict()
+        assert_equal(info['component'], u"main")
+        assert_equal(info['children'][0]['children'][0]['title'], u"1.")
+
+    def test_toc_page_top_level(self):
+        toc = self.builder.table_of_contents_for_xml(AKN)
+        page = self.builder.table_of_contents_page(toc)
+        assert_equal(page['total'], 2)
+        assert_equal([e['node_id'] for e in page['items']], ["chapter-1", "art-3"])
+        assert_equal(page['items'][0]['child_count'], 2)
+        assert_not_in('children', page['items'][0])
+
+    def test_toc_page_children_window(self):
+        toc = self.builder.table_of_contents_for_xml(AKN)
+        page = self.builder.table_of_contents_page(toc, "chapter-1", offset = 1, limit = 5)
+        assert_equal(page['total'], 2)
+        assert_equal([e['id'] for e in page['items']], ["art-2"])
+
+    def test_toc_page_positional_node_id(self):
+        toc = self.builder.table_of_contents_for_xml(AKN)
+        assert_equal(self.builder.find_toc_entry(toc, "0~0~0").id, "art-1.ust-1")
+        assert_equal(self.builder.find_toc_entry(toc, "chapter-1~1").id, "art-2")
+        assert_equal(self.builder.find_toc_entry(toc, "7"), None)
+        assert_raises(KeyError, self.builder.table_of_contents_page, toc, "nope")
+
+    def test_toc_page_positional_node_id_after_dotted_id(self):
+        toc = self.builder.table_of_contents_for_xml(u"""<akomaNtoso>
+  <act><body>
+    <article id="art-5">
+      <num>5.</num>
+      <section id="art-5.sec-1">
+        <num>1</num>
+        <paragraph><num>1.</num></paragraph>
+        <paragraph><num>2.</num></paragraph>
+      </section>
+    </article>
+  </body></act>
+</akomaNtoso>""")
+        page = self.builder.table_of_contents_page(toc, "art-5.sec-1")
+        assert_equal([e['node_id'] for e in page['items']],
+                     ["art-5.sec-1~0", "art-5.sec-1~1"])
+        assert_equal(self.builder.find_toc_entry(toc, "art-5.sec-1~1").num, u"2.")
+        assert_equal(self.builder.find_toc_entry(toc, "art-5~0~0").num, u"1.")
+        assert_equal(self.builder.find_toc_entry(toc, "art-5.sec-1~2"), None)
@@ -1,17 +1,67 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+from collections import namedtuple
+from io import BytesIO
+
+from lxml import etree
+
 from indigo.analysis.toc.base import TOCBuilderBase
-from indigo.plugins import plugins
+from indigo_pl import metrics
+
+
+class TOCEntryPL(namedtuple('TOCEntryPL', 'type id num heading component subcomponent children')):
+    """ A compact, immutable TOC entry built by TOCBuilderPL's streaming fast path.
+
+    It exposes the same attributes as Indigo's TOCElement that the API needs, but it doesn't
+    keep a reference to the underlying XML element. The title is only built when asked for.
+    """
+    __slots__ = ()
+
+    @property
+    def title(self):
+        return TOCBuilderPL.entry_title(self)
+
+    def as_dict(self, children=True):
+        info = {
+            'type': self.type,
+            'component': self.component,
+            'subcomponent': self.subcomponent,
+            'title': self.title,
+        }
+        if self.heading:
+            info['heading'] = self.heading
+        if self.num:
+            info['num'] = self.num
+        if self.id:
+            info['id'] = self.id
+        if self.children and children:
+            info['children'] = [c.as_dict() for c in self.children]
+        return info
 
 
-@plugins.register('toc')
 class TOCBuilderPL(TOCBuilderBase):
     locale = ('pl', 'pol', None)
 
     toc_elements = ["article", "chapter", "conclusions", "coverpage", "division", "paragraph", "preamble", "preface", "section", "subdivision"]
     toc_non_unique_components = ['chapter', 'subdivision', 'paragraph']
 
+    toc_deadends = ['meta', 'embeddedStructure', 'quotedStructure', 'subFlow']
+    """Elements whose content never contributes to the TOC (e.g. articles quoted by an amending
+    act), so the streaming parser ignores everything inside them."""
+
+    toc_top_level_elements = ['part', 'book', 'title', 'division', 'chapter']
+    """Elements which are expanded straight away by the paginated TOC. The children of any other
+    element have to be fetched on demand."""
+
+    toc_page_size = 100
+    """Default number of entries in one page of the paginated TOC."""
+
+    toc_path_separator = '~'
+    """Separator of the positions in the positional addresses of TOC entries (see toc_window),
+    which can't appear in AKN ids, unlike e.g. "." in "art-5.ust-1", nor in a URL path segment.
+    """
+
     titles = {
         'article': lambda t: 'Art. %s' % t.num + (' - %s' % t.heading if t.heading else ''),
         'chapter': lambda t: 'Rozdział  %s' % t.num + (' - %s' % t.heading if t.heading else ''),
@@ -19,3 +69,202 @@ class TOCBuilderPL(TOCBuilderBase):
         'paragraph': lambda t: t.num,
         'section': lambda t: '§ %s' % t.num,
     }
+
+    def table_of_contents_for_document(self, document):
+        """Override of table_of_contents_for_document from superclass, using the streaming
+        fast path instead of the generic traversal of the whole Act object.
+        """
+        with metrics.TOC_BUILD_DURATION.time():
+            return self.table_of_contents_for_xml(document.document_xml)
+
+    def table_of_contents_for_xml(self, xml):
+        """Build the TOC by walking the Akoma Ntoso XML once with an event-based parser.
+
+        Only TOC elements, their <num> and <heading> children, components and dead ends are
+        reported by the parser. Each element is cleared as soon as its entry is built, so memory
+        stays flat no matter how long the document is.
+
+        Args:
+            xml: String with the Akoma Ntoso XML of the document.
+
+        Returns:
+            list: List of TOCEntryPL tuples for the top level TOC elements.
+        """
+        if not isinstance(xml, bytes):
+            xml = xml.encode('utf-8')
+
+        toc_elements = set(self.toc_elements)
+        non_unique = set(self.toc_non_unique_components)
+        deadends = set(self.toc_deadends)
+        tags = ['{*}%s' % t for t in toc_elements | deadends | {'num', 'heading', 'doc'}]
+
+        toc = []
+        # Each open TOC element is a list: [element, type, id, num, heading, children].
+        stack = []
+        components = ['main']
+        deadend_depth = 0
+
+        for event, elem in etree.iterparse(BytesIO(xml), events=('start', 'end'), tag=tags,
+                                           remove_comments=True):
+            tag = elem.tag.rpartition('}')[2]
+
+            if tag in deadends:
+                deadend_depth += 1 if event == 'start' else -1
+                continue
+            if deadend_depth:
+                continue
+
+            if event == 'start':
+                if tag in toc_elements:
+                    stack.append([elem, tag, elem.get('id'), None, None, []])
+                elif tag == 'doc':
+                    components.append(elem.get('name') or 'main')
+                continue
+
+            if tag == 'doc':
+                components.pop()
+            elif tag == 'num' or tag == 'heading':
+                if stack and elem.getparent() is stack[-1][0]:
+                    if tag == 'num':
+                        stack[-1][3] = elem.text
+                    else:
+                        stack[-1][4] = ''.join(elem.itertext())
+            elif tag in toc_elements:
+                _, type_, id_, num, heading, children = stack.pop()
+                subcomponent = None
+                if type_ in non_unique or not id_:
+                    subcomponent = '%s/%s' % (type_, num.strip('.')) if num else type_
+                entry = TOCEntryPL(type_, id_, num, heading, components[-1], subcomponent,
+                                   tuple(children))
+                (stack[-1][5] if stack else toc).append(entry)
+
+                # We're done with this element and everything before it.
+                elem.clear()
+                parent = elem.getparent()
+                if parent is not None:
+                    while elem.getprevious() is not None:
+                        del parent[0]
+
+        return toc
+
+    def table_of_contents_page(self, toc, node_id=None, offset=0, limit=None):
+        """Returns one window of the TOC, for editors of huge documents which can't afford to
+        render the whole TOC at once.
+
+        Without node_id, the window is taken from the top level entries. Otherwise, it's taken
+        from the children of the entry with that id (see find_toc_entry). Entries of types in
+        toc_top_level_elements are expanded as long as all their children are of such types too;
+        for any other entry only the number of its children is given, so they can be fetched
+        later.
+
+        Args:
+            toc: List of TOCEntryPL tuples, as built by table_of_contents_for_xml.
+            node_id: Id of the entry whose children to return, or None for the top level.
+            offset: Index of the first entry in the window.
+            limit: Maximum number of entries in the window, toc_page_size by default.
+
+        Returns:
+            dict: The window, ready to be serialized to JSON.
+        """
+        if node_id is None:
+            entries = toc
+        else:
+            entry = self.find_toc_entry(toc, node_id)
+            if entry is None:
+                raise KeyError(node_id)
+            entries = entry.children
+        limit = limit or self.toc_page_size
+        return {
+            'id': node_id,
+            'offset': offset,
+            'limit': limit,
+            'total': len(entries),
+            'items': [self.lazy_toc_entry_as_dict(e, path)
+                      for path, e in self.toc_window(entries, node_id, offset, limit)],
+        }
+
+    def toc_window(self, entries, node_id, offset, limit):
+        """Yields (path, entry) pairs for the entries in the given window. The path is the
+        positional address of the entry, used as its id when it doesn't have one.
+        """
+        prefix = '' if node_id is None else node_id + self.toc_path_separator
+        for i in xrange(offset, min(offset + limit, len(entries))):
+            yield prefix + str(i), entries[i]
+
+    def lazy_toc_entry_as_dict(self, entry, path):
+        """Returns the dict for a single entry of the paginated TOC.
+
+        Args:
+            entry: The TOCEntryPL to describe.
+            path: The positional address of the entry (see toc_window).
+
+        Returns:
+            dict: The entry, either with its children expanded or with their count only.
+        """
+        info = entry.as_dict(children=False)
+        info['node_id'] = entry.id or path
+        info['child_count'] = len(entry.children)
+        top_level = self.toc_top_level_elements
+        if (entry.children and entry.type in top_level
+                and all(c.type in top_level for c in entry.children)):
+            info['children'] = [
+                self.lazy_toc_entry_as_dict(c, '%s%s%d' % (info['node_id'],
+                                                           self.toc_path_separator, i))
+                for i, c in enumerate(entry.children)]
+        return info
+
+    def find_toc_entry(self, toc, node_id):
+        """Find the TOC entry for the given node id. This is either the AKN id of the element,
+        or, for elements without one, the positional address handed out by toc_window (e.g.
+        "3~0~12"), which may also start with the id of an ancestor, e.g. "art-5.ust-1~2".
+
+        Args:
+            toc: List of TOCEntryPL tuples.
+            node_id: The node id to look for.
+
+        Returns:
+            TOCEntryPL|None: The entry, or None if there's no such entry.
+        """
+        stack = list(reversed(toc))
+        while stack:
+            entry = stack.pop()
+            if entry.id == node_id:
+                return entry
+            stack.extend(reversed(entry.children))
+
+        # Not an AKN id, so try it as a positional address.
+        head, _, rest = node_id.partition(self.toc_path_separator)
+        entries = toc
+        if not head.isdigit():
+            entry = self.find_toc_entry(toc, head) if rest else None
+            if entry is None:
+                return None
+            entries = entry.children
+            head, _, rest = rest.partition(self.toc_path_separator)
+        while True:
+            if not head.isdigit() or int(head) >= len(entries):
+                return None
+            entry = entries[int(head)]
+            if not rest:
+                return entry
+            entries = entry.children
+            head, _, rest = rest.partition(self.toc_path_separator)
+
+    @classmethod
+    def entry_title(cls, entry):
+        """Returns the friendly title for a TOC entry built by the streaming fast path.
+
+        Args:
+            entry: The TOCEntryPL to build the title for.
+
+        Returns:
+            str: The title.
+        """
+        if entry.type in cls.titles:
+            return cls.titles[entry.type](entry)
+        title = entry.type.capitalize()
+        if entry.num:
+            title += ' %s' % entry.num
+        if entry.heading:
+            title += ' - %s' % entry.heading
+        return title
@@ -0,0 +1,17 @@
+from django.conf.urls import include, url
+
+from indigo_pl import views
+
+urlpatterns = [
+    url(r'^api/documents/(?P<document_id>[0-9]+)/toc/pl/?$',
+        views.TableOfContentsPLView.as_view(), name='document-toc-pl'),
+    url(r'^api/documents/(?P<document_id>[0-9]+)/toc/pl/(?P<node_id>[^/]+)/?$',
+        views.TableOfContentsPLView.as_view(), name='document-toc-pl-node'),
+    url(r'^api/documents/(?P<document_id>[0-9]+)/diff/pl/(?P<base_id>[0-9]+)/?$',
+        views.DocumentDiffPLView.as_view(), name='document-diff-pl'),
+    url(r'^api/search/pl/?$', views.SearchPLView.as_view(), name='search-pl'),
+    url(r'^api/preview/pl/?$', views.PreviewPLView.as_view(), name='preview-pl'),
+    url(r'^metrics$', views.MetricsPLView.as_view(), name='metrics-pl'),
+
+    url(r'', include('indigo.urls')),
+]
@@ -0,0 +1,166 @@
+import tempfile
+from collections import OrderedDict
+
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.views.generic import View
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from indigo_api.models import Document
+from indigo_pl import metrics, search
+from indigo_pl.diff import diff_units, unit_fingerprints
+from indigo_pl.plugins import LazyImporterPL, LazyTOCBuilderPL
+from indigo_pl.preview import iter_preview_events
+
+
+class DocumentCache(object):
+    """ Keeps something computed from each of the most recently requested documents in memory
+    between requests, keyed by (document id, last update time), so that edits are picked up.
+    """
+
+    def __init__(self, size):
+        """
+        Args:
+            size: Number of documents to keep.
+        """
+        self.size = size
+        self.entries = OrderedDict()
+
+    def get(self, document, compute):
+        """Returns the cached value for the document, or compute(document) if there's none.
+
+        Args:
+            document: The Document.
+            compute: Function computing the value from the document.
+        """
+        key = (document.pk, document.updated_at)
+        value = self.entries.pop(key, None)
+        if value is None:
+            value = compute(document)
+        self.entries[key] = value
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return value
+
+
+class TableOfContentsPLView(APIView):
+    """ Paginated, lazily expanded TOC of a document.
+
+    GET /api/documents/<id>/toc/pl returns the top levels of the TOC, and
+    GET /api/documents/<id>/toc/pl/<node_id> returns the children of a single entry.
+    Both accept "offset" and "limit" query parameters to page through long lists of entries.
+    """
+    queryset = Document.objects.undeleted()
+
+    MAX_LIMIT = 500
+    """Maximum number of entries returned at once."""
+
+    cache = DocumentCache(8)
+    """TOCs of recently requested documents."""
+
+    def get(self, request, document_id, node_id=None):
+        document = get_object_or_404(self.queryset, pk=document_id)
+        builder = LazyTOCBuilderPL()
+        try:
+            offset = max(int(request.query_params.get('offset', 0)), 0)
+            limit = min(int(request.query_params.get('limit', builder.toc_page_size)),
+                        self.MAX_LIMIT)
+        except ValueError:
+            return Response({'detail': 'Invalid offset or limit.'}, status=400)
+
+        toc = self.get_toc(builder, document)
+        try:
+            return Response(builder.table_of_contents_page(toc, node_id, offset, limit))
+        except KeyError:
+            raise Http404()
+
+    def get_toc(self, builder, document):
+        return self.cache.get(document, builder.table_of_contents_for_document)
+
+
+class DocumentDiffPLView(APIView):
+    """ Structural diff between two versions of an act.
+
+    GET /api/documents/<id>/diff/pl/<base_id> returns the units added, removed, changed (with
+    word level diffs) and moved in document <id> compared to document <base_id>.
+    """
+    queryset = Document.objects.undeleted()
+
+    cache = DocumentCache(16)
+    """Unit fingerprints of recently compared documents."""
+
+    def get(self, request, document_id, base_id):
+        document = get_object_or_404(self.queryset, pk=document_id)
+        base = get_object_or_404(self.queryset, pk=base_id)
+        diff = diff_units(self.get_units(base), self.get_units(document))
+        diff['document_id'] = document.pk
+        diff['base_id'] = base.pk
+        return Response(diff)
+
+    def get_units(self, document):
+        return self.cache.get(document, lambda document: unit_fingerprints(document.document_xml))
+
+
+class SearchPLView(APIView):
+    """ Full-text search across the units of all documents.
+
+    GET /api/search/pl?q=<query> returns the units with all the words of the query, or with
+    the phrase if it's in double quotes. Accepts a "limit" query parameter.
+    """
+    MAX_LIMIT = 500
+    """Maximum number of units returned at once."""
+
+    def get(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'detail': 'Missing query.'}, status=400)
+        try:
+            limit = min(int(request.query_params.get('limit', 50)), self.MAX_LIMIT)
+        except ValueError:
+            return Response({'detail': 'Invalid limit.'}, status=400)
+
+        index = search.get_index()
+        try:
+            results = index.search(query, limit)
+        finally:
+            index.close()
+        return Response({'q': query, 'results': results})
+
+
+class PreviewPLView(APIView):
+    """ Progressive preview of the import of a PDF.
+
+    POST /api/preview/pl with the PDF in "file" streams the plain text of the act as server-sent
+    events, as the pages go through the importer, with the number of pages done so far (see
+    indigo_pl.preview). Closing the connection cancels the import.
+    """
+    # Runs pdftohtml on the upload, so only for editors, like Indigo's import endpoints.
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'detail': 'Missing file.'}, status=400)
+        f = tempfile.NamedTemporaryFile(suffix='.pdf')
+        for chunk in upload.chunks():
+            f.write(chunk)
+        f.flush()
+        response = StreamingHttpResponse(iter_preview_events(LazyImporterPL(), f),
+                                         content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Stops nginx from buffering the events.
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class MetricsPLView(View):
+    """ Metrics of all the processes of the app, for Prometheus.
+
+    GET /metrics returns the counters and histograms of indigo_pl.metrics in the Prometheus text
+    format.
+    """
+
+    def get(self, request):
+        return HttpResponse(metrics.exposition(), content_type='text/plain; version=0.0.4')